@@ -0,0 +1,204 @@
+"""
+Throughput of the hot catalog reads served three ways, at high concurrency:
+
+  wsgi        sync viewsets through Django's WSGI handler, one thread per client
+  asgi-sync   sync viewsets through the ASGI handler (ASYNC_CATALOG_READS=0)
+  asgi-async  async-native handlers through the ASGI handler (ASYNC_CATALOG_READS=1)
+
+The handlers are driven in-process, without a server or sockets in front,
+so the numbers isolate the Django/DRF request path. Each mode runs in its
+own process against a fresh in-memory test database seeded with the same
+catalog. The response cache is off unless --cache is given.
+
+    python benchmarks/async_reads.py --concurrency 64 --requests 4000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+MODES = ("wsgi", "asgi-sync", "asgi-async")
+
+
+def setup_django(mode, cache):
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ecommerceApiproject.settings")
+    os.environ["ASYNC_CATALOG_READS"] = "1" if mode == "asgi-async" else "0"
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.DEBUG = False  # no query log
+    settings.ALLOWED_HOSTS = ["*"]
+    settings.CATALOG_RESPONSE_CACHE_ENABLED = cache
+
+
+def seed(products, categories):
+    from django.db import connection
+    from products.models import Cart, CartItem, Category, Product
+
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    cats = [Category.objects.create(name=f"Category {i}") for i in range(categories)]
+    Product.objects.bulk_create([
+        Product(name=f"Product {i}", slug=f"product-{i}", price=i % 100 + 1, category=cats[i % categories])
+        for i in range(products)
+    ])
+    cart = Cart.objects.create()
+    for product in Product.objects.all()[:5]:
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+    return [
+        "/api/products/",
+        "/api/products/?page=2",
+        "/api/products/product-1/",
+        "/api/categories/",
+        f"/api/carts/{cart.cart_code}/",
+    ]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(mode, paths, concurrency, latencies, elapsed):
+    return {
+        "mode": mode,
+        "paths": paths,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2),
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+        },
+    }
+
+
+def run_wsgi(paths, concurrency, total):
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    counter = iter(range(total))
+    lock = threading.Lock()
+    latencies = []
+
+    def environ(path):
+        path, _, query = path.partition("?")
+        return {
+            "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query,
+            "SERVER_NAME": "bench", "SERVER_PORT": "80", "HTTP_ACCEPT": "application/json",
+            "wsgi.url_scheme": "http", "wsgi.input": BytesIO(), "wsgi.errors": sys.stderr,
+        }
+
+    def client():
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            start = time.perf_counter()
+            statuses = []
+            body = application(environ(paths[n % len(paths)]), lambda status, headers: statuses.append(status))
+            b"".join(body)
+            latencies.append(time.perf_counter() - start)
+            assert statuses[0].startswith("200"), statuses[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return latencies, time.perf_counter() - start
+
+
+def run_asgi(paths, concurrency, total):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    counter = iter(range(total))
+    latencies = []
+
+    async def request(path):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "headers": [(b"host", b"bench"), (b"accept", b"application/json")],
+            "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        }
+        messages = []
+        body_sent = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # The client never hangs up; Django cancels this wait once it has responded
+            await disconnected.wait()
+
+        async def send(message):
+            messages.append(message)
+
+        await application(scope, receive, send)
+        assert messages[0]["status"] == 200, messages[0]["status"]
+
+    async def client():
+        for n in counter:
+            start = time.perf_counter()
+            await request(paths[n % len(paths)])
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return latencies, time.perf_counter() - start
+
+
+def run_mode(args):
+    setup_django(args.mode, args.cache)
+    paths = seed(args.products, args.categories)
+    runner = run_wsgi if args.mode == "wsgi" else run_asgi
+    runner(paths, args.concurrency, min(args.requests, 200))  # warm up
+    latencies, elapsed = runner(paths, args.concurrency, args.requests)
+    print(json.dumps(report(args.mode, paths, args.concurrency, latencies, elapsed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=MODES, help="Run one mode in this process (default: all, one process each)")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--cache", action="store_true", help="Leave the catalog response cache on")
+    args = parser.parse_args()
+    if args.mode:
+        run_mode(args)
+        return
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, __file__, "--mode", mode] + [
+            f"--{name}={getattr(args, name)}" for name in ("concurrency", "requests", "products", "categories")
+        ] + (["--cache"] if args.cache else [])
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Load test of the product, category and cart endpoints over a seeded catalog.
+
+The catalog comes from products.seeding (the seed_catalog command), so a
+given --size and --seed always serve the same rows. Requests go through
+Django's test Client in-process, one client per thread, at --concurrency;
+the same paths are requested in the same order on every run. Query counts
+come from the Server-Timing header of the request metrics middleware.
+
+Results are printed (or written to --output) as JSON: throughput, latency
+percentiles and queries per request, overall and per endpoint. With
+--compare, a previous result is the baseline: more queries per request, or a
+p95 latency more than --tolerance above it, exits non-zero.
+
+    python benchmarks/load.py --size 100k --concurrency 16 --requests 5000
+    python benchmarks/load.py --size 1m --database /tmp/catalog-1m.sqlite3 --compare before.json
+
+Without --database the catalog is seeded into an in-memory database on
+every run; with it, an empty file is seeded once and reused afterwards.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+ENDPOINTS = (
+    "product-list", "product-filter", "product-detail",
+    "category-list", "category-detail",
+    "cart-detail",
+)
+# Distinct paths generated per endpoint; requests cycle through them
+PATHS_PER_ENDPOINT = 500
+SIZE_NAMES = ("10k", "100k", "1m")  # products.seeding.SIZES, importable only after setup
+QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def setup_django(database, cache):
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ecommerceApiproject.settings")
+    os.environ["REQUEST_METRICS"] = "1"  # query counts come from Server-Timing
+    os.environ["ASYNC_CATALOG_READS"] = "0"
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.DEBUG = False  # no query log
+    settings.ALLOWED_HOSTS = ["*"]
+    settings.CATALOG_RESPONSE_CACHE_ENABLED = cache
+    if database:
+        # Before the first connection is opened
+        settings.DATABASES["default"]["NAME"] = database
+
+
+def prepare_catalog(args, counts):
+    from django.core.management import call_command
+    from django.db import connection
+    from products.models import Cart, Category, Product
+    from products.seeding import seed_catalog
+
+    if args.database:
+        call_command("migrate", verbosity=0)
+    else:
+        connection.creation.create_test_db(verbosity=0, serialize=False)
+    present = {
+        "products": Product.objects.count(), "categories": Category.objects.count(), "carts": Cart.objects.count(),
+    }
+    if not any(present.values()):
+        start = time.perf_counter()
+        seed_catalog(seed=args.seed, **counts)
+        print(f"seeded {counts} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    elif present != counts:
+        sys.exit(f"{args.database} holds a different catalog {present}; use another --database path")
+
+
+def build_paths(endpoints, seed):
+    """{endpoint: [path, ...]}, the same for a given catalog and seed."""
+    from products.models import Cart, Category, Product
+
+    rng = random.Random(seed)
+
+    def sample(model, column):
+        # Random rows by pk, without ORDER BY RANDOM() over the whole table
+        pks = list(model.objects.order_by("pk").values_list("pk", flat=True))
+        chosen = sorted(rng.sample(pks, min(PATHS_PER_ENDPOINT, len(pks))))
+        values = list(model.objects.filter(pk__in=chosen).order_by("pk").values_list(column, flat=True))
+        rng.shuffle(values)
+        return values
+
+    category_slugs = sample(Category, "slug")
+    product_pages = max(1, Product.objects.count() // 10)
+    category_pages = max(1, Category.objects.count() // 10)
+    makers = {
+        # Mostly early pages, as real traffic; deep pages show OFFSET costs
+        "product-list": lambda: [
+            f"/api/products/?page={min(product_pages, int(rng.paretovariate(1.0)))}" for _ in range(PATHS_PER_ENDPOINT)
+        ],
+        "product-filter": lambda: [
+            f"/api/products/?category={slug}&ordering=-rating&min_price={rng.randint(1, 200)}"
+            for slug in (rng.choice(category_slugs) for _ in range(PATHS_PER_ENDPOINT))
+        ],
+        "product-detail": lambda: [f"/api/products/{slug}/" for slug in sample(Product, "slug")],
+        "category-list": lambda: [
+            f"/api/categories/?page={rng.randint(1, category_pages)}" for _ in range(PATHS_PER_ENDPOINT)
+        ],
+        "category-detail": lambda: [f"/api/categories/{slug}/" for slug in category_slugs],
+        "cart-detail": lambda: [f"/api/carts/{code}/" for code in sample(Cart, "cart_code")],
+    }
+    return {endpoint: makers[endpoint]() for endpoint in endpoints}
+
+
+def schedule(paths, total):
+    """The (endpoint, path) of each request: endpoints round-robin, paths cycling."""
+    endpoints = list(paths)
+    requests = []
+    for n in range(total):
+        endpoint = endpoints[n % len(endpoints)]
+        cycle = paths[endpoint]
+        requests.append((endpoint, cycle[n // len(endpoints) % len(cycle)]))
+    return requests
+
+
+def run(requests, concurrency):
+    from django.test import Client
+
+    counter = iter(range(len(requests)))
+    lock = threading.Lock()
+    results = []  # (endpoint, seconds, queries)
+
+    def client():
+        http = Client(HTTP_ACCEPT="application/json")
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            endpoint, path = requests[n]
+            start = time.perf_counter()
+            response = http.get(path)
+            elapsed = time.perf_counter() - start
+            if response.status_code != 200:
+                raise AssertionError(f"{path}: HTTP {response.status_code}")
+            match = QUERIES_RE.search(response.get("Server-Timing", ""))
+            results.append((endpoint, elapsed, int(match.group(1)) if match else None))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return results, time.perf_counter() - start
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(results, elapsed):
+    latencies = [seconds for _endpoint, seconds, _queries in results]
+    queries = [count for _endpoint, _seconds, count in results if count is not None]
+    return {
+        "requests": len(results),
+        "throughput_rps": round(len(results) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2),
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "queries_per_request": {
+            "mean": round(statistics.fmean(queries), 2) if queries else None,
+            "max": max(queries) if queries else None,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(result, baseline, tolerance):
+    found = []
+    for endpoint, current in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if before is None:
+            continue
+        queries, queries_before = current["queries_per_request"]["mean"], before["queries_per_request"]["mean"]
+        if queries is not None and queries_before is not None and queries > queries_before:
+            found.append(f"{endpoint}: {queries_before} -> {queries} queries per request")
+        p95, p95_before = current["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        if p95 > p95_before * (1 + tolerance):
+            found.append(f"{endpoint}: p95 {p95_before}ms -> {p95}ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=SIZE_NAMES, default="10k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="SQLite file to seed once and reuse (default: in-memory, seeded per run)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma-separated subset of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=300)
+    parser.add_argument("--cache", action="store_true", help="Leave the catalog response cache on")
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout")
+    parser.add_argument("--compare", help="Baseline result JSON; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 latency increase over the baseline")
+    args = parser.parse_args()
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown or not endpoints:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown)) or '(none given)'}")
+
+    setup_django(args.database, args.cache)
+    from products.seeding import SIZES
+
+    counts = SIZES[args.size]
+    prepare_catalog(args, counts)
+    paths = build_paths(endpoints, args.seed)
+    run(schedule(paths, args.warmup), args.concurrency)
+    results, elapsed = run(schedule(paths, args.requests), args.concurrency)
+
+    by_endpoint = {}
+    for entry in results:
+        by_endpoint.setdefault(entry[0], []).append(entry)
+    result = {
+        "commit": git_commit(),
+        "size": args.size,
+        "catalog": counts,
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "overall": summarize(results, elapsed),
+        # Endpoint throughput is its share of the mixed run
+        "endpoints": {endpoint: summarize(by_endpoint[endpoint], elapsed) for endpoint in endpoints},
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        found = regressions(result, json.loads(Path(args.compare).read_text()), args.tolerance)
+        for line in found:
+            print(f"regression: {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
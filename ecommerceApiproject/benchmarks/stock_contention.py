@@ -0,0 +1,161 @@
+"""
+Contention benchmark for stock reservations: hundreds of clients adding the
+same product to their carts at once.
+
+Each client thread has its own cart and posts `add` operations of one unit
+of a single stock-tracked product to /api/carts/<code>/items/batch/ through
+Django's test Client, all released together by a barrier. With less stock
+than --clients x --adds, the product sells out mid-run and the rest of the
+adds get 409s.
+
+The database is a fresh SQLite file in the production profile (WAL,
+IMMEDIATE transactions), as writes from many threads need a real file. The
+result, one per --shards value, is JSON: throughput, latency percentiles,
+accepted/rejected/error counts and a consistency check that the reserved
+count equals both the accepted adds and the units in carts, within stock.
+
+    python benchmarks/stock_contention.py --clients 300 --adds 5 --stock 1000 --shards 1,8
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(database, busy_timeout):
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ecommerceApiproject.settings")
+    os.environ["DATABASE_PROFILE"] = "production"
+    os.environ["DATABASE_PATH"] = database
+    os.environ.pop("DATABASE_REPLICA_PATH", None)
+    os.environ["REQUEST_METRICS"] = "0"
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ["*"]
+    # Before the first connection is opened
+    settings.DATABASES["default"]["OPTIONS"]["timeout"] = busy_timeout
+
+
+def prepare(clients, stock, shards):
+    from products.carts import allocate_carts
+    from products.inventory import set_stock
+    from products.models import Cart, CartItem, Product
+
+    CartItem.objects.all().delete()
+    Cart.objects.all().delete()
+    product = Product.objects.get_or_create(slug="flash-sale", defaults={"name": "Flash sale", "price": "9.99"})[0]
+    set_stock(product, stock, shards=shards)
+    return product, [cart.cart_code for cart in allocate_carts(clients)]
+
+
+def run(product, codes, adds):
+    from django.db import connections
+    from django.test import Client
+
+    barrier = threading.Barrier(len(codes))
+    results = []  # (status, seconds)
+    lock = threading.Lock()
+    body = {"operations": [{"op": "add", "product_id": product.pk, "quantity": 1}]}
+
+    def client(code):
+        http = Client(HTTP_ACCEPT="application/json", raise_request_exception=False)
+        path = f"/api/carts/{code}/items/batch/"
+        own = []
+        barrier.wait()
+        for _ in range(adds):
+            start = time.perf_counter()
+            response = http.post(path, body, content_type="application/json")
+            own.append((response.status_code, time.perf_counter() - start))
+        with lock:
+            results.extend(own)
+        connections.close_all()
+
+    threads = [threading.Thread(target=client, args=(code,)) for code in codes]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(product, stock, shards, results, elapsed):
+    from django.db.models import Sum
+    from products.inventory import stock_levels
+    from products.models import CartItem
+
+    latencies = [seconds for _status, seconds in results]
+    accepted = sum(1 for status, _seconds in results if status == 200)
+    rejected = sum(1 for status, _seconds in results if status == 409)
+    levels = stock_levels(product)
+    in_carts = CartItem.objects.filter(product=product).aggregate(total=Sum("quantity"))["total"] or 0
+    return {
+        "shards": shards,
+        "stock": stock,
+        "requests": len(results),
+        "throughput_rps": round(len(results) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2),
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        },
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": len(results) - accepted - rejected,
+        "reserved": levels["reserved"],
+        "in_carts": in_carts,
+        "consistent": levels["reserved"] == accepted == in_carts and levels["reserved"] <= stock,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent clients, one cart each")
+    parser.add_argument("--adds", type=int, default=5, help="Adds per client")
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--shards", default="1", help="Comma-separated shard counts to run, e.g. 1,8")
+    parser.add_argument("--busy-timeout", type=float, default=60, help="Seconds a write waits for the database lock")
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout")
+    args = parser.parse_args()
+    shard_counts = [int(n) for n in args.shards.split(",") if n]
+    if args.clients < 1 or args.adds < 1 or args.stock < 0 or not shard_counts or min(shard_counts) < 1:
+        parser.error("--clients, --adds and --shards must be positive and --stock not negative")
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, "stock.sqlite3"), args.busy_timeout)
+        from django.core.management import call_command
+
+        call_command("migrate", verbosity=0)
+        results = []
+        for shards in shard_counts:
+            product, codes = prepare(args.clients, args.stock, shards)
+            samples, elapsed = run(product, codes, args.adds)
+            results.append(summarize(product, args.stock, shards, samples, elapsed))
+
+    output = json.dumps({"clients": args.clients, "adds_per_client": args.adds, "runs": results}, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    sys.exit(0 if all(result["consistent"] and not result["errors"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
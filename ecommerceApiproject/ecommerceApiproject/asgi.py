@@ -12,5 +12,17 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerceApiproject.settings')
+# Async-native handlers for the hot read routes; set to 0 to serve every
+# request through the sync viewsets
+os.environ.setdefault('ASYNC_CATALOG_READS', '1')
 
 application = get_asgi_application()
+
+# Serving processes only: not management commands, tests or the runserver
+# autoreloader's parent process
+from django.conf import settings  # noqa: E402
+
+if settings.CART_SWEEP_INTERVAL:
+    from products.carts import start_cart_sweeper
+
+    start_cart_sweeper(settings.CART_SWEEP_INTERVAL)
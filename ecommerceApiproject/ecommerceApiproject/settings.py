@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total covers the whole stack (products/metrics.py)
+    'products.metrics.RequestMetricsMiddleware',
+    # Reads in write requests go to the primary database (products/db_router.py)
+    'products.db_router.PrimaryForWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,10 +85,77 @@ WSGI_APPLICATION = 'ecommerceApiproject.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DATABASE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Production profile (DATABASE_PROFILE=production). WAL lets readers run
+# alongside the writer; synchronous=NORMAL is durable in WAL mode except
+# for the last commits on power loss. Connections are kept for
+# CONN_MAX_AGE seconds and checked before reuse.
+SQLITE_PRODUCTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA mmap_size=268435456;'  # 256 MiB
+    'PRAGMA cache_size=-65536;'  # 64 MiB
+    'PRAGMA temp_store=MEMORY;'
+)
+if os.environ.get('DATABASE_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # busy_timeout: seconds to wait for the write lock before "database is locked"
+            'timeout': 5,
+            # Take the write lock at BEGIN, so a transaction that reads then
+            # writes waits for it instead of failing on the upgrade
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': SQLITE_PRODUCTION_PRAGMAS,
+        },
+    })
+
+# Catalog reads go to this copy of the database when it is set
+# (products/db_router.py); `manage.py sync_replica` refreshes it locally.
+if os.environ.get('DATABASE_REPLICA_PATH'):
+    replica_options = dict(DATABASES['default'].get('OPTIONS', {}))
+    replica_options.pop('transaction_mode', None)
+    replica_options['init_command'] = replica_options.get('init_command', '') + 'PRAGMA query_only=ON;'
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DATABASE_REPLICA_PATH'],
+        'OPTIONS': replica_options,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['products.db_router.PrimaryReplicaRouter']
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# "catalog" holds rendered product/category responses (products/response_cache.py).
+# It is an in-process LRU by default; set CATALOG_CACHE_DIR to share one on disk.
+# Either way the version that invalidates it is kept in the database.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog-responses',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+if os.environ.get('CATALOG_CACHE_DIR'):
+    CACHES['catalog'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['CATALOG_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+
+CATALOG_RESPONSE_CACHE_ENABLED = True
+CATALOG_RESPONSE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,9 +216,39 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Carts whose contents haven't changed for this long are deleted by
+# purge_stale_carts, or by a sweeper thread in each server process (started
+# by wsgi.py / asgi.py) every CART_SWEEP_INTERVAL seconds when that is set
+# (off by default; prefer a scheduled command).
+CART_TTL_DAYS = 30
+CART_SWEEP_INTERVAL = int(os.environ.get('CART_SWEEP_INTERVAL', '0')) or None
+
+# Product change feed (products/changes.py): rows stamped in the last
+# CHANGE_FEED_SETTLE_SECONDS wait for transactions that may still commit with
+# earlier stamps. Tombstones of deleted products, and so cursors, last
+# CHANGE_FEED_RETENTION_DAYS (purge_tombstones).
+CHANGE_FEED_SETTLE_SECONDS = 2
+CHANGE_FEED_RETENTION_DAYS = 30
+
+# Serve the hot catalog reads from async-native views (products/async_views.py).
+# asgi.py turns this on; under WSGI the sync viewsets are faster.
+ASYNC_CATALOG_READS = os.environ.get('ASYNC_CATALOG_READS', '0') == '1'
+
+# Per-request query count and db/serialize/render timings as Server-Timing
+# headers, with rolling per-route percentiles (the last REQUEST_METRICS_WINDOW
+# requests) at /api/_metrics for staff. REQUEST_METRICS=0 removes the
+# middleware and its hooks.
+REQUEST_METRICS_ENABLED = os.environ.get('REQUEST_METRICS', '1') == '1'
+REQUEST_METRICS_WINDOW = 1000
+
 # drf-spectacular settings
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Ecommerce API',
     'DESCRIPTION': 'OpenAPI schema for the Ecommerce API',
     'VERSION': '1.0.0',
+    # Two "op" enums: pinned so neither is renamed after its serializer
+    'ENUM_NAME_OVERRIDES': {
+        'OpEnum': 'products.carts.OPERATIONS',
+        'ProductChangeOpEnum': 'products.changes.CHANGE_OPS',
+    },
 }
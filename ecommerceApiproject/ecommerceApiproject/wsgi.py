@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerceApiproject.settings')
 
 application = get_wsgi_application()
+
+# Serving processes only: not management commands, tests or the runserver
+# autoreloader's parent process
+from django.conf import settings  # noqa: E402
+
+if settings.CART_SWEEP_INTERVAL:
+    from products.carts import start_cart_sweeper
+
+    start_cart_sweeper(settings.CART_SWEEP_INTERVAL)
@@ -5,3 +5,7 @@ class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
     verbose_name = 'Products'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import signals  # noqa: F401
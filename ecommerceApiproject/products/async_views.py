@@ -0,0 +1,223 @@
+import math
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import category_cache, response_cache
+from .carts import cart_queryset, cart_validators
+from .category_cache import aget_category_block
+from .conditional import not_modified, request_validators, set_validators
+from .db_router import use_primary
+from .fieldsets import FIELDS_PARAM, OMIT_PARAM
+from .metrics import timed
+from .models import Cart, Category, Product
+from .rows import RowSerializer, row_queryset
+from .serializers import CartSerializer, CategoryListSerializer, ProductDetailSerializer, ProductListSerializer
+
+
+"""
+Async-native handlers for the hottest reads under ASGI: product list and
+detail, category list and cart retrieve.
+
+Under ASGI a sync DRF view runs in a thread via sync_to_async. These
+handlers run on the event loop instead, with the async ORM and cache APIs,
+and produce the same bodies, ETags and cache entries as the viewsets, so
+the two paths can serve the same clients and share the response cache.
+They cover the plain JSON GET shape of each route; anything else (writes,
+filters, cursors, facets, sparse fieldsets, the browsable API, 404s) goes
+to the sync viewset in a single thread hop.
+
+async_read_urls() swaps the handlers into the router's URL patterns; it is
+enabled by the ASYNC_CATALOG_READS setting, which asgi.py turns on. Under
+WSGI the async views would each need their own event loop, so the sync
+patterns stay.
+
+Note that Django's async ORM and cache methods on SQLite and LocMemCache are
+still sync_to_async wrappers underneath, so each query is its own hop; see
+benchmarks/async_reads.py for what that costs.
+"""
+
+PAGE_QUERY_PARAM = "page"
+_renderer = JSONRenderer()
+
+
+def _accepts_json(request):
+    # Browsers ask for text/html and get the browsable API from the viewset
+    accept = request.headers.get("Accept", "*/*")
+    return "text/html" not in accept and ("application/json" in accept or "*/*" in accept)
+
+
+def _page_number(request):
+    """The requested page, or None when the request has other parameters or a bad page."""
+    if set(request.GET) - {PAGE_QUERY_PARAM}:
+        return None
+    page = request.GET.get(PAGE_QUERY_PARAM, "1")
+    return int(page) if page.isascii() and page.isdigit() and int(page) > 0 else None
+
+
+def _json_response(request, data, etag, last_modified):
+    with timed("render"):
+        content = _renderer.render(data)
+    response = HttpResponse(content, content_type=_renderer.media_type)
+    patch_vary_headers(response, ("Accept",))
+    return set_validators(request, response, etag, last_modified)
+
+
+async def _cached(request, namespace, action, handler):
+    """Async counterpart of CachedResponseMixin, sharing its keys and entries."""
+    version = await response_cache.acurrent_version()
+    # Bodies nest category blocks; they must be this version's
+    category_cache.sync(version)
+    if not response_cache.enabled():
+        return await handler()
+    cache = caches[response_cache.CACHE_ALIAS]
+    key = response_cache.cache_key(version, namespace, action, request)
+    entry = await cache.aget(key)
+    response_cache.stats.record(entry is not None)
+    if entry is not None:
+        return response_cache.entry_response(entry, request)
+    # From the primary, like the sync misses
+    with use_primary():
+        response = await handler()
+    if response is not None and response.status_code == 200:
+        await cache.aset(key, response_cache.make_entry(response), timeout=response_cache.timeout())
+        response["X-Cache"] = "MISS"
+    return response
+
+
+async def _list(request, queryset, serializer_class, page_size):
+    """A page-number page of `queryset` shaped like DRF's PageNumberPagination, rendered from rows."""
+    page = _page_number(request)
+    if page is None:
+        return None
+    stats = await queryset.aaggregate(last=Max("updated_at"), count=Count("id"))
+    etag, last_modified = request_validators(request, "json", (stats["last"], stats["count"]), stats["last"])
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    count = stats["count"]
+    pages = max(math.ceil(count / page_size), 1)
+    if page > pages:
+        return None  # the viewset answers with its "Invalid page" 404
+    offset = (page - 1) * page_size
+    rows = [row async for row in row_queryset(queryset, serializer_class)[offset:offset + page_size]]
+    url = request.build_absolute_uri()
+    previous = None
+    if page == 2:
+        previous = remove_query_param(url, PAGE_QUERY_PARAM)
+    elif page > 2:
+        previous = replace_query_param(url, PAGE_QUERY_PARAM, page - 1)
+    data = {
+        "count": count,
+        "next": replace_query_param(url, PAGE_QUERY_PARAM, page + 1) if page < pages else None,
+        "previous": previous,
+        "results": RowSerializer(serializer_class, rows, context={"request": request}).data,
+    }
+    return _json_response(request, data, etag, last_modified)
+
+
+async def product_list(request):
+    async def handler():
+        return await _list(request, Product.objects.all(), ProductListSerializer, api_settings.PAGE_SIZE)
+
+    return await _cached(request, "product", "list", handler)
+
+
+async def product_detail(request, slug):
+    async def handler():
+        try:
+            product = await Product.objects.aget(slug=slug)
+        except Product.DoesNotExist:
+            return None
+        block = await aget_category_block(product.category_id)
+        etag, last_modified = request_validators(
+            request, "json", (product.pk, product.updated_at, block), product.updated_at
+        )
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        context = {"request": request, "category_block": block}
+        return _json_response(request, ProductDetailSerializer(product, context=context).data, etag, last_modified)
+
+    return await _cached(request, "product", "retrieve", handler)
+
+
+async def category_list(request):
+    async def handler():
+        return await _list(request, Category.objects.all(), CategoryListSerializer, api_settings.PAGE_SIZE)
+
+    return await _cached(request, "category", "list", handler)
+
+
+async def cart_detail(request, cart_code):
+    try:
+        # aget() runs the prefetch of items and products in the same hop
+        cart = await cart_queryset().aget(cart_code=cart_code)
+    except Cart.DoesNotExist:
+        return None
+    etag, last_modified = request_validators(request, "json", *cart_validators(cart))
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+    return _json_response(request, CartSerializer(cart, context={"request": request}).data, etag, last_modified)
+
+
+ASYNC_READ_HANDLERS = {
+    "product-list": product_list,
+    "product-detail": product_detail,
+    "category-list": category_list,
+    "cart-detail": cart_detail,
+}
+
+
+def async_read_view(handler, sync_view):
+    """An async view serving GETs with `handler` and everything else with `sync_view`."""
+
+    def call_sync(request, *args, **kwargs):
+        response = sync_view(request, *args, **kwargs)
+        # Render in the same thread hop rather than another one in the handler
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    call_sync = sync_to_async(call_sync)
+
+    async def view(request, *args, **kwargs):
+        response = None
+        if (
+            request.method == "GET"
+            and "format" not in kwargs
+            and "format" not in request.GET
+            and FIELDS_PARAM not in request.GET
+            and OMIT_PARAM not in request.GET
+            and _accepts_json(request)
+        ):
+            response = await handler(request, *args, **kwargs)
+        if response is None:
+            response = await call_sync(request, *args, **kwargs)
+        return response
+
+    # Keep cls/initkwargs/actions (routers, schema generation) and csrf_exempt
+    view.__dict__.update(sync_view.__dict__)
+    return view
+
+
+def async_read_urls(patterns):
+    """`patterns` (router URLs) with the async handlers swapped in by route name."""
+    result = []
+    for pattern in patterns:
+        handler = ASYNC_READ_HANDLERS.get(getattr(pattern, "name", None))
+        if handler is not None:
+            pattern = URLPattern(
+                pattern.pattern, async_read_view(handler, pattern.callback), pattern.default_args, pattern.name
+            )
+        result.append(pattern)
+    return result
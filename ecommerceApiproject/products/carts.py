@@ -0,0 +1,298 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CART_CODE_ATTEMPTS, CART_SUBTOTAL_DIGITS, Cart, CartItem, Product, Stock, generate_cart_code
+
+
+"""
+Cart write helpers.
+
+apply_cart_operations() folds a list of add/set/remove operations into one
+net change per product and writes them with a fixed number of statements:
+an upsert for sets, an in-place increment (plus an upsert for new rows) for
+adds, and a single DELETE for removals.
+
+Cart.subtotal / Cart.item_count (total quantity) are maintained
+incrementally by CartItem.save/delete, Cart.clear and apply_cart_operations.
+Writes that bypass those (queryset updates, price changes) are repaired by
+recompute_cart_totals().
+
+Item writes that change the cart's totals also bump Cart.updated_at (via
+Cart.adjust_totals or Cart.clear), so it marks the last change to the
+cart's contents; a write that leaves every quantity as it was doesn't
+touch it. purge_stale_carts() deletes carts unchanged for longer than
+CART_TTL_DAYS.
+
+Items of stock-tracked products hold their quantity as reserved stock
+(see inventory.py): every path above reserves or releases the change, and
+the holds expire with the cart.
+"""
+
+logger = logging.getLogger(__name__)
+
+OP_ADD = "add"
+OP_SET = "set"
+OP_REMOVE = "remove"
+OPERATIONS = (OP_ADD, OP_SET, OP_REMOVE)
+RECOMPUTE_BATCH_SIZE = 1000
+PURGE_BATCH_SIZE = 500
+ALLOCATE_BATCH_SIZE = 500
+
+
+def cart_queryset():
+    # Items and their products in one extra query (JOIN), not one per item
+    return Cart.objects.prefetch_related(
+        Prefetch("items", queryset=CartItem.objects.select_related("product"))
+    )
+
+
+def cart_validators(cart):
+    """Conditional GET validators for a cart fetched through cart_queryset() (no queries)."""
+    items = list(cart.items.all())
+    stamps = [cart.updated_at] + [i.updated_at for i in items] + [i.product.updated_at for i in items]
+    return (cart.pk, len(items), max(stamps)), max(stamps)
+
+
+def allocate_carts(count, batch_size=ALLOCATE_BATCH_SIZE):
+    """
+    Create `count` empty carts with one bulk INSERT per `batch_size` and
+    return them (with pks). Codes are distinct within a batch; a batch that
+    collides with an existing code is redrawn and inserted again.
+    """
+    carts = []
+    while len(carts) < count:
+        size = min(batch_size, count - len(carts))
+        for attempt in range(1, CART_CODE_ATTEMPTS + 1):
+            codes = set()
+            while len(codes) < size:
+                codes.add(generate_cart_code())
+            now = timezone.now()
+            try:
+                with transaction.atomic():
+                    carts.extend(Cart.objects.bulk_create(
+                        [Cart(cart_code=code, created_at=now, updated_at=now) for code in codes]
+                    ))
+                break
+            except IntegrityError:
+                codes_taken = Cart.objects.filter(cart_code__in=codes).exists()
+                if not codes_taken or attempt == CART_CODE_ATTEMPTS:
+                    raise
+    return carts
+
+
+def _coalesce(operations):
+    # Returns {product_id: (op, quantity)} with one net op per product
+    net = {}
+    for operation in operations:
+        product_id = operation["product_id"]
+        op = operation["op"]
+        quantity = operation.get("quantity", 1)
+        current = net.get(product_id)
+        if op == OP_REMOVE:
+            net[product_id] = (OP_REMOVE, 0)
+        elif op == OP_SET:
+            net[product_id] = (OP_SET, quantity) if quantity > 0 else (OP_REMOVE, 0)
+        elif current is None:
+            net[product_id] = (OP_ADD, quantity)
+        elif current[0] == OP_REMOVE:
+            net[product_id] = (OP_SET, quantity)
+        else:
+            net[product_id] = (current[0], current[1] + quantity)
+    return net
+
+
+def apply_cart_operations(cart, operations, prices=None, tracked=None):
+    """
+    Apply validated operations ({"op", "product_id", "quantity"}) to `cart`
+    atomically. `prices` ({product_id: price}) and `tracked` (ids of
+    stock-tracked products) are fetched when not supplied. Raises
+    InsufficientStock, changing nothing, when an increase can't be reserved.
+    """
+    net = _coalesce(operations)
+    sets = {pid: q for pid, (op, q) in net.items() if op == OP_SET}
+    adds = {pid: q for pid, (op, q) in net.items() if op == OP_ADD}
+    removes = [pid for pid, (op, _q) in net.items() if op == OP_REMOVE]
+    now = timezone.now()
+
+    with transaction.atomic():
+        current = dict(
+            CartItem.objects.filter(cart=cart, product_id__in=list(net))
+            .order_by().values_list("product_id", "quantity")
+        )
+        if prices is None or tracked is None:
+            rows = Product.objects.filter(pk__in=list(net)).order_by().values_list("pk", "price", "stock_tracked")
+            prices = {pid: price for pid, price, _tracked in rows}
+            tracked = {pid for pid, _price, is_tracked in rows if is_tracked}
+        quantity_delta = 0
+        amount_delta = Decimal(0)
+        stock_deltas = {}
+        for pid, (op, q) in net.items():
+            old = current.get(pid, 0)
+            new = old + q if op == OP_ADD else q
+            quantity_delta += new - old
+            amount_delta += (new - old) * prices[pid]
+            if pid in tracked and new != old:
+                stock_deltas[pid] = new - old
+
+        if removes:
+            CartItem.objects.filter(cart=cart, product_id__in=removes).delete()
+        # Increment existing rows in place; new rows go through the upsert
+        incremented = [pid for pid in adds if pid in current]
+        if incremented:
+            CartItem.objects.filter(cart=cart, product_id__in=incremented).update(
+                quantity=F("quantity") + Case(
+                    *[When(product_id=pid, then=Value(adds[pid])) for pid in incremented]
+                ),
+                updated_at=now,
+            )
+        sets.update((pid, q) for pid, q in adds.items() if pid not in current)
+        if sets:
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=pid, quantity=q, created_at=now, updated_at=now)
+                 for pid, q in sets.items()],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity", "updated_at"],
+            )
+        if quantity_delta or amount_delta:
+            Cart.adjust_totals(cart.pk, quantity_delta, amount_delta)
+        # Last (see CartItem.save), in product order so concurrent batches
+        # lock stock rows in the same order
+        for pid in sorted(stock_deltas):
+            if stock_deltas[pid] > 0:
+                Stock.reserve(pid, stock_deltas[pid])
+            else:
+                Stock.release(pid, -stock_deltas[pid])
+
+
+def cart_totals_annotations():
+    """Annotations computing each cart's true subtotal and item_count from its items."""
+    items = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+    amount = F("quantity") * F("product__price")
+    money = DecimalField(max_digits=CART_SUBTOTAL_DIGITS, decimal_places=2)
+    return {
+        "computed_subtotal": Coalesce(
+            Subquery(items.annotate(total=Sum(amount, output_field=money)).values("total")),
+            Value(Decimal(0)), output_field=money,
+        ),
+        "computed_item_count": Coalesce(
+            Subquery(items.annotate(total=Sum("quantity")).values("total")), Value(0),
+        ),
+    }
+
+
+def recompute_cart_totals(carts=None, batch_size=RECOMPUTE_BATCH_SIZE, dry_run=False):
+    """
+    Recompute stored totals for `carts` (a Cart queryset; default all) in
+    primary-key batches and fix the ones that drifted. Returns the number of
+    drifted carts.
+    """
+    carts = (Cart.objects.all() if carts is None else carts).order_by("pk")
+    drifted = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            carts.filter(pk__gt=last_pk)
+            .annotate(**cart_totals_annotations())
+            .only("pk", "subtotal", "item_count")[:batch_size]
+        )
+        if not batch:
+            return drifted
+        last_pk = batch[-1].pk
+        fixes = []
+        for cart in batch:
+            subtotal = Decimal(cart.computed_subtotal).quantize(Decimal("0.01"))
+            if cart.subtotal != subtotal or cart.item_count != cart.computed_item_count:
+                cart.subtotal = subtotal
+                cart.item_count = cart.computed_item_count
+                fixes.append(cart)
+        drifted += len(fixes)
+        if fixes and not dry_run:
+            Cart.objects.bulk_update(fixes, ["subtotal", "item_count"])
+
+
+def stale_carts(ttl=None, now=None):
+    """Carts not written to within `ttl` (a timedelta; default CART_TTL_DAYS)."""
+    if ttl is None:
+        ttl = timedelta(days=settings.CART_TTL_DAYS)
+    return Cart.objects.filter(updated_at__lt=(now or timezone.now()) - ttl)
+
+
+def purge_stale_carts(ttl=None, batch_size=PURGE_BATCH_SIZE, dry_run=False, pause=0):
+    """
+    Delete idle carts (see stale_carts) and their items, `batch_size` carts
+    per transaction in primary-key order, so each batch holds write locks
+    briefly; `pause` seconds between batches leaves room for other writers.
+    Returns (carts, items) deleted, or that would be deleted with `dry_run`.
+    """
+    stale = stale_carts(ttl)
+    if dry_run:
+        return stale.count(), CartItem.objects.filter(cart__in=stale).count()
+    carts = items = 0
+    last_pk = 0
+    while True:
+        pks = list(stale.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return carts, items
+        last_pk = pks[-1]
+        with transaction.atomic():
+            # updated_at is re-checked: a cart written to since the scan
+            # survives. Locked first, so its holds and items go together.
+            pks = list(stale.filter(pk__in=pks).select_for_update().values_list("pk", flat=True))
+            Stock.release_held(CartItem.objects.filter(cart__in=pks))
+            _total, deleted = Cart.objects.filter(pk__in=pks).delete()
+        carts += deleted.get(Cart._meta.label, 0)
+        items += deleted.get(CartItem._meta.label, 0)
+        if pause:
+            time.sleep(pause)
+
+
+class StaleCartSweeper(threading.Thread):
+    """Daemon thread running purge_stale_carts() every `interval` seconds."""
+
+    def __init__(self, interval):
+        super().__init__(name="stale-cart-sweeper", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                carts, items = purge_stale_carts()
+                if carts:
+                    logger.info("Purged %d stale cart(s) with %d item(s)", carts, items)
+            except Exception:
+                logger.exception("Stale cart sweep failed")
+            finally:
+                # This thread's connections only
+                connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_cart_sweeper(interval):
+    """
+    Start the process-wide sweeper once; later calls return the running one.
+    Called from the server entry points (wsgi.py / asgi.py) only, so
+    management commands and tests never run it.
+    """
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = StaleCartSweeper(interval)
+            _sweeper.start()
+        return _sweeper
@@ -0,0 +1,98 @@
+import threading
+
+from asgiref.sync import sync_to_async
+
+from .models import Category
+
+
+"""
+Process-local cache of the minimal nested category block used by product
+responses. Categories are few and rarely change, so the whole table is
+loaded in one query on first use and dropped by the Category save/delete
+signals (see signals.py). Other processes find out through the catalog
+version (response_cache.py), which every category write bumps: readers
+pass the version they read to sync(), which drops blocks loaded at another
+version. Slug lookups (get_category_id, for ?category=) use a slug -> id
+map of the same load.
+"""
+
+_lock = threading.Lock()
+_blocks = None
+_slug_ids = None  # slug -> id over the same categories as _blocks
+_version = None  # catalog version last passed to sync()
+
+
+def _load():
+    blocks = {}
+    for category in Category.objects.only("id", "name", "slug", "image"):
+        blocks[category.pk] = {
+            "id": category.pk,
+            "name": category.name,
+            "slug": category.slug,
+            "image": category.image.url if category.image else None,
+        }
+    return blocks
+
+
+def _reload():
+    global _blocks, _slug_ids
+    with _lock:
+        blocks = _load()
+        slug_ids = {block["slug"]: pk for pk, block in blocks.items()}
+        _blocks, _slug_ids = blocks, slug_ids
+    return blocks, slug_ids
+
+
+def get_category_block(category_id):
+    """Return the nested category dict for `category_id`, or None."""
+    if category_id is None:
+        return None
+    blocks = _blocks
+    if blocks is None or category_id not in blocks:
+        # Unknown id: the category may have been created in another process
+        blocks = _reload()[0]
+    return blocks.get(category_id)
+
+
+async def aget_category_block(category_id):
+    """get_category_block() for async callers; only a cache miss leaves the event loop."""
+    blocks = _blocks
+    if category_id is None:
+        return None
+    if blocks is not None and category_id in blocks:
+        return blocks[category_id]
+    return await sync_to_async(get_category_block)(category_id)
+
+
+def get_category_id(slug):
+    """Return the id of the category with `slug`, or None."""
+    slug_ids = _slug_ids
+    if slug_ids is None:
+        slug_ids = _reload()[1]
+    if slug in slug_ids:
+        return slug_ids[slug]
+    # Slugs come from clients: a miss costs one unique-index lookup, and only
+    # a category created in another process since the load reloads the table
+    pk = Category.objects.filter(slug=slug).values_list("pk", flat=True).first()
+    if pk is not None:
+        _reload()
+    return pk
+
+
+def sync(version):
+    """Drop the blocks unless they were kept for catalog `version` (no queries)."""
+    global _blocks, _slug_ids, _version
+    if version == _version:
+        return
+    with _lock:
+        # Reloaded on next use, from data at least as new as `version`
+        _blocks = None
+        _slug_ids = None
+        _version = version
+
+
+def invalidate():
+    global _blocks, _slug_ids
+    with _lock:
+        _blocks = None
+        _slug_ids = None
@@ -0,0 +1,130 @@
+import base64
+import binascii
+import heapq
+import json
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import ID_MAX, ProductTombstone
+
+
+"""
+Product change feed for incremental sync (GET /api/products/changes/).
+
+Changes are products by (updated_at, id), and tombstones of deleted
+products (ProductTombstone, written on post_delete) by (deleted_at,
+product_id), merged into one stream in that order. Both sides seek on an
+index from the cursor, the position of the last change a client has seen,
+so a sync costs what changed since then, not the catalog size. A product
+updated several times shows up once, at its latest update.
+
+Rows stamped within the last CHANGE_FEED_SETTLE_SECONDS are held back: a
+transaction may commit after another with a later stamp, and a cursor past
+its stamp would skip it. Tombstones are kept for CHANGE_FEED_RETENTION_DAYS
+(purge_tombstones); older cursors get a 410 and clients resync from
+scratch (no cursor).
+
+Every write that changes a product's body has to bump updated_at for the
+feed to see it; category saves and deletes do it for the category's
+products (signals.py), since their bodies nest the category.
+"""
+
+OP_CREATED = "created"
+OP_UPDATED = "updated"
+OP_DELETED = "deleted"
+CHANGE_OPS = (OP_CREATED, OP_UPDATED, OP_DELETED)
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = "The cursor is older than the change feed keeps; sync again without it."
+    default_code = "cursor_expired"
+
+
+def encode_cursor(stamp, pk):
+    payload = json.dumps({"t": stamp.isoformat(), "i": pk}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(token):
+    """(timestamp, id) from a cursor token; a 400 for anything else."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        stamp = parse_datetime(payload["t"])
+        # Naive stamps can't be compared with the aware updated_at values
+        if stamp is None or timezone.is_naive(stamp):
+            raise ValueError
+        pk = int(payload["i"])
+        # Both are query parameters: the stamp has to fit in UTC, the id in 64 bits
+        if abs(pk) > ID_MAX:
+            raise ValueError
+        return stamp.astimezone(dt_timezone.utc), pk
+    except (TypeError, ValueError, KeyError, OverflowError, binascii.Error):
+        raise ValidationError({"since": "Invalid cursor"})
+
+
+def _after(stamp_field, id_field, position):
+    if position is None:
+        return Q()
+    stamp, pk = position
+    return Q(**{f"{stamp_field}__gt": stamp}) | Q(**{stamp_field: stamp, f"{id_field}__gt": pk})
+
+
+def product_changes(queryset, since=None, limit=100):
+    """
+    Up to `limit` changes after the cursor `since` (None: every product),
+    oldest first, as (op, product or tombstone). Returns (changes, cursor
+    to resume from, whether more changes are ready). `queryset` is the
+    products to read (e.g. with deferred columns).
+    """
+    now = timezone.now()
+    position = decode_cursor(since) if since else None
+    if position is not None and position[0] < now - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS):
+        raise CursorExpired()
+    horizon = now - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+
+    products = (
+        queryset.filter(_after("updated_at", "id", position), updated_at__lt=horizon)
+        .order_by("updated_at", "id")[:limit + 1]
+    )
+    tombstones = (
+        ProductTombstone.objects.filter(_after("deleted_at", "product_id", position), deleted_at__lt=horizon)
+        .order_by("deleted_at", "product_id")[:limit + 1]
+    )
+    merged = heapq.merge(
+        (((product.updated_at, product.pk), product) for product in products),
+        (((tombstone.deleted_at, tombstone.product_id), tombstone) for tombstone in tombstones),
+        key=lambda entry: entry[0],
+    )
+    entries = list(islice(merged, limit + 1))
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    changes = []
+    for _key, record in entries:
+        if isinstance(record, ProductTombstone):
+            op = OP_DELETED
+        elif position is None or record.created_at > position[0]:
+            op = OP_CREATED
+        else:
+            op = OP_UPDATED
+        changes.append((op, record))
+    cursor = encode_cursor(*entries[-1][0]) if entries else since
+    return changes, cursor, has_more
+
+
+def purge_tombstones(days=None):
+    """Delete tombstones older than `days` (default CHANGE_FEED_RETENTION_DAYS); returns how many."""
+    if days is None:
+        days = settings.CHANGE_FEED_RETENTION_DAYS
+    deleted, _by_model = ProductTombstone.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted
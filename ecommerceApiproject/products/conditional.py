@@ -0,0 +1,92 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+"""
+Conditional GET support for viewsets.
+
+ConditionalGetMixin computes an ETag and Last-Modified for list and retrieve
+from cheap validators (timestamps and counts) supplied by the viewset, and
+answers If-None-Match / If-Modified-Since with a 304 before anything is
+serialized. Validators must change whenever the rendered body would.
+"""
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    # Weak: equivalent, not byte-identical, representations across renderers
+    return f'W/"{digest}"'
+
+
+def _timestamp(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+def request_validators(request, fmt, parts, last_modified):
+    """(etag, last-modified timestamp) for a response to `request` rendered as `fmt`."""
+    # The rendered body also depends on the query string and renderer
+    etag = make_etag(request.get_full_path(), fmt, *parts)
+    return etag, _timestamp(last_modified)
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 (or 412) response when `request` (a Django HttpRequest) is satisfied, else None."""
+    if request.method not in ("GET", "HEAD"):
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response["ETag"] = quote_etag(etag)
+    return response
+
+
+def set_validators(request, response, etag, last_modified):
+    if request.method in ("GET", "HEAD") and response.status_code == 200:
+        response["ETag"] = quote_etag(etag)
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    # Actions answered conditionally; leave out those without cheap validators
+    conditional_actions = ("list", "retrieve")
+
+    def get_list_validators(self, queryset):
+        """Return (etag parts, last modified datetime or None) for a list page."""
+        raise NotImplementedError
+
+    def get_object_validators(self, instance):
+        """Return (etag parts, last modified datetime or None) for one object."""
+        raise NotImplementedError
+
+    def is_conditional(self, request):
+        """Whether this request's action is answered conditionally."""
+        return self.action in self.conditional_actions
+
+    def _validators(self, parts, last_modified):
+        return request_validators(self.request, self.request.accepted_renderer.format, parts, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super().list(request, *args, **kwargs)
+        etag, last_modified = self._validators(
+            *self.get_list_validators(self.filter_queryset(self.get_queryset()))
+        )
+        response = not_modified(request._request, etag, last_modified)
+        if response is not None:
+            return response
+        return set_validators(request, super().list(request, *args, **kwargs), etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return super().retrieve(request, *args, **kwargs)
+        instance = self.get_object()
+        etag, last_modified = self._validators(*self.get_object_validators(instance))
+        response = not_modified(request._request, etag, last_modified)
+        if response is not None:
+            return response
+        serializer = self.get_serializer(instance)
+        return set_validators(request, Response(serializer.data), etag, last_modified)
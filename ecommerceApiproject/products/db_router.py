@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+"""
+Primary/replica routing for the catalog.
+
+With a "replica" alias in DATABASES (see DATABASE_REPLICA_PATH in
+settings), reads of catalog models (Product, Category, Review and the
+change feed's ProductTombstone) go to the replica and everything else,
+carts included, to the primary ("default").
+Writes always go to the primary, and migrations only run there; the
+replica is a copy of it (the sync_replica command makes one locally).
+
+Reads stay on the primary, so they see the writes they follow, when:
+
+- the primary is inside a transaction (atomic block);
+- the code runs under use_primary(), which PrimaryForWritesMiddleware
+  wraps around every POST/PUT/PATCH/DELETE request, and the response
+  cache around the responses it stores (see response_cache.py).
+
+Without a replica alias every read goes to the primary.
+"""
+
+PRIMARY = DEFAULT_DB_ALIAS
+REPLICA = "replica"
+REPLICA_MODELS = {"product", "category", "review", "producttombstone"}
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_pinned = ContextVar("db_pinned_to_primary", default=False)
+
+
+@contextmanager
+def use_primary():
+    """Route the block's catalog reads to the primary."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def _replica_allowed(self):
+        return (
+            REPLICA in connections.settings
+            and not _pinned.get()
+            and not connections[PRIMARY].in_atomic_block
+        )
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "products" and model._meta.model_name in REPLICA_MODELS:
+            return REPLICA if self._replica_allowed() else PRIMARY
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both
+        return {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class PrimaryForWritesMiddleware:
+    """Run unsafe-method requests under use_primary()."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.method in SAFE_METHODS:
+            return self.get_response(request)
+        with use_primary():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method in SAFE_METHODS:
+            return await self.get_response(request)
+        with use_primary():
+            return await self.get_response(request)
@@ -0,0 +1,137 @@
+from django.core.exceptions import FieldDoesNotExist
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+"""
+Sparse fieldsets: ?fields=id,name,price keeps only the named top-level
+fields of a response, ?omit=description drops them.
+
+Names are checked against the readable fields of the action's serializer
+(a 400 lists the allowed ones), and the pruning reaches the database:
+
+- list actions render .values() rows (rows.py) from a plan compiled for
+  just the kept fields, so only their columns are selected and a dropped
+  many=True relation (cart items) isn't fetched at all;
+- retrieve (and other instance actions, e.g. products/batch) defers the
+  model columns that only dropped fields read, e.g. Product.description,
+  and serializes the kept fields only.
+
+Only GETs of the viewset's `fieldset_actions` are pruned; writes always
+respond in full.
+"""
+
+FIELDS_PARAM = "fields"
+OMIT_PARAM = "omit"
+SPARSE_ACTIONS = ("list", "retrieve")
+
+_readable = {}
+
+
+def readable_fields(serializer_class):
+    """Names of the fields `serializer_class` renders, in order (cached per class)."""
+    names = _readable.get(serializer_class)
+    if names is None:
+        names = _readable[serializer_class] = tuple(
+            field.field_name for field in serializer_class()._readable_fields
+        )
+    return names
+
+
+def parse_fieldset(params, serializer_class):
+    """The kept field names (a tuple in serializer order) for ?fields=/?omit= in `params`, or None."""
+    fields, omit = params.get(FIELDS_PARAM), params.get(OMIT_PARAM)
+    if fields is None and omit is None:
+        return None
+    if fields is not None and omit is not None:
+        raise ValidationError({"detail": f"Use either {FIELDS_PARAM} or {OMIT_PARAM}, not both"})
+    param, value = (FIELDS_PARAM, fields) if fields is not None else (OMIT_PARAM, omit)
+    allowed = readable_fields(serializer_class)
+    names = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValidationError({
+            param: f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}"
+        })
+    kept = tuple(name for name in allowed if (name in names) == (param == FIELDS_PARAM))
+    if not kept:
+        raise ValidationError({param: "At least one field must be kept"})
+    return kept
+
+
+def deferred_columns(serializer_class, kept):
+    """Model fields read only by the fields of `serializer_class` not in `kept`."""
+    model = serializer_class.Meta.model
+    used, dropped = set(), set()
+    for field in serializer_class()._readable_fields:
+        # Method fields and dotted sources may read anything; never deferred
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if model_field.concrete and not model_field.primary_key:
+            (used if field.field_name in kept else dropped).add(model_field.name)
+    return sorted(dropped - used)
+
+
+def fieldset_parameters(serializer_class):
+    """OpenAPI parameters documenting ?fields= and ?omit= for `serializer_class`."""
+    schema = {"type": "array", "items": {"type": "string", "enum": list(readable_fields(serializer_class))}}
+    return [
+        OpenApiParameter(
+            FIELDS_PARAM, schema, style="form", explode=False,
+            description="Comma-separated fields to include; all others are left out.",
+        ),
+        OpenApiParameter(
+            OMIT_PARAM, schema, style="form", explode=False,
+            description=f"Comma-separated fields to leave out. Not combined with `{FIELDS_PARAM}`.",
+        ),
+    ]
+
+
+# ?fields=/?omit= on GETs of `fieldset_actions` (see the module docstring).
+# Goes before RowListMixin, which renders lists with get_row_fields().
+# `fieldset_required_columns` are never deferred, e.g. columns read by
+# get_object_validators that are also serializer fields.
+# (No docstring: drf-spectacular would use it as the operation description.)
+class SparseFieldsetMixin:
+    fieldset_actions = SPARSE_ACTIONS
+    fieldset_required_columns = ()
+
+    def get_fieldset(self):
+        if self.action not in self.fieldset_actions or self.request.method not in ("GET", "HEAD"):
+            return None
+        if not hasattr(self, "_fieldset"):
+            self._fieldset = parse_fieldset(self.request.query_params, self.get_serializer_class())
+        return self._fieldset
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # A bad fieldset is a 400 before cache lookups and conditional GETs
+        self.get_fieldset()
+
+    def get_row_fields(self):
+        return self.get_fieldset()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset = self.get_fieldset()
+        if fieldset is not None and self.action != "list":
+            columns = deferred_columns(self.get_serializer_class(), fieldset)
+            columns = [c for c in columns if c not in self.fieldset_required_columns]
+            if columns:
+                queryset = queryset.defer(*columns)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fieldset = self.get_fieldset()
+        if fieldset is None:
+            return serializer
+        pruned = serializer.child if isinstance(serializer, serializers.ListSerializer) else serializer
+        if isinstance(pruned, serializers.Serializer):
+            for field in list(pruned._readable_fields):
+                if field.field_name not in fieldset:
+                    pruned.fields.pop(field.field_name)
+        return serializer
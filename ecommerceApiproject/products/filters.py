@@ -0,0 +1,143 @@
+from datetime import datetime, time, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .category_cache import get_category_block, get_category_id
+
+
+"""
+Product list filters and facet counts.
+
+ProductFilterBackend narrows the queryset by category slug, price range,
+creation range and minimum rating, and orders it by rating on request;
+(category, price), (category, created_at) and rating indexes back the
+common combinations. product_facets() returns per-category and
+per-price-bucket counts for a filtered queryset from one GROUP BY query.
+"""
+
+# Upper bounds of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKET_BOUNDS = [Decimal(b) for b in ("10", "25", "50", "100", "250", "500", "1000")]
+
+# ?ordering= values; each matches product_rating_idx (read forwards or backwards)
+ORDERINGS = {
+    "-rating": ("-rating_avg", "-rating_count", "-id"),
+    "rating": ("rating_avg", "rating_count", "id"),
+}
+
+
+def _decimal(params, name):
+    try:
+        value = Decimal(params[name])
+    except InvalidOperation:
+        value = None
+    # NaN and Infinity parse, but can't be compared with prices
+    if value is None or not value.is_finite():
+        raise ValidationError({name: "A valid number is required."})
+    return value
+
+
+def _datetime(params, name):
+    value = params[name]
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, time.min) if day else None
+        if parsed is not None:
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            # Stored in UTC: an offset can push the edges of the range past it
+            parsed = parsed.astimezone(dt_timezone.utc)
+    except (ValueError, OverflowError):
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: "Use an ISO 8601 date or datetime."})
+    return parsed
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if params.get("category"):
+            # Comma-separated slugs; unknown slugs simply match nothing
+            ids = [get_category_id(slug) for slug in params["category"].split(",") if slug]
+            queryset = queryset.filter(category_id__in=[pk for pk in ids if pk is not None])
+        if "min_price" in params:
+            queryset = queryset.filter(price__gte=_decimal(params, "min_price"))
+        if "max_price" in params:
+            queryset = queryset.filter(price__lte=_decimal(params, "max_price"))
+        if "created_after" in params:
+            queryset = queryset.filter(created_at__gte=_datetime(params, "created_after"))
+        if "created_before" in params:
+            queryset = queryset.filter(created_at__lt=_datetime(params, "created_before"))
+        if "min_rating" in params:
+            # Unreviewed products have rating_avg 0, so any positive minimum excludes them
+            queryset = queryset.filter(rating_avg__gte=_decimal(params, "min_rating"))
+        if "ordering" in params:
+            ordering = ORDERINGS.get(params["ordering"])
+            if ordering is None:
+                raise ValidationError({"ordering": f"Use one of: {', '.join(ORDERINGS)}."})
+            paginator = getattr(view, "paginator", None)
+            if paginator is not None and paginator.use_keyset(request):
+                raise ValidationError({"ordering": "Not supported with cursor pagination."})
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        def param(name, schema, description):
+            return {"name": name, "required": False, "in": "query", "description": description, "schema": schema}
+
+        return [
+            param("category", {"type": "string"}, "Category slug(s), comma-separated."),
+            param("min_price", {"type": "number"}, "Minimum price (inclusive)."),
+            param("max_price", {"type": "number"}, "Maximum price (inclusive)."),
+            param("created_after", {"type": "string", "format": "date-time"}, "Created at or after."),
+            param("created_before", {"type": "string", "format": "date-time"}, "Created before."),
+            param("min_rating", {"type": "number"}, "Minimum average rating (1-5)."),
+            param("ordering", {"type": "string", "enum": list(ORDERINGS)}, "Sort by average rating."),
+            param("facets", {"type": "boolean"}, "Include category and price facet counts."),
+        ]
+
+
+def _price_bucket():
+    whens = [When(price__lt=bound, then=Value(i)) for i, bound in enumerate(PRICE_BUCKET_BOUNDS)]
+    return Case(*whens, default=Value(len(PRICE_BUCKET_BOUNDS)), output_field=IntegerField())
+
+
+def product_facets(queryset):
+    """Category and price-bucket counts for `queryset`, from one grouped query."""
+    rows = (
+        queryset.order_by()
+        .values("category_id", bucket=_price_bucket())
+        .annotate(count=Count("id"))
+    )
+    by_category = {}
+    by_bucket = [0] * (len(PRICE_BUCKET_BOUNDS) + 1)
+    for row in rows:
+        by_category[row["category_id"]] = by_category.get(row["category_id"], 0) + row["count"]
+        by_bucket[row["bucket"]] += row["count"]
+
+    categories = []
+    for category_id, count in by_category.items():
+        block = get_category_block(category_id)
+        categories.append({
+            "id": category_id,
+            "slug": block["slug"] if block else None,
+            "name": block["name"] if block else None,
+            "count": count,
+        })
+    categories.sort(key=lambda c: (-c["count"], c["name"] is None, c["name"] or ""))
+
+    lows = [None] + PRICE_BUCKET_BOUNDS
+    highs = PRICE_BUCKET_BOUNDS + [None]
+    prices = [
+        {"min": low, "max": high, "count": count}
+        for low, high, count in zip(lows, highs, by_bucket)
+        if count
+    ]
+    return {"category": categories, "price": prices}
@@ -0,0 +1,134 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+from PIL import Image, ImageOps
+
+
+"""
+Image derivatives for Product and Category images.
+
+generate_variants() writes fixed-width resizes of an uploaded image, in its
+own format and as WebP, next to the original under derived/. The resulting
+manifest is stored on the model's image_variants JSON column, so
+serializers can build srcset strings without touching storage:
+
+    {"source": "products/shoe.png",
+     "variants": {"webp": {"160": "products/derived/shoe.png.160w.webp", ...},
+                  "png": {"160": "products/derived/shoe.png.160w.png", ...}}}
+
+Derived names keep the source's whole file name, extension included, so
+shoe.png and shoe.jpg don't share variants. Regenerating a manifest
+overwrites its own files in place; any other existing file is left alone
+and storage picks a free name, which the manifest records.
+
+Variants are generated after upload (see signals.py); the
+generate_image_variants command backfills existing media.
+"""
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+# Formats kept as-is for the same-format variants; anything else becomes JPEG
+PASSTHROUGH_FORMATS = {"JPEG": "jpg", "PNG": "png"}
+
+
+def manifest_is_current(manifest, image_name):
+    return bool(manifest) and manifest.get("source") == image_name
+
+
+def _derived_name(image_name, width, ext):
+    directory, filename = os.path.split(image_name)
+    return os.path.join(directory, "derived", f"{filename}.{width}w.{ext}")
+
+
+def _manifest_names(manifest):
+    return {name for paths in (manifest or {}).get("variants", {}).values() for name in paths.values()}
+
+
+def _owned_name(manifest, ext, width):
+    return (manifest or {}).get("variants", {}).get(ext, {}).get(str(width))
+
+
+def _encode(image, fmt):
+    buf = BytesIO()
+    if fmt == "WEBP":
+        image.save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+    elif fmt == "PNG":
+        image.save(buf, "PNG", optimize=True)
+    else:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def generate_variants(storage, image_name, replacing=None):
+    """
+    Write all derivatives of `image_name` to `storage`; return the manifest.
+    Files of the manifest `replacing` (the one being regenerated) are
+    overwritten; no other existing file is.
+    """
+    with storage.open(image_name, "rb") as fh:
+        original = Image.open(fh)
+        source_format = original.format
+        original = ImageOps.exif_transpose(original)
+        original.load()
+
+    same_ext = PASSTHROUGH_FORMATS.get(source_format, "jpg")
+    same_format = "PNG" if same_ext == "png" else "JPEG"
+    # Never upscale; an image narrower than every width gets one variant at its own width
+    widths = [w for w in VARIANT_WIDTHS if w < original.width] or [original.width]
+
+    variants = {"webp": {}, same_ext: {}}
+    for width in widths:
+        height = max(1, round(original.height * width / original.width))
+        resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+        for ext, fmt in (("webp", "WEBP"), (same_ext, same_format)):
+            name = _owned_name(replacing, ext, width)
+            if name and storage.exists(name):
+                storage.delete(name)
+            else:
+                name = _derived_name(image_name, width, ext)
+            variants[ext][str(width)] = storage.save(name, ContentFile(_encode(resized, fmt)))
+    return {"source": image_name, "variants": variants}
+
+
+def delete_variants(storage, manifest):
+    for name in _manifest_names(manifest):
+        storage.delete(name)
+
+
+def media_url_builder(storage, request=None):
+    """
+    name -> URL, as storage.url() then request.build_absolute_uri().
+
+    FileSystemStorage URLs are base_url plus the quoted name, so the absolute
+    prefix is resolved once here instead of two urljoin()s per name. Names
+    the shortcut can't reproduce exactly take the general path.
+    """
+    def general(name):
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    if not isinstance(storage, FileSystemStorage):
+        return general
+    prefix = request.build_absolute_uri(storage.base_url) if request is not None else storage.base_url
+
+    def url_for(name):
+        if name.startswith(("/", "\\")) or "./" in name:
+            return general(name)
+        return prefix + filepath_to_uri(name)
+
+    return url_for
+
+
+def srcset(manifest, url_for):
+    """{"webp": "url 160w, url 320w", ...} from a manifest; `url_for` maps names to URLs."""
+    result = {}
+    for ext, paths in (manifest or {}).get("variants", {}).items():
+        entries = sorted(paths.items(), key=lambda item: int(item[0]))
+        result[ext] = ", ".join(f"{url_for(name)} {width}w" for width, name in entries)
+    return result
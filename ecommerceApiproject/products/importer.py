@@ -0,0 +1,152 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import response_cache
+from .carts import recompute_cart_totals
+from .db_router import use_primary
+from .models import Cart, Category, Product
+from .slugs import assign_unique_slugs
+
+
+"""
+Streaming catalog import.
+
+Rows are read lazily from CSV or NDJSON, validated and written in chunks of
+`chunk_size`, each chunk in its own transaction. Rows carrying a slug that
+already exists update that product (bulk_update); everything else is
+inserted (bulk_create). Memory stays flat whatever the feed size.
+
+Bulk writes skip Product.save and model signals.
+"""
+
+FORMATS = ("csv", "ndjson")
+DEFAULT_CHUNK_SIZE = 1000
+# Cap on per-row errors kept in the result, so a bad feed can't grow memory
+MAX_REPORTED_ERRORS = 100
+UPDATE_FIELDS = ["name", "description", "price", "category", "updated_at"]
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=200)
+    description = serializers.CharField(required=False, allow_blank=True, default="")
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    slug = serializers.SlugField(max_length=220, required=False, allow_blank=True, default="")
+    category = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, detail):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "errors": detail})
+
+    def as_dict(self):
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def iter_rows(lines, fmt):
+    """Yield (line number, row dict) from an iterable of text lines."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Drop short-row padding (None values) and overflow columns (None key)
+            yield reader.line_num, {k: v for k, v in row.items() if k is not None and v is not None}
+    elif fmt == "ndjson":
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else {"__invalid__": line}
+    else:
+        raise ValueError(f"Unsupported import format: {fmt!r}")
+
+
+# Category and slug lookups must see the rows just written
+@use_primary()
+def import_products(lines, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Import products from text `lines` in `fmt` ("csv" or "ndjson")."""
+    result = ImportResult()
+    categories = dict(Category.objects.values_list("slug", "id"))
+    validator = ProductImportRowSerializer()
+    rows = iter_rows(lines, fmt)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, validator, categories, result)
+    return result
+
+
+def _import_chunk(chunk, validator, categories, result):
+    by_slug = {}
+    new = []
+    for line, row in chunk:
+        if "__invalid__" in row:
+            result.add_error(line, {"non_field_errors": ["Invalid JSON object"]})
+            continue
+        try:
+            data = validator.run_validation(row)
+        except serializers.ValidationError as exc:
+            result.add_error(line, exc.detail)
+            continue
+        category_id = None
+        if data["category"]:
+            category_id = categories.get(data["category"])
+            if category_id is None:
+                result.add_error(line, {"category": [f"Unknown category slug {data['category']!r}"]})
+                continue
+        product = Product(
+            name=data["name"],
+            description=data["description"],
+            price=data["price"],
+            slug=data["slug"] or None,
+            category_id=category_id,
+        )
+        if product.slug:
+            # Last row wins when a slug repeats within the chunk
+            by_slug[product.slug] = product
+        else:
+            new.append(product)
+
+    with transaction.atomic():
+        existing = Product.objects.only("id", "slug").in_bulk(list(by_slug), field_name="slug")
+        now = timezone.now()
+        updates = []
+        for slug, product in by_slug.items():
+            current = existing.get(slug)
+            if current is None:
+                new.append(product)
+            else:
+                product.pk = current.pk
+                product.updated_at = now
+                updates.append(product)
+        if updates:
+            Product.objects.bulk_update(updates, UPDATE_FIELDS)
+            # bulk_update skips signals; fix totals of carts holding repriced products
+            recompute_cart_totals(Cart.objects.filter(items__product__in=updates).distinct())
+        if new:
+            assign_unique_slugs(new)
+            Product.objects.bulk_create(new)
+    # Bulk writes skip the signals that invalidate cached catalog responses
+    response_cache.bump_version()
+    result.updated += len(updates)
+    result.created += len(new)
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import CartItem, Product, Stock
+
+
+"""
+Stock and reservations.
+
+A tracked product's stock is Stock rows holding on-hand `quantity` and
+`reserved` units. Cart items hold their quantity as reserved stock: an
+increase runs one conditional UPDATE
+
+    UPDATE products_stock SET reserved = reserved + n
+    WHERE id = (a random shard of the product with n free) AND quantity >= reserved + n
+
+and sells out when no row matches (InsufficientStock, a 409 from the cart
+endpoints); there is no SELECT-then-save, so concurrent adds never
+oversell, and a CHECK constraint backs that up. The UPDATE is the last
+statement of the item write's transaction, which keeps the row lock short.
+Decreases, removals, clears and cart deletes release; purge_stale_carts
+releases the holds of the carts it expires, so holds last as long as carts.
+
+A hot product can have its stock split over several shard rows
+(set_stock(shards=N)): adds pick a random shard, so on databases with row
+locks concurrent adds mostly wait on different rows. On SQLite every write
+takes the database lock, so shards change nothing there. A request no one
+shard can satisfy takes units from several, all or nothing.
+
+Products without Stock rows (stock_tracked=False) are not limited.
+"""
+
+
+@transaction.atomic
+def set_stock(product, quantity, shards=1):
+    """
+    Set `product`'s on-hand stock to `quantity` units over `shards` rows, or
+    stop tracking it with None. What carts hold now is counted as reserved.
+    """
+    Stock.objects.filter(product=product).delete()
+    if quantity is None:
+        Product.objects.filter(pk=product.pk).update(stock_tracked=False)
+        product.stock_tracked = False
+        return
+    if quantity < 0 or shards < 1:
+        raise ValueError("quantity must not be negative and shards must be positive")
+    held = CartItem.objects.filter(product=product).aggregate(total=Sum("quantity"))["total"] or 0
+    if held > quantity:
+        raise ValueError(f"Carts hold {held} units, more than {quantity}")
+
+    def share(total, shard):
+        return total // shards + (shard < total % shards)
+
+    Stock.objects.bulk_create([
+        Stock(product=product, shard=shard, quantity=share(quantity, shard), reserved=share(held, shard))
+        for shard in range(shards)
+    ])
+    Product.objects.filter(pk=product.pk).update(stock_tracked=True)
+    product.stock_tracked = True
+
+
+def stock_levels(product):
+    """{"quantity", "reserved", "available"} for a tracked `product`, or None."""
+    levels = Stock.objects.filter(product=product).aggregate(quantity=Sum("quantity"), reserved=Sum("reserved"))
+    if levels["quantity"] is None:
+        return None
+    levels["available"] = levels["quantity"] - levels["reserved"]
+    return levels
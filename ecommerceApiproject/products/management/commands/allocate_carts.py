@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.carts import ALLOCATE_BATCH_SIZE, allocate_carts
+
+
+class Command(BaseCommand):
+    help = "Pre-create empty carts (e.g. for kiosks or load tests) and print their codes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int)
+        parser.add_argument("--batch-size", type=int, default=ALLOCATE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["count"] <= 0 or options["batch_size"] <= 0:
+            raise CommandError("count and --batch-size must be positive")
+        for cart in allocate_carts(options["count"], batch_size=options["batch_size"]):
+            self.stdout.write(cart.cart_code)
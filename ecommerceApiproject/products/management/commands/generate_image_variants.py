@@ -0,0 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from products import images, response_cache
+from products.db_router import use_primary
+from products.models import Category, Product
+
+
+def _init_worker():
+    # Spawned workers (e.g. on Windows) start without configured settings
+    django.setup()
+
+
+def _generate(image_name, replacing):
+    # Runs in a worker process: storage only, no database access
+    try:
+        return image_name, images.generate_variants(default_storage, image_name, replacing), None
+    except OSError as exc:
+        return image_name, None, str(exc)
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnail/WebP variants for product and category images missing them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument("--force", action="store_true", help="Regenerate variants that are already current")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    @use_primary()
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive")
+        # Don't hand open database connections to forked workers
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=_init_worker) as pool:
+            for model in (Category, Product):
+                done, failed = self._backfill(model, pool, options)
+                self.stdout.write(f"{model._meta.verbose_name_plural}: {done} generated, {failed} failed")
+        # bulk_update skips the signals that invalidate cached responses
+        response_cache.bump_version()
+
+    def _backfill(self, model, pool, options):
+        done = failed = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.exclude(image="").exclude(image__isnull=True)
+                .filter(pk__gt=last_pk).order_by("pk")
+                .only("pk", "image", "image_variants")[:options["batch_size"]]
+            )
+            if not rows:
+                return done, failed
+            last_pk = rows[-1].pk
+            pending = {}
+            for row in rows:
+                if options["force"] or not images.manifest_is_current(row.image_variants, row.image.name):
+                    pending.setdefault(row.image.name, []).append(row)
+            # --force regenerates current manifests in place; other files are never overwritten
+            futures = [
+                pool.submit(_generate, name, group[0].image_variants if images.manifest_is_current(group[0].image_variants, name) else None)
+                for name, group in pending.items()
+            ]
+            updated = []
+            for future in as_completed(futures):
+                name, manifest, error = future.result()
+                if error:
+                    failed += len(pending[name])
+                    self.stderr.write(f"{name}: {error}")
+                    continue
+                for row in pending[name]:
+                    row.image_variants = manifest
+                    # The srcsets in the body changed (ETags, change feed)
+                    row.updated_at = timezone.now()
+                    updated.append(row)
+            model.objects.bulk_update(updated, ["image_variants", "updated_at"])
+            done += len(updated)
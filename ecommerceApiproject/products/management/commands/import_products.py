@@ -0,0 +1,41 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import DEFAULT_CHUNK_SIZE, FORMATS, import_products
+
+
+class Command(BaseCommand):
+    help = "Stream products from a CSV or NDJSON file into the catalog (upsert by slug)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or '-' for stdin")
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="Input format; inferred from the file extension when omitted",
+        )
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"]
+        if fmt is None:
+            ext = os.path.splitext(path)[1].lower()
+            fmt = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(ext)
+            if fmt is None:
+                raise CommandError("Cannot infer format; pass --format")
+        if options["chunk_size"] <= 0:
+            raise CommandError("--chunk-size must be positive")
+
+        if path == "-":
+            result = import_products(sys.stdin, fmt, options["chunk_size"])
+        else:
+            with open(path, newline="", encoding="utf-8") as fh:
+                result = import_products(fh, fmt, options["chunk_size"])
+
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result.created}, updated {result.updated}, failed {result.failed}"
+        ))
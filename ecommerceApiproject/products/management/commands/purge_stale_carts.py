@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.carts import PURGE_BATCH_SIZE, purge_stale_carts
+
+
+class Command(BaseCommand):
+    help = "Delete carts with no activity for longer than the TTL, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=float, default=settings.CART_TTL_DAYS,
+            help=f"Idle time before a cart is stale (default {settings.CART_TTL_DAYS})",
+        )
+        parser.add_argument("--batch-size", type=int, default=PURGE_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=0, help="Seconds to sleep between batches")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive")
+        if options["days"] < 0:
+            raise CommandError("--days must not be negative")
+        carts, items = purge_stale_carts(
+            ttl=timedelta(days=options["days"]),
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+            pause=options["pause"],
+        )
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {carts} stale cart(s) with {items} item(s)"))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.changes import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete change feed tombstones of products deleted longer ago than the feed's retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=float, default=settings.CHANGE_FEED_RETENTION_DAYS,
+            help=(
+                f"Age of the tombstones to delete (default CHANGE_FEED_RETENTION_DAYS, "
+                f"{settings.CHANGE_FEED_RETENTION_DAYS}); less than that and clients "
+                "resuming from older cursors miss deletes"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days must not be negative")
+        deleted = purge_tombstones(days=options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstone(s)"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.carts import RECOMPUTE_BATCH_SIZE, recompute_cart_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute stored cart subtotals and item counts from cart items, fixing drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=RECOMPUTE_BATCH_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="Report drifted carts without fixing them")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive")
+        drifted = recompute_cart_totals(batch_size=options["batch_size"], dry_run=options["dry_run"])
+        verb = "Found" if options["dry_run"] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {drifted} cart(s) with drifted totals"))
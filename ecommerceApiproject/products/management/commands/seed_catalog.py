@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.seeding import MAX_ITEMS_PER_CART, SEED_BATCH_SIZE, SIZES, flush_catalog, seed_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an empty database with a deterministic catalog (categories, products, carts with items) "
+        "for load tests. Counts default to the --size preset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", choices=SIZES, default="10k")
+        parser.add_argument("--products", type=int)
+        parser.add_argument("--categories", type=int)
+        parser.add_argument("--carts", type=int)
+        parser.add_argument("--max-items-per-cart", type=int, default=MAX_ITEMS_PER_CART)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=SEED_BATCH_SIZE)
+        parser.add_argument("--flush", action="store_true", help="Delete the existing catalog, carts and reviews first")
+
+    def handle(self, *args, **options):
+        counts = dict(SIZES[options["size"]])
+        for name in counts:
+            if options[name] is not None:
+                counts[name] = options[name]
+        if min(counts.values()) < 0 or counts["categories"] < 1 or options["batch_size"] <= 0:
+            raise CommandError("Counts must not be negative, with at least one category and a positive --batch-size")
+
+        if options["flush"]:
+            flush_catalog()
+        start = time.perf_counter()
+
+        def progress(table, rows):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{table}: {rows}")
+
+        try:
+            seeded = seed_catalog(
+                max_items_per_cart=options["max_items_per_cart"], seed=options["seed"],
+                batch_size=options["batch_size"], progress=progress, **counts,
+            )
+        except ValueError as exc:
+            raise CommandError(f"{exc} (use --flush)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {seeded['products']} products, {seeded['categories']} categories and "
+            f"{seeded['carts']} carts ({seeded['cart_items']} items) in {time.perf_counter() - start:.1f}s"
+        ))
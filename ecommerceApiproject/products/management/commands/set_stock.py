@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.inventory import set_stock, stock_levels
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Set a product's on-hand stock (what carts hold stays reserved), optionally split over "
+        "several rows for very hot products, or stop tracking it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug")
+        parser.add_argument("quantity", nargs="?", type=int, help="Omit to show the current levels")
+        parser.add_argument("--shards", type=int, default=1, help="Rows to spread the stock over")
+        parser.add_argument("--untrack", action="store_true", help="Stop limiting the product's stock")
+
+    def handle(self, *args, **options):
+        try:
+            product = Product.objects.get(slug=options["slug"])
+        except Product.DoesNotExist:
+            raise CommandError(f"No product with slug {options['slug']!r}")
+        try:
+            if options["untrack"]:
+                set_stock(product, None)
+            elif options["quantity"] is not None:
+                set_stock(product, options["quantity"], shards=options["shards"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        levels = stock_levels(product)
+        if levels is None:
+            self.stdout.write(f"{product.slug}: stock not tracked")
+        else:
+            self.stdout.write(
+                f"{product.slug}: {levels['quantity']} on hand, {levels['reserved']} reserved, "
+                f"{levels['available']} available"
+            )
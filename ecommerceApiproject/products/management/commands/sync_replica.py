@@ -0,0 +1,30 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from products.db_router import PRIMARY, REPLICA
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database onto the replica file with SQLite's online backup, "
+        "a local stand-in for replication (set DATABASE_REPLICA_PATH)."
+    )
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.settings:
+            raise CommandError("No replica database is configured; set DATABASE_REPLICA_PATH")
+        primary = connections[PRIMARY]
+        if primary.vendor != "sqlite" or connections[REPLICA].vendor != "sqlite":
+            raise CommandError("sync_replica only copies SQLite databases")
+
+        # The replica connection is read-only (query_only); write the file directly
+        connections[REPLICA].close()
+        primary.ensure_connection()
+        target = sqlite3.connect(connections[REPLICA].settings_dict["NAME"])
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied {primary.settings_dict['NAME']} to the replica"))
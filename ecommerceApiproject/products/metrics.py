@@ -0,0 +1,243 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.response import Response
+
+from . import response_cache
+
+
+"""
+Per-request query and timing instrumentation.
+
+RequestMetricsMiddleware records, for each request, the number of SQL
+queries and the time spent in the database, in serialization (serializers
+with TimedSerializerMixin, RowSerializer.data) and in rendering (views with
+TimedRenderMixin, the async read views). It reports them to the client as
+a Server-Timing header:
+
+    Server-Timing: db;dur=1.84;desc="3 queries", serialize;dur=2.10, render;dur=0.61, total;dur=6.02
+
+and keeps the last REQUEST_METRICS_WINDOW samples per route (view name and
+method) in memory, from which metrics_text() renders p50/p95/p99 summaries
+in the Prometheus text format for /api/_metrics.
+
+The state lives in a context variable, so it follows a request into
+sync_to_async threads under ASGI. Serialization or rendering nested in the
+other is counted once, under the outer phase; queries they trigger count
+under db as well. With REQUEST_METRICS_ENABLED off the middleware removes
+itself at startup, no query wrapper is installed and the timed() blocks
+find no request to count for.
+"""
+
+PHASES = ("serialize", "render")
+QUANTILES = (0.5, 0.95, 0.99)
+# (metric name, help, RequestSample attribute)
+SUMMARIES = (
+    ("api_request_duration_seconds", "Time to respond, middleware to middleware.", "total"),
+    ("api_request_db_seconds", "Time spent executing SQL.", "db"),
+    ("api_request_serialize_seconds", "Time spent in serializer .data.", "serialize"),
+    ("api_request_render_seconds", "Time spent rendering the response body.", "render"),
+    ("api_request_queries", "SQL queries executed.", "queries"),
+)
+
+_current = ContextVar("request_metrics", default=None)
+
+
+def enabled():
+    return getattr(settings, "REQUEST_METRICS_ENABLED", False)
+
+
+class RequestSample:
+    """Counters of one request; durations in seconds."""
+
+    __slots__ = ("start", "queries", "db", "serialize", "render", "total", "phase")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = self.serialize = self.render = self.total = 0.0
+        self.phase = None  # the phase being timed, if any
+
+    def server_timing(self):
+        ms = {name: getattr(self, name) * 1000 for name in ("db", "serialize", "render", "total")}
+        return (
+            f'db;dur={ms["db"]:.2f};desc="{self.queries} queries", serialize;dur={ms["serialize"]:.2f}, '
+            f'render;dur={ms["render"]:.2f}, total;dur={ms["total"]:.2f}'
+        )
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to `phase` of the current request, if any."""
+    sample = _current.get()
+    if sample is None or sample.phase is not None:
+        yield
+        return
+    sample.phase = phase
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(sample, phase, getattr(sample, phase) + time.perf_counter() - start)
+        sample.phase = None
+
+
+def _record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.db += time.perf_counter() - start
+
+
+def watch_connection(connection, **kwargs):
+    # First in the list: connection.execute_wrapper() pops from the end
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def instrument():
+    """Count the queries of connections opened from now on (idempotent)."""
+    connection_created.connect(watch_connection, dispatch_uid="request_metrics")
+
+
+# Times the serializer's output under "serialize". A many=True list renders
+# each item through the child's to_representation, so lists are covered
+# too; nested serializers run inside their parent's timing.
+class TimedSerializerMixin:
+    def to_representation(self, instance):
+        with timed("serialize"):
+            return super().to_representation(instance)
+
+
+# Renders the view's Response under "render" in finalize_response instead of
+# leaving it to the handler after the view returns. List it after
+# CachedResponseMixin, which renders cache misses to store them.
+# (No docstring: drf-spectacular would use it as the operation description.)
+class TimedRenderMixin:
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if isinstance(response, Response) and not response.is_rendered:
+            with timed("render"):
+                response.render()
+        return response
+
+
+class RouteHistograms:
+    """The last `window` samples per (method, route), plus lifetime counts and sums."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, method, route, sample):
+        values = tuple(getattr(sample, attr) for _name, _help, attr in SUMMARIES)
+        with self._lock:
+            entry = self._routes.get((method, route))
+            if entry is None:
+                window = getattr(settings, "REQUEST_METRICS_WINDOW", 1000)
+                entry = self._routes[(method, route)] = [deque(maxlen=window), 0, [0] * len(SUMMARIES)]
+            entry[0].append(values)
+            entry[1] += 1
+            entry[2] = [total + value for total, value in zip(entry[2], values)]
+
+    def snapshot(self):
+        """{(method, route): (samples, count, sums)}"""
+        with self._lock:
+            return {key: (list(samples), count, list(sums)) for key, (samples, count, sums) in self._routes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+histograms = RouteHistograms()
+
+
+def quantile(ordered, q):
+    # Nearest rank
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metrics_text():
+    """The histograms (and response cache counters) in the Prometheus text format."""
+    routes = sorted(histograms.snapshot().items())
+    lines = []
+    for index, (name, help_text, _attr) in enumerate(SUMMARIES):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+        for (method, route), (samples, count, sums) in routes:
+            labels = f'method="{_label(method)}",route="{_label(route)}"'
+            ordered = sorted(sample[index] for sample in samples)
+            for q in QUANTILES:
+                lines.append(f'{name}{{{labels},quantile="{q}"}} {quantile(ordered, q):.6g}')
+            lines.append(f"{name}_sum{{{labels}}} {sums[index]:.6g}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+    cache = response_cache.stats.as_dict()
+    for outcome in ("hits", "misses"):
+        name = f"catalog_response_cache_{outcome}_total"
+        lines += [f"# TYPE {name} counter", f"{name} {cache[outcome]}"]
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        instrument()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        # Connections opened before instrument() ran (connection_created covers the rest)
+        for connection in connections.all(initialized_only=True):
+            watch_connection(connection)
+        sample = RequestSample()
+        token = _current.set(sample)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, sample)
+
+    async def __acall__(self, request):
+        sample = RequestSample()
+        token = _current.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, sample)
+
+    def _finish(self, request, response, sample):
+        sample.total = time.perf_counter() - sample.start
+        match = request.resolver_match
+        histograms.observe(request.method, match.view_name if match else "unmatched", sample)
+        timing = sample.server_timing()
+        if "Server-Timing" in response:
+            timing = f"{response['Server-Timing']}, {timing}"
+        response["Server-Timing"] = timing
+        return response
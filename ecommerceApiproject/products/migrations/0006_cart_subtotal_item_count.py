@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:05
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('products', 'Cart')
+    CartItem = apps.get_model('products', 'CartItem')
+    totals = (
+        CartItem.objects.order_by().values('cart_id')
+        .annotate(count=Sum('quantity'), amount=Sum(F('quantity') * F('product__price')))
+    )
+    for row in totals.iterator():
+        Cart.objects.filter(pk=row['cart_id']).update(
+            item_count=row['count'],
+            subtotal=Decimal(row['amount'] or 0).quantize(Decimal('0.01')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_cat_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['subtotal'], name='cart_subtotal_idx'),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_cart_subtotal_item_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='product_cat_price_idx'),
+        ),
+    ]
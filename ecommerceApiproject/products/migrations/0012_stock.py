@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_review_product_ratings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_tracked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('reserved', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='products.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'shard'), name='stock_product_shard_uniq'), models.CheckConstraint(condition=models.Q(('reserved__lte', models.F('quantity'))), name='stock_reserved_lte_quantity')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+    ]
@@ -1,14 +1,24 @@
-from django.db import models
-from django.utils.text import slugify
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Subquery, Sum
+from django.db.models.functions import Cast, Greatest
 from django.utils import timezone
 import secrets
 import string
 
+from .slugs import save_with_unique_slug
+
+# Largest value of the 64-bit id columns
+ID_MAX = 2 ** 63 - 1
+
 
 class Category(models.Model):
     name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=220, unique=True, blank=True)
     image = models.ImageField(upload_to='categories/', null=True, blank=True)
+    # Derivative manifest written by products.images (thumbnails, WebP)
+    image_variants = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["name"]
@@ -18,13 +28,7 @@ class Category(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug and self.name:
-            base = slugify(self.name)
-            slug = base
-            i = 1
-            while Category.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                i += 1
-                slug = f"{base}-{i}"
-            self.slug = slug
+            return save_with_unique_slug(self, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
 
@@ -33,56 +37,181 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     slug = models.SlugField(max_length=220, unique=True, null=True, blank=True)
+    # Review aggregates, kept in step with Review writes (see adjust_ratings)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    # rating_sum / rating_count, or 0 with no reviews (sorts below every real average)
+    rating_avg = models.FloatField(default=0)
+    # Has Stock rows (see inventory.py); untracked products sell without limit
+    stock_tracked = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Supports keyset pagination on (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="product_created_id_idx"),
+            # Supports the bounded nested product page on category detail
+            models.Index(fields=["category", "-created_at", "-id"], name="product_cat_created_id_idx"),
+            # Category + price range filters
+            models.Index(fields=["category", "price"], name="product_cat_price_idx"),
+            # Rating sort and min_rating filter
+            models.Index(fields=["-rating_avg", "-rating_count", "-id"], name="product_rating_idx"),
+            # Change feed (changes.py) seeks on (updated_at, id)
+            models.Index(fields=["updated_at", "id"], name="product_updated_id_idx"),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
+    @property
+    def rating_histogram(self):
+        return {str(star): getattr(self, f"rating_{star}") for star in range(1, 6)}
+
+    @staticmethod
+    def adjust_ratings(product_id, added=None, removed=None):
+        # Single UPDATE moving one review's rating in (added) and/or out
+        # (removed); call inside the transaction that wrote the review
+        count = (added is not None) - (removed is not None)
+        total = (added or 0) - (removed or 0)
+        changes = {
+            "rating_count": models.F("rating_count") + count,
+            "rating_sum": models.F("rating_sum") + total,
+            # Right-hand sides see the old row, so recompute from the new totals
+            "rating_avg": Cast(models.F("rating_sum") + total, models.FloatField())
+            / Greatest(models.F("rating_count") + count, 1),
+            "updated_at": timezone.now(),
+        }
+        for star, step in ((added, 1), (removed, -1)):
+            if star is not None:
+                column = f"rating_{star}"
+                changes[column] = changes.get(column, models.F(column)) + step
+        Product.objects.filter(pk=product_id).update(**changes)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Price as loaded; a change means stored cart totals need recomputing
+        instance._saved_price = instance.__dict__.get("price")
+        return instance
+
     def save(self, *args, **kwargs):
-        # Auto-generate slug from name if not provided
+        # Auto-generate a unique slug from name if not provided
         if not self.slug and self.name:
-            base = slugify(self.name)
-            slug = base
-            i = 1
-            # Ensure uniqueness
-            while Product.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                i += 1
-                slug = f"{base}-{i}"
-            self.slug = slug
+            return save_with_unique_slug(self, super().save, *args, **kwargs)
         super().save(*args, **kwargs)
 
 
-def _generate_cart_code(length: int = 12) -> str:
+class ProductTombstone(models.Model):
+    # A deleted product, for the change feed (see changes.py); written by
+    # the post_delete signal and pruned after CHANGE_FEED_RETENTION_DAYS
+    product_id = models.BigIntegerField()
+    slug = models.SlugField(max_length=220, null=True, blank=True)
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["deleted_at", "product_id"], name="tombstone_deleted_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"ProductTombstone({self.product_id})"
+
+
+class CatalogVersion(models.Model):
+    # One row (pk 1): the catalog version in response cache keys (see
+    # response_cache.py), in the database so every process shares it
+    version = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self) -> str:
+        return f"CatalogVersion({self.version})"
+
+
+# 36**12 codes: a collision is rare enough that it is retried, not prevented
+CART_CODE_ATTEMPTS = 5
+
+# Most units one cart may hold: Cart.item_count's range on every backend.
+# Cart.subtotal is wide enough for all of them at the highest price
+# (Product.price has 8 integer digits), so capping the count caps the total.
+CART_MAX_QUANTITY = 2_147_483_647
+CART_SUBTOTAL_DIGITS = 20
+
+
+def generate_cart_code(length: int = 12) -> str:
     alphabet = string.ascii_uppercase + string.digits
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
 class Cart(models.Model):
     cart_code = models.CharField(max_length=32, unique=True, db_index=True)
+    # Denormalized totals, kept in step with CartItem writes (see adjust_totals)
+    subtotal = models.DecimalField(max_digits=CART_SUBTOTAL_DIGITS, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ["-updated_at", "-created_at"]
+        indexes = [
+            models.Index(fields=["subtotal"], name="cart_subtotal_idx"),
+            # Range scans for purge_stale_carts
+            models.Index(fields=["updated_at"], name="cart_updated_at_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"Cart({self.cart_code})"
 
     def save(self, *args, **kwargs):
-        if not self.cart_code:
-            # Ensure uniqueness by retrying a few times if collision occurs
-            for _ in range(5):
-                code = _generate_cart_code()
-                if not Cart.objects.filter(cart_code=code).exists():
-                    self.cart_code = code
-                    break
-        super().save(*args, **kwargs)
+        if self.cart_code:
+            return super().save(*args, **kwargs)
+        # Insert optimistically (no exists() probe); retry with a new code
+        # only if the unique constraint says this one is taken
+        for attempt in range(1, CART_CODE_ATTEMPTS + 1):
+            self.cart_code = generate_cart_code()
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                code_taken = Cart.objects.filter(cart_code=self.cart_code).exists()
+                if not code_taken or attempt == CART_CODE_ATTEMPTS:
+                    # Not a code collision (or out of retries): surface the error
+                    self.cart_code = ""
+                    raise
+
+    @staticmethod
+    def adjust_totals(cart_id, quantity_delta, amount_delta):
+        # Single UPDATE; call inside the transaction that changed the items,
+        # which CartTooLarge rolls back
+        updated = Cart.objects.filter(pk=cart_id, item_count__lte=CART_MAX_QUANTITY - quantity_delta).update(
+            item_count=models.F("item_count") + quantity_delta,
+            subtotal=models.F("subtotal") + amount_delta,
+            updated_at=timezone.now(),
+        )
+        if not updated and quantity_delta > 0:
+            raise CartTooLarge()
+
+    def delete(self, *args, **kwargs):
+        # Items cascade with the cart; their stock holds go back first
+        with transaction.atomic(savepoint=False):
+            Stock.release_held(CartItem.objects.filter(cart=self))
+            return super().delete(*args, **kwargs)
+
+    def clear(self):
+        with transaction.atomic():
+            Stock.release_held(self.items.all())
+            self.items.all().delete()
+            Cart.objects.filter(pk=self.pk).update(item_count=0, subtotal=0, updated_at=timezone.now())
+        self.item_count = 0
+        self.subtotal = 0
 
 
 class CartItem(models.Model):
@@ -99,13 +228,138 @@ class CartItem(models.Model):
     def __str__(self) -> str:
         return f"{self.product.name} x{self.quantity} in {self.cart.cart_code}"
 
+    # Quantity as last read from / written to the database, for total deltas
+    _saved_quantity = 0
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_quantity = instance.__dict__.get("quantity", 0)
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            delta = self.quantity - self._saved_quantity
+            if delta:
+                Cart.adjust_totals(self.cart_id, delta, delta * self.product.price)
+                # Last, so the hot stock row stays locked only until commit
+                if delta > 0 and self.product.stock_tracked:
+                    Stock.reserve(self.product_id, delta)
+                elif self.product.stock_tracked:
+                    Stock.release(self.product_id, -delta)
+        self._saved_quantity = self.quantity
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            if self._saved_quantity:
+                Cart.adjust_totals(self.cart_id, -self._saved_quantity, -self._saved_quantity * self.product.price)
+                if self.product.stock_tracked:
+                    Stock.release(self.product_id, self._saved_quantity)
+        self._saved_quantity = 0
+        return result
+
     @property
     def line_total(self):
-        try:
-            return self.quantity * self.product.price
-        except Exception:
-            return 0
-            
+        return self.quantity * self.product.price
+
+
+class CartTooLarge(Exception):
+    def __init__(self):
+        super().__init__(f"A cart holds at most {CART_MAX_QUANTITY} units")
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, requested, available):
+        super().__init__(f"Only {available} of product {product_id} available; {requested} requested")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+class Stock(models.Model):
+    # On-hand and reserved units of a product, over one or more shard rows
+    # so hot products spread their row locks (see inventory.py)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock")
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "shard"], name="stock_product_shard_uniq"),
+            models.CheckConstraint(condition=Q(reserved__lte=F("quantity")), name="stock_reserved_lte_quantity"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Stock({self.product_id}#{self.shard}: {self.reserved}/{self.quantity})"
+
+    @staticmethod
+    def _update_any_shard(product_id, condition, **changes):
+        # One UPDATE of a random shard row meeting `condition`, which is
+        # checked again on the row itself as it is written
+        shard = Stock.objects.filter(condition, product_id=product_id).order_by("?").values("pk")[:1]
+        return Stock.objects.filter(condition, pk=Subquery(shard)).update(**changes)
+
+    @staticmethod
+    def reserve(product_id, quantity):
+        # Hold `quantity` units with a single conditional UPDATE, no read
+        # first; raises InsufficientStock. Call inside the transaction that
+        # writes the cart item.
+        if Stock._update_any_shard(
+            product_id, Q(quantity__gte=F("reserved") + quantity), reserved=F("reserved") + quantity
+        ):
+            return
+        # No one shard has them all (or lost a race): take them shard by
+        # shard, all or nothing
+        free = dict(
+            Stock.objects.filter(product_id=product_id, quantity__gt=F("reserved"))
+            .values_list("pk", F("quantity") - F("reserved"))
+        )
+        if sum(free.values()) >= quantity:
+            with transaction.atomic():
+                remaining = quantity
+                for pk, units in sorted(free.items(), key=lambda item: -item[1]):
+                    take = min(units, remaining)
+                    if Stock.objects.filter(pk=pk, quantity__gte=F("reserved") + take).update(
+                        reserved=F("reserved") + take
+                    ):
+                        remaining -= take
+                    if not remaining:
+                        return
+                transaction.set_rollback(True)
+        elif not free and not Stock.objects.filter(product_id=product_id).exists():
+            return  # tracking was switched off meanwhile
+        raise InsufficientStock(product_id, quantity, sum(free.values()))
+
+    @staticmethod
+    def release(product_id, quantity):
+        # Give `quantity` held units back. Clamped at what is reserved, so
+        # drift (writes that skipped these helpers) can't go negative.
+        if Stock._update_any_shard(product_id, Q(reserved__gte=quantity), reserved=F("reserved") - quantity):
+            return
+        remaining = quantity
+        held = Stock.objects.filter(product_id=product_id, reserved__gt=0).order_by("-reserved")
+        for pk, units in held.values_list("pk", "reserved"):
+            give = min(units, remaining)
+            if Stock.objects.filter(pk=pk, reserved__gte=give).update(reserved=F("reserved") - give):
+                remaining -= give
+            if not remaining:
+                return
+
+    @staticmethod
+    def release_held(items):
+        # Release what the CartItem queryset `items` holds of tracked
+        # products; call before deleting them, in the same transaction
+        held = (
+            items.filter(product__stock_tracked=True).order_by("product_id")
+            .values("product_id").annotate(total=Sum("quantity")).values_list("product_id", "total")
+        )
+        for product_id, total in held:
+            Stock.release(product_id, total)
+
+
 class Review(models.Model):
 
     RATING_CHOICE = [
@@ -119,7 +373,7 @@ class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='reviews' )
     rating = models.PositiveIntegerField(choices=RATING_CHOICE)
-    review = models.TextFieldField(max_length=255)
+    review = models.TextField(max_length=255, blank=True)
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -129,4 +383,29 @@ class Review(models.Model):
         unique_together = ("product", "user")
 
     def __str__(self) -> str:
-        return f"Review by {self.user_name} for {self.product.name}"
\ No newline at end of file
+        return f"Review by {self.user} for {self.product.name}"
+
+    # Rating and product as last read from / written to the database, for
+    # the deltas applied to the product's stored rating aggregates
+    _saved_rating = None
+    _saved_product_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_rating = instance.__dict__.get("rating")
+        instance._saved_product_id = instance.__dict__.get("product_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self._saved_product_id != self.product_id:
+                if self._saved_product_id is not None:
+                    Product.adjust_ratings(self._saved_product_id, removed=self._saved_rating)
+                Product.adjust_ratings(self.product_id, added=self.rating)
+            elif self._saved_rating != self.rating:
+                Product.adjust_ratings(self.product_id, added=self.rating, removed=self._saved_rating)
+        self._saved_rating = self.rating
+        self._saved_product_id = self.product_id
+        # Deletes (including cascades from users) are handled in signals.py
\ No newline at end of file
@@ -0,0 +1,249 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .models import ID_MAX
+
+
+"""
+Pagination helpers.
+
+KeysetPagination seeks on a composite key (e.g. created_at, id) instead of
+using COUNT(*) + OFFSET, so every page costs the same as the first one.
+Cursors are opaque base64 tokens holding the boundary row's key values.
+"""
+
+
+class KeysetPagination(BasePagination):
+    # Ordering fields; prefix with "-" for descending. The last field must be unique.
+    ordering = ("-created_at", "-id")
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        position, reverse = self.decode_cursor(request, queryset.model)
+        ordering = self._ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(position, reverse))
+
+        # Fetch one extra row to learn whether there is another page.
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Opaque pagination cursor.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+    # Cursor encoding
+
+    def _field_names(self):
+        return [f.lstrip("-") for f in self.ordering]
+
+    def _ordering(self, reverse):
+        if not reverse:
+            return list(self.ordering)
+        return [f[1:] if f.startswith("-") else f"-{f}" for f in self.ordering]
+
+    def _seek_filter(self, position, reverse):
+        # Lexicographic "row comes after position" over the ordering fields:
+        # (a > x) OR (a = x AND b > y) OR ...
+        result = Q()
+        equal = {}
+        for field in self._ordering(reverse):
+            name = field.lstrip("-")
+            value = position[name]
+            lookup = "lt" if field.startswith("-") else "gt"
+            result |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return result
+
+    def row_key(self, row):
+        key = {}
+        for name in self._field_names():
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            key[name] = value.isoformat() if hasattr(value, "isoformat") else value
+        return key
+
+    def encode_cursor(self, row, reverse):
+        payload = {"p": self.row_key(row)}
+        if reverse:
+            payload["r"] = 1
+        token = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(",", ":")).encode()
+        ).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    @staticmethod
+    def _query_value(value):
+        # Values that parse but don't fit the columns: datetimes past the
+        # UTC range, integers past 64 bits
+        if isinstance(value, datetime):
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            return value.astimezone(dt_timezone.utc)
+        if isinstance(value, int) and abs(value) > ID_MAX:
+            raise ValueError
+        return value
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            position = payload["p"]
+            if set(position) != set(self._field_names()):
+                raise ValueError
+            # Converted here so a bad value is an invalid cursor, not a 500
+            position = {name: model._meta.get_field(name).to_python(value) for name, value in position.items()}
+            if None in position.values():
+                raise ValueError
+            return {name: self._query_value(value) for name, value in position.items()}, bool(payload.get("r"))
+        except (TypeError, ValueError, KeyError, AttributeError, OverflowError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ProductKeysetPagination(KeysetPagination):
+    ordering = ("-created_at", "-id")
+
+
+class ProductPagination(PageNumberPagination):
+    """
+    Page-number pagination by default (keeps `count` for clients that need a
+    total). Clients opt into keyset pagination with `?pagination=cursor`, and
+    any request carrying a `cursor` token stays in keyset mode.
+    """
+    mode_query_param = "pagination"
+    keyset_class = ProductKeysetPagination
+
+    def use_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or self.keyset_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        # Present with ?facets=true (see ProductViewSet.list)
+        response_schema["properties"]["facets"] = {
+            "type": "object",
+            "properties": {
+                "category": {"type": "array", "items": {"type": "object"}},
+                "price": {"type": "array", "items": {"type": "object"}},
+            },
+        }
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        params = super().get_schema_operation_parameters(view)
+        params.append({
+            "name": self.mode_query_param,
+            "required": False,
+            "in": "query",
+            "description": "Set to `cursor` for keyset pagination (no total count).",
+            "schema": {"type": "string", "enum": ["page", "cursor"]},
+        })
+        params.extend(self.keyset_class().get_schema_operation_parameters(view))
+        return params
+
+
+class CategoryProductsPagination(KeysetPagination):
+    # Nested product page on category detail; params are prefixed so they
+    # don't clash with list pagination.
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = "products_cursor"
+    page_size_query_param = "products_page_size"
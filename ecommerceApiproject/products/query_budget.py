@@ -0,0 +1,123 @@
+import os
+import sys
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import URLPattern, URLResolver
+
+from . import metrics
+
+
+"""
+Helpers for the query budget tests (TestQueryBudgets).
+
+QueryLog records every query a block runs together with its call site: the
+innermost frame in project code and, when the query was issued from library
+code (a related-object descriptor, a DRF field), the library frame that
+made it, e.g.
+
+    products/serializers.py:120 in get_products (via django/db/models/query.py:400 in __iter__)
+
+so an N+1 shows up as one call site with many queries. report() renders a
+log grouped by call site, most queries first.
+
+api_routes() lists (route name, HTTP method) for every URL pattern, which
+the tests compare with their budget table so new routes need a budget.
+"""
+
+PROJECT_DIR = os.path.join(str(settings.BASE_DIR), "")
+# Execute wrappers, not callers
+SKIPPED_FILES = (__file__, metrics.__file__)
+SQL_SAMPLES = 2
+SQL_WIDTH = 240
+
+
+def _short(filename):
+    if filename.startswith(PROJECT_DIR):
+        return os.path.relpath(filename, PROJECT_DIR)
+    for marker in ("site-packages", "dist-packages"):
+        if marker in filename:
+            return filename.split(marker + os.sep, 1)[1]
+    return filename
+
+
+def call_site(frame=None):
+    frame = frame or sys._getframe(1)
+    library = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename in SKIPPED_FILES:
+            frame = frame.f_back
+            continue
+        if filename.startswith(PROJECT_DIR):
+            site = f"{_short(filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+            return f"{site} (via {library})" if library else site
+        if library is None and "/django/db/" not in filename and "/django/dispatch/" not in filename:
+            library = f"{_short(filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return library or "<unknown>"
+
+
+class QueryLog:
+    """Context manager recording (sql, call site) for each query on `using`."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.queries = []
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self._record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append((sql, call_site()))
+        return execute(sql, params, many, context)
+
+    def report(self):
+        """The queries grouped by call site, most queries first."""
+        by_site = defaultdict(list)
+        for sql, site in self.queries:
+            by_site[site].append(sql)
+        lines = []
+        for site, statements in sorted(by_site.items(), key=lambda item: -len(item[1])):
+            lines.append(f"  {len(statements)} x {site}")
+            for sql, count in Counter(statements).most_common(SQL_SAMPLES):
+                sql = sql if len(sql) <= SQL_WIDTH else sql[:SQL_WIDTH] + "..."
+                lines.append(f"      {count} x {sql}")
+        return "\n".join(lines)
+
+
+# Served by the GET handler, or metadata only
+IMPLICIT_METHODS = ("head", "options")
+
+
+def _methods(callback):
+    actions = getattr(callback, "actions", None)
+    if actions is not None:
+        # DRF adds "head" to this mapping on the first request
+        methods = set(actions)
+    else:
+        view_class = getattr(callback, "cls", None) or getattr(callback, "view_class", None)
+        if view_class is None:
+            return {"get"}
+        methods = {m for m in view_class.http_method_names if hasattr(view_class, m)}
+    return methods - set(IMPLICIT_METHODS)
+
+
+def api_routes(patterns):
+    """{(route name, method)} for `patterns` and everything they include."""
+    routes = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            routes |= api_routes(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            routes |= {(pattern.name, method) for method in _methods(pattern.callback)}
+    return routes
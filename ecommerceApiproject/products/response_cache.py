@@ -0,0 +1,168 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from . import category_cache
+from .db_router import use_primary
+from .models import CatalogVersion
+
+
+"""
+Versioned cache of rendered JSON responses for catalog reads.
+
+Keys are namespaced by a catalog version counter; Product/Category save
+and delete signals (and bulk writers) bump it, so every cached page goes
+stale at once without tracking which pages a change touched. Old entries
+are never deleted explicitly, they fall out of the size-bounded LRU
+("catalog" alias in CACHES: LocMemCache per process, or FileBasedCache
+shared between processes).
+
+The counter is a CatalogVersion row on the primary database, not a cache
+key: every process sees a bump (a per-process cache would only see its
+own), and it is never evicted (an evicted key would restart the count and
+bring old entries back). Reading it is one primary-key query per cached
+GET. The bump is an UPDATE in the writer's transaction, so readers see the
+new version exactly when they can see the new data on the primary.
+
+Misses are filled from the primary (use_primary()), body and validators
+alike: the version comes from there, and a lagging replica would otherwise
+store the old data under the new version until the next bump.
+"""
+
+CACHE_ALIAS = "catalog"
+VERSION_PK = 1
+CACHEABLE_FORMATS = ("json",)
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+stats = CacheStats()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def enabled():
+    return getattr(settings, "CATALOG_RESPONSE_CACHE_ENABLED", True)
+
+
+def current_version():
+    version = CatalogVersion.objects.filter(pk=VERSION_PK).values_list("version", flat=True).first()
+    return version or 1
+
+
+async def acurrent_version():
+    version = await CatalogVersion.objects.filter(pk=VERSION_PK).values_list("version", flat=True).afirst()
+    return version or 1
+
+
+def timeout():
+    return getattr(settings, "CATALOG_RESPONSE_CACHE_TIMEOUT", 300)
+
+
+def cache_key(version, namespace, action, request):
+    # Host is part of the key: bodies carry absolute pagination links
+    return f"catalog:{version}:{namespace}:{action}:{request.get_host()}{request.get_full_path()}"
+
+
+def make_entry(response):
+    """What is stored for a rendered 200 response."""
+    return {
+        "content": response.content,
+        "content_type": response["Content-Type"],
+        "headers": {h: response[h] for h in ("ETag", "Last-Modified") if h in response},
+    }
+
+
+def entry_response(entry, request):
+    """Response for a cache hit; a 304 when the client's If-None-Match or If-Modified-Since is satisfied."""
+    response = HttpResponse(entry["content"], content_type=entry["content_type"])
+    for header, value in entry["headers"].items():
+        response[header] = value
+    last_modified = entry["headers"].get("Last-Modified")
+    response = get_conditional_response(
+        request,
+        etag=entry["headers"].get("ETag"),
+        last_modified=last_modified and parse_http_date_safe(last_modified),
+        response=response,
+    )
+    response["X-Cache"] = "HIT"
+    return response
+
+
+def bump_version():
+    """Invalidate every cached catalog response (when the current transaction commits)."""
+    if not CatalogVersion.objects.filter(pk=VERSION_PK).update(version=F("version") + 1):
+        # Row lost (e.g. a flushed database): restart past any count it had
+        # reached, so old entries don't come back
+        CatalogVersion.objects.update_or_create(pk=VERSION_PK, defaults={"version": time.time_ns()})
+
+
+class CachedResponseMixin:
+    """Serve GET list/retrieve from the versioned response cache."""
+
+    cache_namespace = None  # defaults to the viewset basename
+
+    def _cache_key(self, request):
+        namespace = self.cache_namespace or self.basename
+        version = current_version()
+        # A miss renders category blocks; they must be this version's
+        category_cache.sync(version)
+        return cache_key(version, namespace, self.action, request)
+
+    def _cacheable(self, request):
+        return (
+            enabled()
+            and request.method == "GET"
+            and request.accepted_renderer.format in CACHEABLE_FORMATS
+        )
+
+    def _cached(self, handler, request, *args, **kwargs):
+        if not self._cacheable(request):
+            return handler(request, *args, **kwargs)
+        key = self._cache_key(request)
+        entry = _cache().get(key)
+        stats.record(entry is not None)
+        if entry is None:
+            self._response_cache_key = key
+            with use_primary():
+                return handler(request, *args, **kwargs)
+        return entry_response(entry, request)
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, "_response_cache_key", None)
+        if key is not None and response.status_code == 200:
+            response.render()
+            _cache().set(key, make_entry(response), timeout=timeout())
+            response["X-Cache"] = "MISS"
+        return response
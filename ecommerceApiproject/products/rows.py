@@ -0,0 +1,240 @@
+from collections import defaultdict
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .images import media_url_builder
+from .metrics import timed
+
+
+"""
+Fast read path for list endpoints: render .values() rows instead of model
+instances.
+
+compile_plan() turns a ModelSerializer class into a row plan once: the
+columns to select and, per output field, how to get its representation
+from a row. Fields whose representation is the column value (CharField,
+IntegerField) are copied; others call the bound field's to_representation,
+so the JSON matches what the serializer renders from instances. Supported:
+
+- model column fields (dotted sources follow foreign keys);
+- file and image fields, rendered to (absolute) URLs from the stored name;
+- nested serializers over a foreign key, flattened into the same row;
+- nested many=True serializers over a reverse foreign key, fetched for the
+  whole page in one extra query;
+- SerializerMethodFields the serializer computes in SQL via
+  `row_annotations` (top-level serializers only).
+
+A field can also define row_representation(), returning the value ->
+representation function to use for a whole page (e.g. with per-page setup
+hoisted out of to_representation).
+
+A plan can cover a subset of the top-level fields (sparse fieldsets, see
+fieldsets.py); it then selects only the columns those fields read.
+
+The serializer class is still what validates input and describes the
+OpenAPI schema; RowListMixin only changes how the list action renders.
+"""
+
+# Representations equal to the database value; no per-row call needed
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField)
+
+_plans = {}
+
+
+class RowPlan:
+    def __init__(self, serializer_class, prefix=""):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.pk_column = f"{prefix}{self.model._meta.pk.attname}"
+        self.columns = [self.pk_column]
+        self.annotations = {}
+        # (name, kind, column, extra) in serializer field order
+        self.fields = []
+        # (name, related model, foreign key attname, child plan)
+        self.children = []
+
+    def add_column(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+
+def compile_plan(serializer_class, prefix="", fields=None):
+    """
+    The row plan for `serializer_class`, or for just its `fields` (a tuple
+    of names) when given. Cached per class, column prefix and fields.
+    """
+    plan = _plans.get((serializer_class, prefix, fields))
+    if plan is not None:
+        return plan
+
+    plan = RowPlan(serializer_class, prefix)
+    model = plan.model
+    annotations = getattr(serializer_class, "row_annotations", {})
+    # An unbound instance, only to read the declared fields
+    for field in serializer_class()._readable_fields:
+        name = field.field_name
+        if fields is not None and name not in fields:
+            continue
+        source = field.source.replace(".", "__")
+        where = f"{serializer_class.__name__}.{name}"
+        if isinstance(field, serializers.ListSerializer):
+            relation = model._meta.get_field(field.source)
+            if not relation.one_to_many:
+                raise ImproperlyConfigured(f"{where}: many=True needs a reverse foreign key")
+            child = compile_plan(type(field.child))
+            plan.children.append((name, relation.related_model, relation.field.attname, child))
+            plan.fields.append((name, "children", name, None))
+        elif isinstance(field, serializers.BaseSerializer):
+            nested = compile_plan(type(field), prefix=f"{prefix}{source}__")
+            if nested.annotations:
+                raise ImproperlyConfigured(f"{where}: row_annotations only work on the top-level serializer")
+            for column in nested.columns:
+                plan.add_column(column)
+            plan.fields.append((name, "nested", nested.pk_column, nested))
+        elif isinstance(field, serializers.SerializerMethodField):
+            if prefix or name not in annotations:
+                raise ImproperlyConfigured(f"{where}: method fields need a row_annotations entry")
+            plan.annotations[name] = annotations[name]
+            plan.fields.append((name, "value", plan.add_column(name), None))
+        elif field.source == "*":
+            raise ImproperlyConfigured(f"{where}: source='*' needs an instance")
+        elif isinstance(field, serializers.FileField):
+            storage = model._meta.get_field(field.source).storage
+            plan.fields.append((name, "file", plan.add_column(f"{prefix}{source}"), storage))
+        else:
+            kind = "value" if isinstance(field, PASSTHROUGH_FIELDS) else "field"
+            plan.fields.append((name, kind, plan.add_column(f"{prefix}{source}"), None))
+    _plans[(serializer_class, prefix, fields)] = plan
+    return plan
+
+
+def row_queryset(queryset, serializer_class, extra_columns=(), fields=None):
+    """`queryset` as .values() rows with every column `serializer_class` (or its `fields`) renders."""
+    plan = compile_plan(serializer_class, fields=fields)
+    columns = [c for c in plan.columns if c not in plan.annotations]
+    columns += [c for c in extra_columns if c not in plan.columns]
+    return queryset.values(*columns, **plan.annotations)
+
+
+def _column(column, to_representation=None):
+    if to_representation is None:
+        return lambda row: row[column]
+
+    def step(row):
+        value = row[column]
+        return None if value is None else to_representation(value)
+
+    return step
+
+
+def _file_url(column, field, storage, request):
+    # As serializers.FileField.to_representation
+    use_url = getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL)
+    url_for = media_url_builder(storage, request) if use_url else str
+
+    def step(row):
+        name = row[column]
+        return url_for(name) if name else None
+
+    return step
+
+
+def _nested(pk_column, convert):
+    # A null foreign key renders as None, like the serializer
+    return lambda row: None if row[pk_column] is None else convert(row)
+
+
+def _children(name, convert):
+    return lambda row: [convert(child) for child in row[name]]
+
+
+def _converter(plan, fields, request):
+    """Compile `plan` against bound `fields` into a row -> dict function."""
+    steps = []
+    for name, kind, column, extra in plan.fields:
+        field = fields[name]
+        if kind == "value":
+            step = _column(column)
+        elif kind == "field":
+            to_representation = getattr(field, "row_representation", None)
+            to_representation = to_representation() if to_representation else field.to_representation
+            step = _column(column, to_representation)
+        elif kind == "file":
+            step = _file_url(column, field, extra, request)
+        elif kind == "nested":
+            step = _nested(column, _converter(extra, field.fields, request))
+        else:
+            child_plan = next(child for n, _m, _fk, child in plan.children if n == name)
+            step = _children(name, _converter(child_plan, field.child.fields, request))
+        steps.append((name, step))
+    return lambda row: {name: step(row) for name, step in steps}
+
+
+def attach_children(plan, rows):
+    """Add each many=True relation's rows to `rows`, one query per relation."""
+    if not plan.children or not rows:
+        return rows
+    pks = [row[plan.pk_column] for row in rows]
+    for name, model, fk_name, child_plan in plan.children:
+        grouped = defaultdict(list)
+        queryset = model._default_manager.filter(**{f"{fk_name}__in": pks})
+        for child in row_queryset(queryset, child_plan.serializer_class, extra_columns=(fk_name,)):
+            grouped[child[fk_name]].append(child)
+        for row in rows:
+            row[name] = grouped.get(row[plan.pk_column], [])
+    return rows
+
+
+class RowSerializer:
+    """
+    Stand-in for `serializer_class(rows, many=True, context=context)` over
+    rows from row_queryset(); `.data` is the same list of dicts, limited to
+    `fields` when given.
+    """
+
+    def __init__(self, serializer_class, rows, context=None, fields=None):
+        self.plan = compile_plan(serializer_class, fields=fields)
+        self.rows = rows
+        self.context = context or {}
+
+    @property
+    def data(self):
+        rows = attach_children(self.plan, list(self.rows))
+        with timed("serialize"):
+            # Bind the fields once per page so they see the request context
+            fields = self.plan.serializer_class(context=self.context).fields
+            convert = _converter(self.plan, fields, self.context.get("request"))
+            return [convert(row) for row in rows]
+
+
+# Renders the list action from .values() rows via the list serializer's row
+# plan; `row_extra_columns` are selected too, e.g. keyset pagination keys.
+# get_row_fields() can limit the plan to some fields (SparseFieldsetMixin).
+# (No docstring: drf-spectacular would use it as the operation description.)
+class RowListMixin:
+    row_extra_columns = ()
+
+    def get_row_fields(self):
+        return None
+
+    def _row_queryset(self, queryset):
+        return row_queryset(queryset, self.get_serializer_class(), self.row_extra_columns, self.get_row_fields())
+
+    def paginate_queryset(self, queryset):
+        if self.action == "list":
+            queryset = self._row_queryset(queryset)
+        return super().paginate_queryset(queryset)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == "list" and kwargs.get("many"):
+            rows = args[0]
+            if self.paginator is None:
+                # Unpaginated list: the queryset hasn't been converted yet
+                rows = self._row_queryset(rows)
+            return RowSerializer(
+                self.get_serializer_class(), rows, context=self.get_serializer_context(), fields=self.get_row_fields()
+            )
+        return super().get_serializer(*args, **kwargs)
@@ -0,0 +1,294 @@
+import html
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from .changes import OP_DELETED, CursorExpired, encode_cursor, product_changes
+from .models import Product
+
+
+"""
+Full-text product search.
+
+On SQLite the catalog is indexed by an FTS5 external-content table over
+Product.name/description, kept in sync by triggers (so bulk_create and
+bulk_update are covered too). ensure_fts() installs the table and triggers
+idempotently after every migrate: SQLite table rebuilds during migrations
+drop triggers, and this puts them back and reindexes.
+
+Other backends fall back to a process-local inverted index, built on first
+search. Product save/delete signals update it right away for this
+process's writes; before each search it also applies the change feed
+(changes.py) since its last sync, which covers bulk writes and the other
+processes' writes.
+
+Both return (product_id, rank, snippet) rows, best match first; snippets
+mark matches with <mark>...</mark> around HTML-escaped text.
+"""
+
+FTS_TABLE = "products_product_fts"
+MAX_TERMS = 10
+SNIPPET_TOKENS = 12
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+ELLIPSIS = "…"
+# Changes read per change feed query when syncing the in-memory index
+SYNC_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='products_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+FTS_OBJECTS = {FTS_TABLE, f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au"}
+
+# Per-alias cache of "FTS5 index is installed"
+_fts_ready = {}
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def query_terms(query):
+    # Deduplicated, order-preserving, capped
+    return list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+
+
+def ensure_fts(using=DEFAULT_DB_ALIAS):
+    """Create the FTS5 table and triggers if missing; reindex when anything was created."""
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)" % ", ".join(["%s"] * len(FTS_OBJECTS)),
+            sorted(FTS_OBJECTS),
+        )
+        present = {row[0] for row in cursor.fetchall()}
+        if present != FTS_OBJECTS:
+            try:
+                for statement in FTS_SQL:
+                    cursor.execute(statement)
+            except Exception:
+                # SQLite built without FTS5: use the in-memory fallback
+                _fts_ready[using] = False
+                return False
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _fts_ready[using] = True
+    return True
+
+
+def fts_available(using=DEFAULT_DB_ALIAS):
+    ready = _fts_ready.get(using)
+    if ready is None:
+        connection = connections[using]
+        if connection.vendor != "sqlite":
+            ready = _fts_ready[using] = False
+        else:
+            # A missing table isn't cached: ensure_fts may create it after a migrate
+            ready = FTS_TABLE in connection.introspection.table_names()
+            if ready:
+                _fts_ready[using] = True
+    return ready
+
+
+def _highlight(text, is_match):
+    return " ".join(
+        f"{HIGHLIGHT_OPEN}{html.escape(word)}{HIGHLIGHT_CLOSE}" if is_match(word) else html.escape(word)
+        for word in text.split()
+    )
+
+
+def _fts_search(terms, limit, offset, using):
+    match = " ".join('"%s"*' % term.replace('"', '""') for term in terms)
+    # snippet() doesn't escape, so mark with control characters, escape, then swap in tags
+    sql = (
+        f"SELECT rowid, bm25({FTS_TABLE}, 10.0, 1.0) AS rank, "
+        f"snippet({FTS_TABLE}, -1, char(2), char(3), %s, %s) "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s"
+    )
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [ELLIPSIS, SNIPPET_TOKENS, match, limit, offset])
+        rows = cursor.fetchall()
+    # bm25() is lower-is-better; flip so higher means more relevant
+    return [
+        (pk, -rank, html.escape(snippet).replace("\x02", HIGHLIGHT_OPEN).replace("\x03", HIGHLIGHT_CLOSE))
+        for pk, rank, snippet in rows
+    ]
+
+
+class InMemorySearchIndex:
+    """Inverted index over product name/description with prefix matching."""
+
+    NAME_WEIGHT = 10.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None  # term -> {product_id: weighted term frequency}
+        self._terms = []  # sorted vocabulary, for prefix lookups
+        self._docs = {}  # product_id -> (name, description)
+        self._cursor = None  # change feed position the index is synced to
+
+    def _ensure_built(self):
+        if self._postings is None:
+            with self._lock:
+                if self._postings is None:
+                    # Changes stamped from here on (less the feed's settle
+                    # window) are applied again by the first sync
+                    started = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_SETTLE_SECONDS)
+                    self._postings = defaultdict(dict)
+                    self._docs = {}
+                    rows = Product.objects.order_by().values_list("pk", "name", "description")
+                    for pk, name, description in rows.iterator(chunk_size=2000):
+                        self._add(pk, name, description, keep_sorted=False)
+                    self._terms = sorted(self._postings)
+                    self._cursor = encode_cursor(started, 0)
+
+    def _sync(self):
+        # Two indexed queries when nothing changed
+        queryset = Product.objects.only("id", "name", "description", "created_at", "updated_at")
+        since = self._cursor
+        while True:
+            changes, since, has_more = product_changes(queryset, since=since, limit=SYNC_BATCH_SIZE)
+            with self._lock:
+                for op, record in changes:
+                    if op == OP_DELETED:
+                        self._remove(record.product_id)
+                    else:
+                        self._remove(record.pk)
+                        self._add(record.pk, record.name, record.description)
+                self._cursor = since
+            if not has_more:
+                return
+
+    def _add(self, pk, name, description, keep_sorted=True):
+        self._docs[pk] = (name, description)
+        for weight, text in ((self.NAME_WEIGHT, name), (1.0, description)):
+            for term in tokenize(text):
+                if keep_sorted and term not in self._postings:
+                    insort(self._terms, term)
+                postings = self._postings[term]
+                postings[pk] = postings.get(pk, 0.0) + weight
+
+    def _remove(self, pk):
+        doc = self._docs.pop(pk, None)
+        if doc is None:
+            return
+        for term in set(tokenize(doc[0]) + tokenize(doc[1])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[term]
+                    del self._terms[bisect_left(self._terms, term)]
+
+    def update(self, pk, name, description):
+        if self._postings is None:
+            return
+        with self._lock:
+            self._remove(pk)
+            self._add(pk, name, description)
+
+    def remove(self, pk):
+        if self._postings is None:
+            return
+        with self._lock:
+            self._remove(pk)
+
+    def reset(self):
+        with self._lock:
+            self._postings = None
+            self._terms = []
+            self._docs = {}
+            self._cursor = None
+
+    def _expand(self, prefix):
+        terms = self._terms
+        for i in range(bisect_left(terms, prefix), len(terms)):
+            if not terms[i].startswith(prefix):
+                break
+            yield terms[i]
+
+    def search(self, terms, limit, offset):
+        self._ensure_built()
+        try:
+            self._sync()
+        except CursorExpired:
+            # Not searched for longer than the feed keeps tombstones
+            self.reset()
+            self._ensure_built()
+        with self._lock:
+            return self._search(terms, limit, offset)
+
+    def _search(self, terms, limit, offset):
+        total_docs = max(len(self._docs), 1)
+        scores = None
+        for prefix in terms:
+            # Every query term must match (as a prefix), like FTS5's implicit AND
+            term_scores = defaultdict(float)
+            for term in self._expand(prefix):
+                postings = self._postings[term]
+                idf = math.log(1 + total_docs / len(postings))
+                for pk, tf in postings.items():
+                    term_scores[pk] += tf * idf
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {pk: s + term_scores[pk] for pk, s in scores.items() if pk in term_scores}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[offset:offset + limit]
+        return [(pk, score, self.snippet(pk, terms)) for pk, score in ranked]
+
+    def snippet(self, pk, terms):
+        def is_match(word):
+            return any(token.startswith(term) for token in tokenize(word) for term in terms)
+
+        name, description = self._docs[pk]
+        for text in (description, name):
+            words = text.split()
+            hit = next((i for i, word in enumerate(words) if is_match(word)), None)
+            if hit is not None:
+                start = max(0, hit - SNIPPET_TOKENS // 2)
+                window = " ".join(words[start:start + SNIPPET_TOKENS])
+                prefix = ELLIPSIS if start > 0 else ""
+                suffix = ELLIPSIS if start + SNIPPET_TOKENS < len(words) else ""
+                return prefix + _highlight(window, is_match) + suffix
+        return html.escape(name)
+
+
+memory_index = InMemorySearchIndex()
+
+
+def search_products(query, limit=20, offset=0, using=DEFAULT_DB_ALIAS):
+    """Return [(product_id, rank, snippet)] for `query`, best match first."""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    if fts_available(using):
+        return _fts_search(terms, limit, offset, using)
+    return memory_index.search(terms, limit, offset)
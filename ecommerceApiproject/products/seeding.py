@@ -0,0 +1,157 @@
+import random
+import string
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from . import category_cache, response_cache
+from .db_router import use_primary
+from .models import Cart, CartItem, Category, Product, ProductTombstone, Review, Stock
+
+
+"""
+Deterministic catalogs for load tests and benchmarks.
+
+seed_catalog() fills an empty catalog from a seeded random.Random: the same
+arguments always give the same categories, products (names, slugs, prices,
+rating aggregates) and carts (codes, items, stored totals); only the
+timestamps differ between runs. Rows are bulk inserted in batches and the
+denormalized aggregates are computed while generating them, so no signals
+or fix-up passes run; the catalog caches are invalidated at the end.
+
+SIZES are the presets of the seed_catalog command and benchmarks/load.py.
+"""
+
+SIZES = {
+    "10k": {"products": 10_000, "categories": 50, "carts": 1_000},
+    "100k": {"products": 100_000, "categories": 200, "carts": 10_000},
+    "1m": {"products": 1_000_000, "categories": 1_000, "carts": 100_000},
+}
+SEED_BATCH_SIZE = 5000
+MAX_ITEMS_PER_CART = 5
+# Share of products with reviews
+REVIEWED_SHARE = 0.6
+
+CART_CODE_ALPHABET = string.ascii_uppercase + string.digits
+ADJECTIVES = (
+    "Classic", "Compact", "Deluxe", "Everyday", "Heavy", "Light", "Modern", "Portable",
+    "Premium", "Rugged", "Slim", "Smart", "Soft", "Sturdy", "Vintage", "Wireless",
+)
+MATERIALS = (
+    "Bamboo", "Canvas", "Ceramic", "Copper", "Cotton", "Glass", "Leather", "Linen",
+    "Maple", "Oak", "Steel", "Wool",
+)
+NOUNS = (
+    "Backpack", "Blanket", "Bottle", "Bowl", "Chair", "Clock", "Desk", "Headphones",
+    "Jacket", "Kettle", "Lamp", "Mug", "Notebook", "Pan", "Pillow", "Shelf",
+    "Speaker", "Table", "Towel", "Umbrella", "Vase", "Wallet", "Watch",
+)
+
+
+def _batches(total, size):
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+def _product(rng, i, category_ids):
+    name = f"{rng.choice(ADJECTIVES)} {rng.choice(MATERIALS)} {rng.choice(NOUNS)}"
+    product = Product(
+        name=name,
+        # Unique without a lookup: the index is part of the slug
+        slug=f"{name.lower().replace(' ', '-')}-{i}",
+        description=f"{name} number {i}, {rng.choice(ADJECTIVES).lower()} and {rng.choice(ADJECTIVES).lower()}.",
+        price=Decimal(rng.randint(100, 50_000)).scaleb(-2),
+        category_id=rng.choice(category_ids),
+    )
+    if rng.random() < REVIEWED_SHARE:
+        counts = [rng.randint(0, 12) for _ in range(5)]
+        counts[rng.randrange(5)] += 1  # at least one review
+        for stars, count in enumerate(counts, start=1):
+            setattr(product, f"rating_{stars}", count)
+        product.rating_count = sum(counts)
+        product.rating_sum = sum(stars * count for stars, count in enumerate(counts, start=1))
+        product.rating_avg = product.rating_sum / product.rating_count
+    return product
+
+
+def _cart_code(rng, taken):
+    while True:
+        code = "".join(rng.choices(CART_CODE_ALPHABET, k=12))
+        if code not in taken:
+            taken.add(code)
+            return code
+
+
+@use_primary()
+def seed_catalog(
+    products, categories, carts, max_items_per_cart=MAX_ITEMS_PER_CART, seed=0,
+    batch_size=SEED_BATCH_SIZE, progress=None,
+):
+    """
+    Insert a deterministic catalog into an empty database and return the
+    row counts. `progress(table, rows_so_far)` is called after each batch.
+    """
+    if Product.objects.exists() or Category.objects.exists() or Cart.objects.exists():
+        raise ValueError("The catalog is not empty; flush it first")
+    if categories < 1:
+        raise ValueError("At least one category is needed")
+    progress = progress or (lambda table, rows: None)
+    rng = random.Random(seed)
+
+    category_ids = []
+    for batch in _batches(categories, batch_size):
+        created = Category.objects.bulk_create(
+            [Category(name=f"Category {i}", slug=f"category-{i}") for i in batch]
+        )
+        category_ids += [category.pk for category in created]
+        progress("categories", len(category_ids))
+
+    product_ids = []
+    prices = []
+    for batch in _batches(products, batch_size):
+        with transaction.atomic():
+            created = Product.objects.bulk_create([_product(rng, i, category_ids) for i in batch])
+        product_ids += [product.pk for product in created]
+        prices += [product.price for product in created]
+        progress("products", len(product_ids))
+
+    codes = set()
+    items_total = 0
+    carts_total = 0
+    for batch in _batches(carts, batch_size):
+        new_carts = []
+        lines = []  # per cart: [(product index, quantity)]
+        for _ in batch:
+            count = rng.randint(0, min(max_items_per_cart, len(product_ids)))
+            cart_lines = [(index, rng.randint(1, 3)) for index in rng.sample(range(len(product_ids)), count)]
+            new_carts.append(Cart(
+                cart_code=_cart_code(rng, codes),
+                subtotal=sum((prices[index] * quantity for index, quantity in cart_lines), Decimal("0.00")),
+                item_count=sum(quantity for _index, quantity in cart_lines),
+            ))
+            lines.append(cart_lines)
+        with transaction.atomic():
+            Cart.objects.bulk_create(new_carts)
+            items = [
+                CartItem(cart_id=cart.pk, product_id=product_ids[index], quantity=quantity)
+                for cart, cart_lines in zip(new_carts, lines)
+                for index, quantity in cart_lines
+            ]
+            CartItem.objects.bulk_create(items, batch_size=batch_size)
+        carts_total += len(new_carts)
+        items_total += len(items)
+        progress("carts", carts_total)
+
+    # Bulk writes skip the signals that invalidate these
+    response_cache.bump_version()
+    category_cache.invalidate()
+    return {"categories": len(category_ids), "products": len(product_ids), "carts": carts_total, "cart_items": items_total}
+
+
+def flush_catalog():
+    """Delete every review, cart, stock row, product, tombstone and category with one DELETE per table."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (Review, CartItem, Cart, Stock, Product, ProductTombstone, Category):
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+    response_cache.bump_version()
+    category_cache.invalidate()
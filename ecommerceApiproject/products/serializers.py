@@ -1,6 +1,14 @@
 from rest_framework import serializers
-from .models import Product, Category, Cart, CartItem, Review
+from .models import CART_MAX_QUANTITY, CART_SUBTOTAL_DIGITS, ID_MAX, Product, Category, Cart, CartItem, Review
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db.models import DecimalField, ExpressionWrapper, F
+from drf_spectacular.utils import extend_schema_field
+from .carts import OP_ADD, OPERATIONS
+from .category_cache import get_category_block
+from .images import media_url_builder, srcset
+from .metrics import TimedSerializerMixin
+from .pagination import CategoryProductsPagination
 
 
 """
@@ -10,13 +18,55 @@ Restructured serializers:
 """
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+@extend_schema_field({"type": "object", "additionalProperties": {"type": "string"}})
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """srcset strings per format ({"webp": "url 160w, ..."}) from the image_variants manifest."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("source", "image_variants")
+        super().__init__(**kwargs)
+
+    def to_representation(self, manifest):
+        return srcset(manifest, media_url_builder(default_storage, self.context.get("request")))
+
+    def row_representation(self):
+        # rows.py: one URL builder for the whole page
+        url_for = media_url_builder(default_storage, self.context.get("request"))
+        return lambda manifest: srcset(manifest, url_for)
+
+
+@extend_schema_field({"type": "number", "nullable": True})
+class RatingField(serializers.ReadOnlyField):
+    """Average review rating from the stored aggregate, or None without reviews."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("source", "rating_avg")
+        super().__init__(**kwargs)
+
+    def to_representation(self, rating_avg):
+        # Ratings are 1-5, so an average of 0 means no reviews
+        return round(rating_avg, 2) if rating_avg else None
+
+
+class ProductListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    image_srcset = ImageSrcsetField()
+    rating = RatingField()
+
     class Meta:
         model = Product
-        fields = ["id", "name", "slug", "image", "price"]
+        fields = ["id", "name", "slug", "image", "image_srcset", "price", "rating", "rating_count"]
+
 
+class ProductSearchResultSerializer(ProductListSerializer):
+    # Set on each instance by ProductViewSet.search
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+    class Meta(ProductListSerializer.Meta):
+        fields = ProductListSerializer.Meta.fields + ["rank", "snippet"]
+
+
+class ProductDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Read: nested minimal category; Write: category_id
     from typing import Optional  # noqa: F401 (type hints only)
     # Import here to avoid circular import ordering issues in some IDEs
@@ -26,42 +76,84 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         queryset=Category.objects.all(), source='category', write_only=True, allow_null=True, required=False
     )
 
+    image_srcset = ImageSrcsetField()
+    rating = RatingField()
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
     class Meta:
         model = Product
         fields = [
-            "id", "name", "description", "slug", "image", "price",
-            "category", "category_id"
+            "id", "name", "description", "slug", "image", "image_srcset", "price",
+            "category", "category_id", "rating", "rating_count", "rating_histogram"
         ]
+        read_only_fields = ["rating_count"]
 
     def get_category(self, obj):
-        # Minimal shape for nested category in detail responses
-        if obj.category_id:
-            return {
-                "id": obj.category_id,
-                "name": obj.category.name,
-                "slug": obj.category.slug,
-                "image": obj.category.image.url if obj.category.image else None,
-            }
-        return None
-
-
-class CategoryListSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Category
-        fields = ["id", "name", "slug", "image"]
+        # Minimal shape for nested category in detail responses, served from
+        # the process-local category cache (no per-row query). Async views
+        # look the block up beforehand and pass it in, as a reload here would
+        # be a synchronous query.
+        if "category_block" in self.context:
+            return self.context["category_block"]
+        return get_category_block(obj.category_id)
 
 
-class CategoryDetailSerializer(serializers.ModelSerializer):
-    # Include minimal product info on detail using the list serializer
-    products = ProductListSerializer(many=True, read_only=True)
+class CategoryListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Category
-        fields = ["id", "name", "slug", "image", "products"]
-        read_only_fields = ["id", "slug", "products"]
+        fields = ["id", "name", "slug", "image", "image_srcset"]
+
 
+class CategoryDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Include a bounded, cursor-paginated page of minimal product info
+    products = serializers.SerializerMethodField(read_only=True)
+    products_next = serializers.SerializerMethodField(read_only=True)
+    product_count = serializers.SerializerMethodField(read_only=True)
+    image_srcset = ImageSrcsetField()
 
-class CartItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ["id", "name", "slug", "image", "image_srcset", "products", "products_next", "product_count"]
+        read_only_fields = ["id", "slug", "products", "products_next", "product_count"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._products_pages = {}
+
+    def _products_page(self, obj):
+        # Paginate once per category; both products and products_next read it
+        pages = self._products_pages
+        if obj.pk not in pages:
+            paginator = CategoryProductsPagination()
+            queryset = obj.products.all()
+            request = self.context.get("request")
+            if request is None:
+                rows = list(queryset.order_by(*paginator.ordering)[:paginator.page_size])
+                pages[obj.pk] = (rows, None)
+            else:
+                rows = paginator.paginate_queryset(queryset, request)
+                pages[obj.pk] = (rows, paginator.get_next_link())
+        return pages[obj.pk]
+
+    @extend_schema_field(ProductListSerializer(many=True))
+    def get_products(self, obj):
+        rows, _next = self._products_page(obj)
+        return ProductListSerializer(rows, many=True, context=self.context).data
+
+    @extend_schema_field(serializers.URLField(allow_null=True))
+    def get_products_next(self, obj):
+        return self._products_page(obj)[1]
+
+    @extend_schema_field(serializers.IntegerField())
+    def get_product_count(self, obj):
+        # Annotated by CategoryViewSet on retrieve; fall back to a COUNT otherwise
+        count = getattr(obj, "product_count", None)
+        return obj.products.count() if count is None else count
+
+
+class CartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = ProductListSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source='product', write_only=True
@@ -75,33 +167,75 @@ class CartItemSerializer(serializers.ModelSerializer):
             "created_at", "updated_at"
         ]
         read_only_fields = ["id", "line_total", "created_at", "updated_at", "product"]
+        extra_kwargs = {"quantity": {"max_value": CART_MAX_QUANTITY}}
+
+    # For the .values() list path (rows.py); same value as CartItem.line_total
+    row_annotations = {
+        "line_total": ExpressionWrapper(
+            F("quantity") * F("product__price"),
+            output_field=DecimalField(max_digits=CART_SUBTOTAL_DIGITS, decimal_places=2),
+        ),
+    }
 
     def get_line_total(self, obj):
         return obj.line_total
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
-    total = serializers.SerializerMethodField(read_only=True)
+    # Stored on the cart and maintained on item writes; no per-read summing
+    total = serializers.DecimalField(
+        source="subtotal", max_digits=CART_SUBTOTAL_DIGITS, decimal_places=2, coerce_to_string=False, read_only=True
+    )
 
     class Meta:
         model = Cart
-        fields = ["id", "cart_code", "items", "total", "created_at", "updated_at"]
-        read_only_fields = ["id", "cart_code", "items", "total", "created_at", "updated_at"]
-    def get_total(self, obj):
-        return sum(item.line_total for item in obj.items.all())
+        fields = ["id", "cart_code", "items", "total", "item_count", "created_at", "updated_at"]
+        read_only_fields = ["id", "cart_code", "items", "total", "item_count", "created_at", "updated_at"]
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    # Plain integer: existence is checked for the whole batch in one query
+    product_id = serializers.IntegerField(min_value=1, max_value=ID_MAX)
+    quantity = serializers.IntegerField(min_value=0, max_value=CART_MAX_QUANTITY, required=False, default=1)
+
+    def validate(self, attrs):
+        if attrs["op"] == OP_ADD and attrs["quantity"] < 1:
+            raise serializers.ValidationError({"quantity": "add requires a positive quantity"})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=200)
+
+    def validate(self, attrs):
+        # One query checks the products exist and fetches their prices and
+        # whether their stock is tracked
+        ids = {operation["product_id"] for operation in attrs["operations"]}
+        rows = Product.objects.filter(pk__in=ids).order_by().values_list("pk", "price", "stock_tracked")
+        prices = {pk: price for pk, price, _tracked in rows}
+        missing = sorted(ids - set(prices))
+        if missing:
+            raise serializers.ValidationError({"operations": f"Unknown product ids: {missing}"})
+        attrs["prices"] = prices
+        attrs["tracked"] = {pk for pk, _price, tracked in rows if tracked}
+        return attrs
+
   
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ['id', 'first_name', 'last_name']
         read_only_fields = ['id']
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    # Read-only, but the default lets the (product, user) unique check run
+    user = serializers.PrimaryKeyRelatedField(read_only=True, default=serializers.CurrentUserDefault())
 
     class Meta:
         model = Review
-        fields = ['id', 'product', 'user', 'rating', 'comment', 'created_at', 'updated_at']
+        fields = ['id', 'product', 'user', 'rating', 'review', 'comment', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at', 'user']
 
     def create(self, validated_data):
@@ -0,0 +1,128 @@
+import logging
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import category_cache, images, response_cache, search
+from .carts import recompute_cart_totals
+from .models import Cart, Category, Product, ProductTombstone, Review
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    # Drop now for this process, and again once the change is visible to others
+    category_cache.invalidate()
+    transaction.on_commit(category_cache.invalidate)
+
+
+@receiver(post_save, sender=Category)
+def touch_products_on_category_save(sender, instance, created, **kwargs):
+    # Their bodies nest the category block; bump updated_at for the change feed
+    if not created:
+        Product.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Category)
+def touch_products_before_category_delete(sender, instance, **kwargs):
+    # Inside the delete's transaction, before SET_NULL clears their category
+    # with an UPDATE that leaves updated_at alone
+    Product.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+def recompute_carts_on_price_change(sender, instance, created, **kwargs):
+    saved_price = getattr(instance, "_saved_price", None)
+    if not created and saved_price is not None and saved_price != instance.price:
+        recompute_cart_totals(Cart.objects.filter(items__product=instance))
+    instance._saved_price = instance.price
+
+
+@receiver(pre_delete, sender=Product)
+def remember_carts_before_product_delete(sender, instance, **kwargs):
+    # Cart items cascade away with the product; note whose totals to fix
+    instance._affected_cart_ids = list(
+        Cart.objects.filter(items__product=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def recompute_carts_after_product_delete(sender, instance, **kwargs):
+    cart_ids = getattr(instance, "_affected_cart_ids", None)
+    if cart_ids:
+        recompute_cart_totals(Cart.objects.filter(pk__in=cart_ids))
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    # Only the in-memory fallback needs this; FTS5 is maintained by triggers
+    search.memory_index.update(instance.pk, instance.name, instance.description)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.memory_index.remove(instance.pk)
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    if sender.name == "products":
+        search.ensure_fts(using)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, origin=None, **kwargs):
+    # Also covers cascades (user deletes); runs inside the delete's transaction.
+    # Reviews cascading from their product's delete are skipped, one UPDATE
+    # each of a row that is going too.
+    if isinstance(origin, Product) or (isinstance(origin, QuerySet) and origin.model is Product):
+        return
+    if instance._saved_rating is not None:
+        Product.adjust_ratings(instance._saved_product_id, removed=instance._saved_rating)
+
+
+@receiver(post_delete, sender=Product)
+def record_product_tombstone(sender, instance, **kwargs):
+    # For the change feed; inside the delete's transaction, so a rolled
+    # back delete leaves none
+    ProductTombstone.objects.create(product_id=instance.pk, slug=instance.slug, deleted_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Review)
+def bump_catalog_version(sender, origin=None, **kwargs):
+    # One UPDATE per bump: reviews cascading from a product delete leave it
+    # to the product's
+    if sender is Review and (
+        isinstance(origin, Product) or (isinstance(origin, QuerySet) and origin.model is Product)
+    ):
+        return
+    response_cache.bump_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def refresh_image_variants(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and "image" not in update_fields:
+        return
+    image = instance.image
+    manifest = instance.image_variants
+    if image and images.manifest_is_current(manifest, image.name):
+        return
+    if not image and not manifest:
+        return
+    images.delete_variants(image.storage, manifest)
+    new_manifest = {}
+    if image:
+        try:
+            new_manifest = images.generate_variants(image.storage, image.name)
+        except OSError:
+            logger.exception("Could not generate image variants for %s", image.name)
+    # update() rather than save(): no second round of signals
+    sender.objects.filter(pk=instance.pk).update(image_variants=new_manifest)
+    instance.image_variants = new_manifest
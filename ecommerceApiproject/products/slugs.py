@@ -0,0 +1,125 @@
+import re
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+
+"""
+Unique slug allocation.
+
+Instead of probing `filter(slug=...).exists()` once per candidate suffix,
+read every taken slug sharing the base in one prefix query and pick the
+next suffix after the highest one. Concurrent writers can still race for
+the same suffix, so saves retry on IntegrityError.
+"""
+
+MAX_SAVE_ATTEMPTS = 5
+# Bases per prefix query in assign_unique_slugs (keeps the OR'ed ranges small)
+BATCH_SIZE = 100
+
+
+def slug_base(instance, source_field="name"):
+    return slugify(getattr(instance, source_field)) or instance._meta.model_name
+
+
+def _suffix(base, slug):
+    # "base" -> 1, "base-7" -> 7, anything else (e.g. "base-blue") -> None
+    if slug == base:
+        return 1
+    match = re.fullmatch(re.escape(base) + r"-(\d+)", slug)
+    return int(match.group(1)) if match else None
+
+
+def _prefix_q(base):
+    # A range, not startswith: SQLite's LIKE can't use the slug index, so a
+    # prefix match would scan the table. "." sorts right after "-".
+    return Q(slug=base) | Q(slug__gt=f"{base}-", slug__lt=f"{base}.")
+
+
+def _advance(base, n):
+    # Step past suffix `n` (None = base itself is free); returns (n, slug)
+    n = 1 if n is None else n + 1
+    return n, base if n == 1 else f"{base}-{n}"
+
+
+def next_free_slug(model, base, exclude_pk=None):
+    """Return `base` or `base-N` (N one past the highest taken suffix) in one query."""
+    taken = model._default_manager.filter(_prefix_q(base)).order_by()
+    if exclude_pk is not None:
+        taken = taken.exclude(pk=exclude_pk)
+    highest = None
+    for slug in taken.values_list("slug", flat=True):
+        n = _suffix(base, slug)
+        if n is not None and (highest is None or n > highest):
+            highest = n
+    return _advance(base, highest)[1]
+
+
+def save_with_unique_slug(instance, save, *args, source_field="name", **kwargs):
+    """
+    Allocate a slug for `instance` and call `save` (the model's super().save),
+    retrying with a fresh suffix if a concurrent insert took the slug first.
+    """
+    model = type(instance)
+    original = instance.slug
+    base = slug_base(instance, source_field)
+    for attempt in range(1, MAX_SAVE_ATTEMPTS + 1):
+        instance.slug = next_free_slug(model, base, exclude_pk=instance.pk)
+        try:
+            with transaction.atomic():
+                return save(*args, **kwargs)
+        except IntegrityError:
+            slug_taken = model._default_manager.filter(slug=instance.slug).exclude(pk=instance.pk).exists()
+            if not slug_taken or attempt == MAX_SAVE_ATTEMPTS:
+                # Not a slug race (or out of retries): surface the original error
+                instance.slug = original
+                raise
+
+
+def assign_unique_slugs(instances, source_field="name"):
+    """
+    Give every instance in the `instances` list that has no slug a unique
+    one, using one prefix query per BATCH_SIZE distinct bases. Slugs are
+    unique within the batch as well as against the table. Returns `instances`.
+    """
+    pending = defaultdict(list)
+    for instance in instances:
+        if not instance.slug:
+            pending[slug_base(instance, source_field)].append(instance)
+    if not pending:
+        return instances
+
+    model = type(next(iter(pending.values()))[0])
+    bases = list(pending)
+    highest = {}
+    # Slugs in the table, explicit slugs, and slugs handed out earlier in
+    # this batch are all taken
+    used = {instance.slug for instance in instances if instance.slug}
+    for start in range(0, len(bases), BATCH_SIZE):
+        chunk = set(bases[start:start + BATCH_SIZE])
+        query = Q()
+        for base in chunk:
+            query |= _prefix_q(base)
+        for slug in model._default_manager.filter(query).order_by().values_list("slug", flat=True):
+            used.add(slug)
+            # "lamp-3" counts for base "lamp-3" and for base "lamp"
+            head, _, tail = slug.rpartition("-")
+            matches = []
+            if slug in chunk:
+                matches.append((slug, 1))
+            if head in chunk and tail.isdigit():
+                matches.append((head, int(tail)))
+            for base, n in matches:
+                highest[base] = max(n, highest.get(base) or 0)
+
+    for base, group in pending.items():
+        n = highest.get(base)
+        for instance in group:
+            n, slug = _advance(base, n)
+            while slug in used:
+                n, slug = _advance(base, n)
+            instance.slug = slug
+            used.add(slug)
+    return instances
@@ -1,15 +1,67 @@
 from django.urls import reverse
-from rest_framework import status
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 from rest_framework.test import APITestCase
-from .models import Product, Category
+from .models import CART_MAX_QUANTITY, CatalogVersion, Product, ProductTombstone, Category, Cart, CartItem, InsufficientStock, Review, Stock
+from .inventory import set_stock, stock_levels
+from . import category_cache
+from .slugs import assign_unique_slugs
+from .carts import allocate_carts, purge_stale_carts, recompute_cart_totals
+from .changes import encode_cursor, purge_tombstones
+from .seeding import flush_catalog, seed_catalog
+from .query_budget import QueryLog, api_routes
+from .db_router import REPLICA_MODELS, PrimaryForWritesMiddleware, PrimaryReplicaRouter, use_primary
+from . import urls as api_urls
+from .search import InMemorySearchIndex, query_terms
+from . import search
+from . import response_cache
+from . import metrics
+from .async_views import async_read_urls
+from .urls import router
+from .serializers import CartSerializer, CategoryListSerializer, ProductListSerializer
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user_model
+import base64
+import json
+import os
 import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 import shutil
-from io import BytesIO
+from io import BytesIO, StringIO
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.cache import caches
+from django.db import IntegrityError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.utils import timezone
 from PIL import Image
 
 
+# Rendered-response caching is exercised by TestResponseCache only. Elsewhere
+# tests read resp.data and count queries, and the rollback between tests
+# doesn't fire the signals that bump the catalog version.
+_no_response_cache = override_settings(CATALOG_RESPONSE_CACHE_ENABLED=False)
+
+
+def setUpModule():
+    _no_response_cache.enable()
+
+
+def tearDownModule():
+    _no_response_cache.disable()
+
+
+def _warm_category_cache(category_id):
+    # At the current catalog version, as a request would load it
+    category_cache.sync(response_cache.current_version())
+    category_cache.get_category_block(category_id)
+
+
 class TestProductAPI(APITestCase):
     def setUp(self):
         self.list_url = "/api/products/"
@@ -28,21 +80,21 @@ class TestProductAPI(APITestCase):
         }
         create = self.client.post(self.list_url, payload, format="json")
         self.assertEqual(create.status_code, status.HTTP_201_CREATED)
-        pid = create.data["id"]
+        slug = create.data["slug"]
 
         # list should have 1 item
         list_resp = self.client.get(self.list_url)
         self.assertEqual(list_resp.data["count"], 1)
 
         # retrieve
-        detail_url = f"{self.list_url}{pid}/"
+        detail_url = f"{self.list_url}{slug}/"
         retrieve = self.client.get(detail_url)
         self.assertEqual(retrieve.status_code, status.HTTP_200_OK)
         self.assertEqual(retrieve.data["name"], payload["name"])
 
     def test_update_and_delete_product(self):
         p = Product.objects.create(name="Old", description="", price=5)
-        detail_url = f"{self.list_url}{p.id}/"
+        detail_url = f"{self.list_url}{p.slug}/"
 
         update = self.client.patch(detail_url, {"name": "New"}, format="json")
         self.assertEqual(update.status_code, status.HTTP_200_OK)
@@ -80,14 +132,14 @@ class TestCategoryAndImagesAPI(APITestCase):
         img = self._make_image("cat.png")
         create = self.client.post(self.categories_url, {"name": "Electronics", "image": img}, format="multipart")
         self.assertEqual(create.status_code, status.HTTP_201_CREATED)
-        cid = create.data["id"]
-        self.assertTrue(create.data.get("slug"))
+        slug = create.data["slug"]
+        self.assertTrue(slug)
         # List
         listed = self.client.get(self.categories_url)
         self.assertEqual(listed.status_code, status.HTTP_200_OK)
         self.assertEqual(listed.data["count"], 1)
         # Retrieve
-        detail_url = f"{self.categories_url}{cid}/"
+        detail_url = f"{self.categories_url}{slug}/"
         retrieve = self.client.get(detail_url)
         self.assertEqual(retrieve.status_code, status.HTTP_200_OK)
         # Update
@@ -118,3 +170,1486 @@ class TestCategoryAndImagesAPI(APITestCase):
         listed = self.client.get(self.products_url)
         self.assertEqual(listed.status_code, status.HTTP_200_OK)
         self.assertEqual(listed.data["count"], 1)
+
+
+class TestProductCursorPagination(APITestCase):
+    def setUp(self):
+        self.list_url = "/api/products/"
+        for i in range(25):
+            Product.objects.create(name=f"Item {i}", price=i)
+
+    def test_cursor_mode_walks_all_pages_without_count(self):
+        resp = self.client.get(self.list_url, {"pagination": "cursor"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", resp.data)
+        self.assertIsNone(resp.data["previous"])
+        seen = [p["id"] for p in resp.data["results"]]
+        next_url = resp.data["next"]
+        while next_url:
+            resp = self.client.get(next_url)
+            seen.extend(p["id"] for p in resp.data["results"])
+            next_url = resp.data["next"]
+        expected = list(Product.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_cursor_pages_never_aggregate_the_table(self):
+        first = self.client.get(self.list_url, {"pagination": "cursor"})
+        self.assertNotIn("ETag", first)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(first.data["next"])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotIn("ETag", second)
+        sql = " ".join(query["sql"] for query in queries.captured_queries)
+        self.assertNotIn("COUNT(", sql)
+        self.assertNotIn("MAX(", sql)
+
+    def test_cursor_previous_link_returns_prior_page(self):
+        first = self.client.get(self.list_url, {"pagination": "cursor"})
+        second = self.client.get(first.data["next"])
+        back = self.client.get(second.data["previous"])
+        self.assertEqual(
+            [p["id"] for p in back.data["results"]],
+            [p["id"] for p in first.data["results"]],
+        )
+
+    def test_invalid_cursor_is_404(self):
+        resp = self.client.get(self.list_url, {"cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # Well-formed, but with values that aren't a created_at and an id
+        for position in (
+            {"created_at": "garbage", "id": 1},
+            {"created_at": "2026-01-01T00:00:00Z", "id": None},
+            {"created_at": "9999-12-31T23:59:59-12:00", "id": 1},
+            {"created_at": "2026-01-01T00:00:00Z", "id": 2 ** 70},
+        ):
+            token = base64.urlsafe_b64encode(json.dumps({"p": position}).encode()).decode()
+            with self.subTest(position=position):
+                resp = self.client.get(self.list_url, {"cursor": token})
+                self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_mode_still_reports_count(self):
+        resp = self.client.get(self.list_url)
+        self.assertEqual(resp.data["count"], 25)
+
+
+class TestCategoryDetailProducts(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Big")
+        for i in range(45):
+            Product.objects.create(name=f"Big {i}", price=i, category=self.category)
+        self.detail_url = f"/api/categories/{self.category.slug}/"
+
+    def test_nested_products_are_bounded_and_paginated(self):
+        resp = self.client.get(self.detail_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data["product_count"], 45)
+        self.assertEqual(len(resp.data["products"]), 20)
+        seen = [p["id"] for p in resp.data["products"]]
+        next_url = resp.data["products_next"]
+        while next_url:
+            resp = self.client.get(next_url)
+            seen.extend(p["id"] for p in resp.data["products"])
+            next_url = resp.data["products_next"]
+        expected = list(self.category.products.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_nested_products_query_count_is_constant(self):
+        with self.assertNumQueries(2):
+            self.client.get(self.detail_url)
+
+
+class TestProductCategoryCache(APITestCase):
+    def setUp(self):
+        category_cache.invalidate()
+        self.category = Category.objects.create(name="Audio")
+        self.product = Product.objects.create(name="Speaker", price=10, category=self.category)
+        self.detail_url = f"/api/products/{self.product.slug}/"
+
+    def test_nested_category_costs_no_queries_when_warm(self):
+        self.client.get(self.detail_url)
+        # The catalog version and the product
+        with self.assertNumQueries(2):
+            resp = self.client.get(self.detail_url)
+        self.assertEqual(resp.data["category"]["slug"], self.category.slug)
+
+    def test_category_save_invalidates_cache(self):
+        self.client.get(self.detail_url)
+        self.category.name = "Hi-Fi"
+        self.category.save()
+        resp = self.client.get(self.detail_url)
+        self.assertEqual(resp.data["category"]["name"], "Hi-Fi")
+
+    def test_category_write_in_another_process(self):
+        self.client.get(self.detail_url)
+        # Its signals cleared that process's blocks, not these; the version tells
+        Category.objects.filter(pk=self.category.pk).update(name="Hi-Fi")
+        response_cache.bump_version()
+        resp = self.client.get(self.detail_url)
+        self.assertEqual(resp.data["category"]["name"], "Hi-Fi")
+
+    def test_slug_lookups(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(category_cache.get_category_id(self.category.slug), self.category.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(category_cache.get_category_id(self.category.slug), self.category.pk)
+        # An unknown slug is one indexed lookup, not a reload
+        blocks = category_cache._blocks
+        with self.assertNumQueries(1):
+            self.assertIsNone(category_cache.get_category_id("nope"))
+        self.assertIs(category_cache._blocks, blocks)
+        # Created elsewhere (no signal here): found, and the table reloaded
+        other = Category.objects.bulk_create([Category(name="Vinyl", slug="vinyl")])[0]
+        self.assertEqual(category_cache.get_category_id("vinyl"), other.pk)
+        self.assertEqual(category_cache.get_category_block(other.pk)["name"], "Vinyl")
+
+
+class TestSlugAllocation(APITestCase):
+    def test_duplicate_names_get_incrementing_suffixes(self):
+        slugs = [Product.objects.create(name="T-Shirt", price=1).slug for _ in range(4)]
+        self.assertEqual(slugs, ["t-shirt", "t-shirt-2", "t-shirt-3", "t-shirt-4"])
+
+    def test_allocation_is_one_query_regardless_of_collisions(self):
+        for _ in range(20):
+            Product.objects.create(name="Mug", price=1)
+        # slug prefix scan + insert (inside a savepoint) + catalog version bump
+        with self.assertNumQueries(5):
+            p = Product.objects.create(name="Mug", price=1)
+        self.assertEqual(p.slug, "mug-21")
+
+    def test_prefix_queries_search_the_slug_index(self):
+        Product.objects.create(name="Mug", price=1)
+        with CaptureQueriesContext(connection) as queries:
+            Product.objects.create(name="Mug", price=1)
+            assign_unique_slugs([Product(name="Mug", price=1), Product(name="Cup", price=1)])
+        lookups = [q["sql"] for q in queries.captured_queries if q["sql"].startswith('SELECT "products_product"."slug"')]
+        self.assertEqual(len(lookups), 2)
+        with connection.cursor() as cursor:
+            for sql in lookups:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+                self.assertIn("SEARCH products_product USING COVERING INDEX", plan)
+                self.assertIn("(slug>? AND slug<?)", plan)
+                self.assertNotIn("SCAN", plan)
+                self.assertNotIn("ORDER BY", plan)
+
+    def test_non_numeric_suffixes_are_ignored(self):
+        Product.objects.create(name="Mug Blue", price=1)
+        self.assertEqual(Product.objects.create(name="Mug", price=1).slug, "mug")
+
+    def test_category_slug_unique(self):
+        Category.objects.create(name="Shoes", slug="shoes")
+        self.assertEqual(Category.objects.create(name="Shoes!").slug, "shoes-2")
+
+    def test_assign_unique_slugs_batch(self):
+        Product.objects.create(name="Lamp", price=1)
+        batch = [Product(name="Lamp", price=1) for _ in range(3)] + [Product(name="Lamp 3", price=1)]
+        with self.assertNumQueries(1):
+            assign_unique_slugs(batch)
+        self.assertEqual([p.slug for p in batch], ["lamp-2", "lamp-3", "lamp-4", "lamp-3-2"])
+        Product.objects.bulk_create(batch)
+
+    def test_assign_unique_slugs_counts_taken_slugs_for_every_base(self):
+        # "lamp-3" in the table is both a suffix of "lamp" and a base of its own
+        Product.objects.create(name="Lamp", price=1)
+        Product.objects.create(name="Lamp 3", price=1)
+        batch = [Product(name="Lamp", price=1), Product(name="Lamp", price=1), Product(name="Lamp 3", price=1)]
+        assign_unique_slugs(batch)
+        self.assertEqual([p.slug for p in batch], ["lamp-4", "lamp-5", "lamp-3-2"])
+        Product.objects.bulk_create(batch)
+
+
+class TestBulkImport(APITestCase):
+    def setUp(self):
+        self.url = "/api/products/import/"
+        self.category = Category.objects.create(name="Tees")
+
+    def test_csv_import_creates_products(self):
+        body = "name,price,category\nT-Shirt,9.99,tees\nT-Shirt,10.00,\nBad,notaprice,\nOdd,1,nope\n"
+        resp = self.client.post(self.url, data=body, content_type="text/csv")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data["created"], 2)
+        self.assertEqual(resp.data["failed"], 2)
+        self.assertEqual([e["line"] for e in resp.data["errors"]], [4, 5])
+        self.assertEqual(
+            sorted(Product.objects.values_list("slug", flat=True)), ["t-shirt", "t-shirt-2"]
+        )
+        self.assertEqual(Product.objects.get(slug="t-shirt").category, self.category)
+
+    def test_ndjson_import_upserts_by_slug(self):
+        Product.objects.create(name="Old", price=1, slug="sku-1")
+        body = (
+            '{"name": "New", "price": "2.50", "slug": "sku-1"}\n'
+            '{"name": "Fresh", "price": 3, "slug": "sku-2"}\n'
+        )
+        resp = self.client.post(self.url, data=body, content_type="application/x-ndjson")
+        self.assertEqual((resp.data["created"], resp.data["updated"]), (1, 1))
+        self.assertEqual(Product.objects.get(slug="sku-1").name, "New")
+
+    def test_unsupported_content_type(self):
+        resp = self.client.post(self.url, data="{}", content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_import_products_command_chunks(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as fh:
+            fh.write("name,price\n")
+            for i in range(25):
+                fh.write(f"Item,{i}\n")
+        self.addCleanup(os.unlink, fh.name)
+        out = StringIO()
+        call_command("import_products", fh.name, "--chunk-size", "10", stdout=out)
+        self.assertIn("Created 25", out.getvalue())
+        self.assertEqual(Product.objects.filter(slug__startswith="item").count(), 25)
+
+
+class TestCartBatchItems(APITestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.products = [Product.objects.create(name=f"P{i}", price=i + 1) for i in range(30)]
+        self.url = f"/api/carts/{self.cart.cart_code}/items/batch/"
+
+    def test_batch_applies_add_set_remove(self):
+        a, b, c = self.products[:3]
+        CartItem.objects.create(cart=self.cart, product=a, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=c, quantity=1)
+        ops = [
+            {"op": "add", "product_id": a.id, "quantity": 3},
+            {"op": "add", "product_id": b.id},
+            {"op": "add", "product_id": b.id, "quantity": 2},
+            {"op": "remove", "product_id": c.id},
+            {"op": "set", "product_id": c.id, "quantity": 4},
+        ]
+        resp = self.client.post(self.url, {"operations": ops}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        quantities = {i["product"]["id"]: i["quantity"] for i in resp.data["items"]}
+        self.assertEqual(quantities, {a.id: 5, b.id: 3, c.id: 4})
+
+    def test_batch_query_count_is_constant(self):
+        ops = [{"op": "set", "product_id": p.id, "quantity": 2} for p in self.products]
+        # cart lookup, product check, savepoint, current items, upsert,
+        # totals update, release, cart + items reload
+        with self.assertNumQueries(9):
+            resp = self.client.post(self.url, {"operations": ops}, format="json")
+        self.assertEqual(len(resp.data["items"]), 30)
+
+    def test_batch_rejects_unknown_products(self):
+        ops = [{"op": "add", "product_id": 999999}]
+        resp = self.client.post(self.url, {"operations": ops}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_batch_rejects_out_of_range_integers(self):
+        product = self.products[0]
+        for op in (
+            {"op": "add", "product_id": 2 ** 70},
+            {"op": "add", "product_id": product.id, "quantity": 2 ** 70},
+            {"op": "set", "product_id": product.id, "quantity": CART_MAX_QUANTITY + 1},
+        ):
+            resp = self.client.post(self.url, {"operations": [op]}, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, op)
+        self.assertFalse(self.cart.items.exists())
+
+
+class TestCartTotals(APITestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.a = Product.objects.create(name="A", price="2.50")
+        self.b = Product.objects.create(name="B", price="10.00")
+        self.base = f"/api/carts/{self.cart.cart_code}/"
+
+    def _stored(self):
+        self.cart.refresh_from_db()
+        return self.cart.item_count, self.cart.subtotal
+
+    def test_totals_follow_item_writes(self):
+        self.client.post(f"{self.base}items/", {"product_id": self.a.id, "quantity": 2}, format="json")
+        self.client.post(f"{self.base}items/", {"product_id": self.b.id, "quantity": 1}, format="json")
+        self.assertEqual(self._stored(), (3, Decimal("15.00")))
+        item = CartItem.objects.get(cart=self.cart, product=self.a)
+        resp = self.client.patch(f"{self.base}items/{item.id}/", {"quantity": 4}, format="json")
+        self.assertEqual(resp.data["total"], Decimal("20.00"))
+        self.assertEqual(resp.data["item_count"], 5)
+        self.client.delete(f"{self.base}items/{item.id}/")
+        self.assertEqual(self._stored(), (1, Decimal("10.00")))
+        self.client.post(f"{self.base}items/batch/", {"operations": [
+            {"op": "add", "product_id": self.b.id, "quantity": 2},
+            {"op": "set", "product_id": self.a.id, "quantity": 2},
+        ]}, format="json")
+        self.assertEqual(self._stored(), (5, Decimal("35.00")))
+        self.client.delete(f"{self.base}clear/")
+        self.assertEqual(self._stored(), (0, Decimal("0.00")))
+
+    def test_quantities_are_capped_so_totals_stay_readable(self):
+        pricey = Product.objects.create(name="Vault", price="99999999.99")
+        resp = self.client.post(f"{self.base}items/", {"product_id": pricey.id, "quantity": 2_000_000_000}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data["total"], Decimal("99999999.99") * 2_000_000_000)
+        self.assertEqual(self.client.get(self.base).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get("/api/carts/").status_code, status.HTTP_200_OK)
+
+        # Past CART_MAX_QUANTITY for one item, or for the whole cart
+        item = CartItem.objects.get(cart=self.cart)
+        for method, path, payload in (
+            ("post", "items/", {"product_id": self.a.id, "quantity": 2 ** 40}),
+            ("post", "items/", {"product_id": self.a.id, "quantity": 200_000_000}),
+            ("patch", f"items/{item.id}/", {"quantity": 2 ** 70}),
+            ("post", "items/batch/", {"operations": [{"op": "add", "product_id": self.b.id, "quantity": 200_000_000}]}),
+        ):
+            with self.subTest(path=path, payload=payload):
+                resp = getattr(self.client, method)(f"{self.base}{path}", payload, format="json")
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(self._stored(), (2_000_000_000, Decimal("99999999.99") * 2_000_000_000))
+
+    def test_price_change_and_recompute_command(self):
+        CartItem.objects.create(cart=self.cart, product=self.a, quantity=2)
+        self.a.price = Decimal("3.00")
+        self.a.save()
+        self.assertEqual(self._stored(), (2, Decimal("6.00")))
+        Cart.objects.filter(pk=self.cart.pk).update(subtotal=0, item_count=0)
+        out = StringIO()
+        call_command("recompute_cart_totals", stdout=out)
+        self.assertIn("Fixed 1 cart", out.getvalue())
+        self.assertEqual(self._stored(), (2, Decimal("6.00")))
+
+    def test_list_orders_by_subtotal(self):
+        other = Cart.objects.create()
+        CartItem.objects.create(cart=other, product=self.b, quantity=1)
+        resp = self.client.get("/api/carts/", {"ordering": "-subtotal", "min_subtotal": "1"})
+        self.assertEqual([c["cart_code"] for c in resp.data["results"]], [other.cart_code])
+        for param in ("min_subtotal", "max_subtotal"):
+            for value in ("abc", "NaN", "Infinity", "-inf"):
+                with self.subTest(param=param, value=value):
+                    self.assertEqual(self.client.get("/api/carts/", {param: value}).status_code, 400)
+        resp = self.client.get("/api/carts/", {"max_subtotal": "1e30"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+class TestCartCodes(APITestCase):
+    def test_create_is_a_single_insert(self):
+        # The INSERT runs in a savepoint (tests run inside a transaction)
+        with self.assertNumQueries(3):
+            cart = Cart.objects.create()
+        self.assertEqual(len(cart.cart_code), 12)
+
+    def test_collision_retries_with_new_code(self):
+        taken = Cart.objects.create().cart_code
+        with mock.patch("products.models.generate_cart_code", side_effect=[taken, "FRESHCODE001"]):
+            cart = Cart.objects.create()
+        self.assertEqual(cart.cart_code, "FRESHCODE001")
+
+    def test_never_saves_without_a_code(self):
+        taken = Cart.objects.create().cart_code
+        with mock.patch("products.models.generate_cart_code", return_value=taken):
+            with self.assertRaises(IntegrityError):
+                Cart.objects.create()
+        self.assertFalse(Cart.objects.filter(cart_code="").exists())
+
+    def test_allocate_carts(self):
+        out = StringIO()
+        with self.assertNumQueries(3 * 3):
+            call_command("allocate_carts", "25", "--batch-size", "10", stdout=out)
+        codes = out.getvalue().split()
+        self.assertEqual(len(set(codes)), 25)
+        self.assertEqual(Cart.objects.filter(cart_code__in=codes).count(), 25)
+
+    def test_allocate_redraws_colliding_batch(self):
+        taken = Cart.objects.create().cart_code
+        codes = [taken, "CODE0000000A", "CODE0000000B", "CODE0000000C"]
+        with mock.patch("products.carts.generate_cart_code", side_effect=codes):
+            carts = allocate_carts(2)
+        self.assertEqual({c.cart_code for c in carts}, {"CODE0000000B", "CODE0000000C"})
+        self.assertTrue(all(c.pk for c in carts))
+
+
+class TestPurgeStaleCarts(APITestCase):
+    def setUp(self):
+        product = Product.objects.create(name="Cup", price="3.00")
+        self.fresh = Cart.objects.create()
+        self.stale = [Cart.objects.create() for _ in range(3)]
+        for cart in [self.fresh] + self.stale:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        old = timezone.now() - timedelta(days=45)
+        Cart.objects.filter(pk__in=[c.pk for c in self.stale]).update(updated_at=old)
+
+    def test_dry_run_only_counts(self):
+        out = StringIO()
+        call_command("purge_stale_carts", "--dry-run", stdout=out)
+        self.assertIn("Would delete 3 stale cart(s) with 3 item(s)", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 4)
+
+    def test_purges_in_batches(self):
+        # Per batch: the pk scan, then (in a savepoint) the locking SELECT, the
+        # stock holds, the cart SELECT and the two DELETEs of the cascade; one
+        # last scan finds nothing
+        with self.assertNumQueries(2 * 8 + 1):
+            self.assertEqual(purge_stale_carts(batch_size=2), (3, 3))
+        self.assertQuerySetEqual(Cart.objects.all(), [self.fresh])
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_ttl_option(self):
+        out = StringIO()
+        call_command("purge_stale_carts", "--days", "60", stdout=out)
+        self.assertIn("Deleted 0 stale cart(s)", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 4)
+
+
+class TestReviewRatings(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.alice = User.objects.create_user("alice", password="x")
+        self.bob = User.objects.create_user("bob", password="x")
+        self.lamp = Product.objects.create(name="Lamp", price="20.00")
+        self.desk = Product.objects.create(name="Desk", price="90.00")
+
+    def _review(self, user, product, rating):
+        self.client.force_authenticate(user)
+        resp = self.client.post("/api/reviews/", {"product": product.id, "rating": rating}, format="json")
+        self.client.force_authenticate(None)
+        return resp
+
+    def _stored(self, product):
+        product.refresh_from_db()
+        return product.rating_count, product.rating_sum, product.rating_histogram
+
+    def test_aggregates_follow_review_writes(self):
+        self.assertEqual(self._review(self.alice, self.lamp, 5).status_code, status.HTTP_201_CREATED)
+        self._review(self.bob, self.lamp, 2)
+        count, total, histogram = self._stored(self.lamp)
+        self.assertEqual((count, total, histogram["5"], histogram["2"]), (2, 7, 1, 1))
+        self.assertAlmostEqual(self.lamp.rating_avg, 3.5)
+
+        review = Review.objects.get(user=self.bob)
+        self.client.force_authenticate(self.bob)
+        self.client.patch(f"/api/reviews/{review.id}/", {"rating": 4}, format="json")
+        self.assertEqual(self._stored(self.lamp)[:2], (2, 9))
+        self.assertEqual(self.lamp.rating_histogram, {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1})
+
+        self.client.delete(f"/api/reviews/{review.id}/")
+        self.assertEqual(self._stored(self.lamp)[:2], (1, 5))
+        # Cascade from deleting the user
+        self.alice.delete()
+        self.assertEqual(self._stored(self.lamp), (0, 0, {str(star): 0 for star in range(1, 6)}))
+        self.assertEqual(self.lamp.rating_avg, 0)
+
+    def test_one_review_per_user_and_only_author_edits(self):
+        self._review(self.alice, self.lamp, 3)
+        self.assertEqual(self._review(self.alice, self.lamp, 4).status_code, status.HTTP_400_BAD_REQUEST)
+        review = Review.objects.get(user=self.alice)
+        self.client.force_authenticate(self.bob)
+        resp = self.client.patch(f"/api/reviews/{review.id}/", {"rating": 1}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self._stored(self.lamp)[:2], (1, 3))
+
+    def test_filter_by_product(self):
+        self._review(self.alice, self.lamp, 3)
+        self._review(self.bob, self.desk, 5)
+        resp = self.client.get("/api/reviews/", {"product": self.desk.pk})
+        self.assertEqual([r["rating"] for r in resp.data["results"]], [5])
+        for product in ("x", "\u00b2", str(2 ** 63)):
+            with self.subTest(product=product):
+                resp = self.client.get("/api/reviews/", {"product": product})
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sort_and_filter_by_rating(self):
+        self._review(self.alice, self.lamp, 3)
+        self._review(self.alice, self.desk, 5)
+        self._review(self.bob, self.desk, 4)
+        Product.objects.create(name="Unrated", price="1.00")
+
+        resp = self.client.get("/api/products/?ordering=-rating")
+        results = resp.data["results"]
+        self.assertEqual([p["name"] for p in results], ["Desk", "Lamp", "Unrated"])
+        self.assertEqual((results[0]["rating"], results[0]["rating_count"]), (4.5, 2))
+        self.assertIsNone(results[2]["rating"])
+
+        resp = self.client.get("/api/products/?min_rating=4")
+        self.assertEqual([p["name"] for p in resp.data["results"]], ["Desk"])
+        resp = self.client.get("/api/products/?ordering=-rating&pagination=cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        detail = self.client.get(f"/api/products/{self.desk.slug}/")
+        self.assertEqual(detail.data["rating_histogram"]["4"], 1)
+
+
+class TestProductSearch(APITestCase):
+    def setUp(self):
+        self.url = "/api/products/search/"
+        self.headphones = Product.objects.create(
+            name="Wireless Headphones", description="Noise cancelling over-ear headphones", price=99
+        )
+        self.cable = Product.objects.create(
+            name="Audio Cable", description="Connects <b>wired</b> headphones", price=5
+        )
+        Product.objects.create(name="Desk Lamp", description="LED lamp", price=20)
+
+    def test_ranked_prefix_search_with_snippets(self):
+        resp = self.client.get(self.url, {"q": "headph"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        ids = [r["id"] for r in resp.data["results"]]
+        # Name matches outrank description-only matches
+        self.assertEqual(ids, [self.headphones.id, self.cable.id])
+        self.assertIn("<mark>", resp.data["results"][1]["snippet"])
+        self.assertIn("&lt;b&gt;", resp.data["results"][1]["snippet"])
+
+    def test_bulk_writes_are_indexed(self):
+        Product.objects.bulk_create([Product(name="Bulk Teapot", price=3, slug="bulk-teapot")])
+        Product.objects.filter(pk=self.cable.pk).update(name="Optical Cable")
+        self.assertEqual(len(self.client.get(self.url, {"q": "teapot"}).data["results"]), 1)
+        self.assertEqual(self.client.get(self.url, {"q": "optical"}).data["results"][0]["id"], self.cable.id)
+
+    def test_paging_and_validation(self):
+        resp = self.client.get(self.url, {"q": "headphones", "limit": 1})
+        self.assertEqual(len(resp.data["results"]), 1)
+        self.assertIsNotNone(resp.data["next"])
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(self.url, {"q": "headphones", "offset": "99999999999999999999999"})
+        self.assertEqual((resp.status_code, resp.data["results"], resp.data["next"]), (status.HTTP_200_OK, [], None))
+
+    def test_in_memory_fallback_index(self):
+        index = InMemorySearchIndex()
+        results = index.search(query_terms("head cancel"), limit=10, offset=0)
+        self.assertEqual([pk for pk, _rank, _snippet in results], [self.headphones.id])
+        index.update(self.cable.pk, "Headphone Cable", "")
+        results = index.search(query_terms("headph"), limit=10, offset=0)
+        self.assertEqual({pk for pk, _rank, _snippet in results}, {self.headphones.id, self.cable.id})
+
+    @override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+    def test_in_memory_fallback_follows_the_change_feed(self):
+        # No signals reach this index, as for writes made by other processes
+        index = InMemorySearchIndex()
+        self.assertEqual(index.search(query_terms("teapot"), limit=10, offset=0), [])
+        Product.objects.bulk_create([Product(name="Bulk Teapot", price=3, slug="bulk-teapot")])
+        Product.objects.filter(pk=self.cable.pk).update(name="Optical Cable", updated_at=timezone.now())
+        Product.objects.filter(pk=self.headphones.pk).delete()
+        self.assertEqual(len(index.search(query_terms("teapot"), limit=10, offset=0)), 1)
+        self.assertEqual([pk for pk, _r, _s in index.search(query_terms("optical"), limit=10, offset=0)], [self.cable.pk])
+        self.assertEqual(index.search(query_terms("wireless"), limit=10, offset=0), [])
+
+    def test_missing_fts_table_is_not_cached(self):
+        search._fts_ready.pop(connection.alias, None)
+        with mock.patch.object(connection.introspection, "table_names", return_value=[]):
+            self.assertFalse(search.fts_available())
+        self.assertTrue(search.fts_available())
+
+
+class TestProductFiltersAndFacets(APITestCase):
+    def setUp(self):
+        category_cache.invalidate()
+        self.url = "/api/products/"
+        self.shoes = Category.objects.create(name="Shoes")
+        self.hats = Category.objects.create(name="Hats")
+        for price in (5, 20, 60):
+            Product.objects.create(name="Shoe", price=price, category=self.shoes)
+        Product.objects.create(name="Hat", price=15, category=self.hats)
+        Product.objects.create(name="Loose", price=300)
+
+    def test_filters_by_category_and_price(self):
+        resp = self.client.get(self.url, {"category": "shoes", "min_price": "10", "max_price": "100"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(Decimal(p["price"]) for p in resp.data["results"]), [20, 60])
+        resp = self.client.get(self.url, {"category": "shoes,hats", "created_after": "2000-01-01"})
+        self.assertEqual(resp.data["count"], 4)
+        for value in ("abc", "NaN", "Infinity", "-inf", "sNaN"):
+            with self.subTest(value=value):
+                self.assertEqual(self.client.get(self.url, {"min_price": value}).status_code, 400)
+        # In range as written, out of range once converted to UTC
+        for name, value in (("created_after", "9999-12-31T23:59:59-12:00"), ("created_before", "0001-01-01T00:00:00+01:00")):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(self.url, {name: value}).status_code, 400)
+
+    def test_facets_from_one_grouped_query(self):
+        _warm_category_cache(self.shoes.id)
+        with self.assertNumQueries(5):  # catalog version, etag validators, count, page, facets
+            resp = self.client.get(self.url, {"facets": "true"})
+        facets = resp.data["facets"]
+        self.assertEqual(
+            [(c["slug"], c["count"]) for c in facets["category"]],
+            [("shoes", 3), ("hats", 1), (None, 1)],
+        )
+        self.assertEqual(sum(b["count"] for b in facets["price"]), 5)
+        self.assertEqual([b["count"] for b in facets["price"] if b["max"] == Decimal("10")], [1])
+
+    def test_facets_follow_filters(self):
+        resp = self.client.get(self.url, {"facets": "1", "category": "hats"})
+        self.assertEqual([(c["slug"], c["count"]) for c in resp.data["facets"]["category"]], [("hats", 1)])
+
+
+class TestConditionalGet(APITestCase):
+    def setUp(self):
+        category_cache.invalidate()
+        self.category = Category.objects.create(name="Books")
+        self.product = Product.objects.create(name="Novel", price=12, category=self.category)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+
+    def _revalidate(self, url, queries):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first["ETag"]
+        with self.assertNumQueries(queries):
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second["ETag"], etag)
+        return etag
+
+    def test_not_modified_short_circuits(self):
+        # Product reads also read the catalog version (category blocks)
+        self._revalidate("/api/products/", 2)
+        self._revalidate(f"/api/products/{self.product.slug}/", 2)
+        self._revalidate("/api/categories/", 1)
+        self._revalidate(f"/api/categories/{self.category.slug}/", 1)
+        self._revalidate(f"/api/carts/{self.cart.cart_code}/", 2)
+        # No list validators for carts: always a full response
+        self.assertNotIn("ETag", self.client.get("/api/carts/"))
+
+    def test_changes_invalidate_etag(self):
+        url = f"/api/products/{self.product.slug}/"
+        etag = self._revalidate(url, 2)
+        self.product.price = 13
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        list_etag = self._revalidate("/api/products/", 2)
+        Product.objects.create(name="Sequel", price=12)
+        self.assertEqual(self.client.get("/api/products/", HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_category_rename_changes_product_etag(self):
+        url = f"/api/products/{self.product.slug}/"
+        etag = self._revalidate(url, 2)
+        self.category.name = "Paperbacks"
+        self.category.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_last_modified_header(self):
+        resp = self.client.get(f"/api/products/{self.product.slug}/")
+        self.assertIn("Last-Modified", resp)
+        again = self.client.get(
+            f"/api/products/{self.product.slug}/", HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"]
+        )
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@override_settings(CATALOG_RESPONSE_CACHE_ENABLED=True)
+class TestResponseCache(APITestCase):
+    def setUp(self):
+        caches[response_cache.CACHE_ALIAS].clear()
+        self.category = Category.objects.create(name="Games")
+        self.product = Product.objects.create(name="Chess", price=30, category=self.category)
+
+    def test_hit_skips_database_and_serialization(self):
+        url = f"/api/products/{self.product.slug}/"
+        before = response_cache.stats.as_dict()
+        first = self.client.get(url)
+        self.assertEqual(first["X-Cache"], "MISS")
+        # Only the catalog version is read
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.content, first.content)
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        after = response_cache.stats.as_dict()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 2)
+
+    def test_hit_answers_if_modified_since(self):
+        url = f"/api/products/{self.product.slug}/"
+        first = self.client.get(url)
+        with self.assertNumQueries(1):
+            hit = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual((hit.status_code, hit["X-Cache"]), (status.HTTP_304_NOT_MODIFIED, "HIT"))
+        self.assertEqual(hit["Last-Modified"], first["Last-Modified"])
+        stale = self.client.get(url, HTTP_IF_MODIFIED_SINCE="Mon, 01 Jan 2001 00:00:00 GMT")
+        self.assertEqual((stale.status_code, stale["X-Cache"]), (status.HTTP_200_OK, "HIT"))
+        self.assertEqual(stale.content, first.content)
+
+    def test_writes_bump_version(self):
+        self.client.get("/api/categories/")
+        self.category.name = "Board Games"
+        self.category.save()
+        resp = self.client.get("/api/categories/")
+        self.assertEqual(resp["X-Cache"], "MISS")
+        self.assertEqual(resp.data["results"][0]["name"], "Board Games")
+
+    def test_category_write_in_another_process_is_not_cached_stale(self):
+        url = f"/api/products/{self.product.slug}/"
+        self.client.get(url)
+        Category.objects.filter(pk=self.category.pk).update(name="Puzzles")
+        response_cache.bump_version()
+        for expected in ("MISS", "HIT"):
+            resp = self.client.get(url)
+            self.assertEqual((resp["X-Cache"], json.loads(resp.content)["category"]["name"]), (expected, "Puzzles"))
+
+    def test_version_is_shared_and_never_evicted(self):
+        version = response_cache.current_version()
+        # Another process's cache, or an eviction: the version is not in it
+        caches[response_cache.CACHE_ALIAS].clear()
+        self.assertEqual(response_cache.current_version(), version)
+        response_cache.bump_version()
+        self.assertEqual(response_cache.current_version(), version + 1)
+        CatalogVersion.objects.all().delete()
+        response_cache.bump_version()
+        self.assertGreater(response_cache.current_version(), version + 1)
+
+    def test_bulk_import_bumps_version(self):
+        self.client.get("/api/products/")
+        self.client.post("/api/products/import/", data="name,price\nGo,5\n", content_type="text/csv")
+        resp = self.client.get("/api/products/")
+        self.assertEqual(resp.data["count"], 2)
+
+    def test_browsable_api_is_not_cached(self):
+        resp = self.client.get("/api/products/", HTTP_ACCEPT="text/html")
+        self.assertNotIn("X-Cache", resp)
+
+
+class TestImageVariants(APITestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self._tmpdir)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def _make_image(self, name="big.png", size=(800, 400), fmt="PNG"):
+        buf = BytesIO()
+        Image.new("RGB", size, (0, 128, 255)).save(buf, format=fmt)
+        return SimpleUploadedFile(name, buf.getvalue(), content_type=f"image/{fmt.lower()}")
+
+    def test_upload_generates_variants_and_srcset(self):
+        payload = {"name": "Poster", "price": "9.00", "image": self._make_image()}
+        created = self.client.post("/api/products/", payload, format="multipart")
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+        srcset = created.data["image_srcset"]
+        self.assertEqual(set(srcset), {"webp", "png"})
+        self.assertEqual([entry.split()[-1] for entry in srcset["webp"].split(", ")], ["160w", "320w", "640w"])
+
+        product = Product.objects.get(pk=created.data["id"])
+        webp = product.image_variants["variants"]["webp"]["320"]
+        with Image.open(os.path.join(self._tmpdir, webp)) as img:
+            self.assertEqual((img.format, img.width, img.height), ("WEBP", 320, 160))
+
+        listed = self.client.get("/api/products/")
+        self.assertEqual(listed.data["results"][0]["image_srcset"], srcset)
+
+    def test_small_images_are_not_upscaled(self):
+        category = Category.objects.create(name="Icons", image=self._make_image("icon.png", (64, 64)))
+        variants = category.image_variants["variants"]
+        self.assertEqual(list(variants["webp"]), ["64"])
+
+    def test_backfill_command(self):
+        product = Product.objects.create(name="Old", price=1, image=self._make_image())
+        Product.objects.filter(pk=product.pk).update(image_variants={})
+        out = StringIO()
+        call_command("generate_image_variants", "--workers", "1", stdout=out)
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants["source"], product.image.name)
+        self.assertIn("1 generated", out.getvalue())
+
+    def _variant_files(self, product):
+        return {name for paths in product.image_variants["variants"].values() for name in paths.values()}
+
+    def test_images_sharing_a_stem_keep_their_own_variants(self):
+        png = Product.objects.create(name="Shoe", price=1, image=self._make_image("shoe.png"))
+        png_files = self._variant_files(png)
+        # A stray file where the other product's variant would go is not ours to replace
+        stray = os.path.join(self._tmpdir, "products", "derived", "shoe.jpg.160w.webp")
+        with open(stray, "wb") as fh:
+            fh.write(b"not ours")
+
+        jpg = Product.objects.create(name="Boot", price=1, image=self._make_image("shoe.jpg", fmt="JPEG"))
+        jpg_files = self._variant_files(jpg)
+        self.assertFalse(png_files & jpg_files)
+        with open(stray, "rb") as fh:
+            self.assertEqual(fh.read(), b"not ours")
+
+        call_command("generate_image_variants", "--workers", "1", "--force", stdout=StringIO())
+        jpg.refresh_from_db()
+        self.assertEqual(self._variant_files(jpg), jpg_files)
+        jpg.image = ""
+        jpg.save()
+        for name in png_files:
+            self.assertTrue(os.path.exists(os.path.join(self._tmpdir, name)), name)
+        for name in jpg_files:
+            self.assertFalse(os.path.exists(os.path.join(self._tmpdir, name)), name)
+
+
+class TestAsyncReads(APITestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        # The async views as ASGI deployments route them (first pattern per name)
+        self.views = {}
+        for pattern in async_read_urls(router.urls):
+            self.views.setdefault(pattern.name, pattern.callback)
+        self.category = Category.objects.create(name="Tools")
+        for i in range(12):
+            Product.objects.create(name=f"Hammer {i}", price=i + 1, category=self.category)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=Product.objects.first(), quantity=2)
+
+    async def _get(self, name, path, headers=None, **kwargs):
+        return await self.views[name](self.factory.get(path, headers=headers), **kwargs)
+
+    def _assert_same(self, async_response, sync_response):
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response["ETag"], sync_response["ETag"])
+        self.assertEqual(json.loads(async_response.content), json.loads(sync_response.content))
+
+    async def test_matches_sync_viewsets(self):
+        cases = [
+            ("product-list", "/api/products/", {}),
+            ("product-list", "/api/products/?page=2", {}),
+            ("product-detail", "/api/products/hammer-3/", {"slug": "hammer-3"}),
+            ("category-list", "/api/categories/", {}),
+            ("cart-detail", f"/api/carts/{self.cart.cart_code}/", {"cart_code": self.cart.cart_code}),
+        ]
+        for name, path, kwargs in cases:
+            with self.subTest(path=path):
+                async_response = await self._get(name, path, **kwargs)
+                sync_response = await sync_to_async(self.client.get)(path)
+                self._assert_same(async_response, sync_response)
+
+    async def test_not_modified(self):
+        first = await self._get("product-list", "/api/products/")
+        again = await self._get("product-list", "/api/products/", headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_other_requests_fall_back_to_viewset(self):
+        filtered = await self._get("product-list", f"/api/products/?category={self.category.slug}")
+        self.assertEqual(json.loads(filtered.content)["count"], 12)
+        missing = await self._get("product-detail", "/api/products/nope/", slug="nope")
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        out_of_range = await self._get("product-list", "/api/products/?page=9")
+        self.assertEqual(out_of_range.status_code, status.HTTP_404_NOT_FOUND)
+        # "²".isdigit() is true, but it is not a page number
+        superscript = await self._get("product-list", "/api/products/?page=%C2%B2")
+        self.assertEqual(superscript.status_code, status.HTTP_404_NOT_FOUND)
+        browsable = await self._get("category-list", "/api/categories/", headers={"Accept": "text/html"})
+        self.assertIn(b"<html", browsable.content)
+
+        request = self.factory.post("/api/products/", {"name": "Saw", "price": "3.00"}, content_type="application/json")
+        created = await self.views["product-list"](request)
+        self.assertEqual(created.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(CATALOG_RESPONSE_CACHE_ENABLED=True)
+    async def test_shares_response_cache_with_sync_views(self):
+        caches["catalog"].clear()
+        miss = await self._get("category-list", "/api/categories/")
+        self.assertEqual(miss["X-Cache"], "MISS")
+        hit = await sync_to_async(self.client.get)("/api/categories/")
+        self.assertEqual(hit["X-Cache"], "HIT")
+        self.assertEqual(hit.content, miss.content)
+
+
+class TestRowSerializers(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Paint")
+        # Stored names only (update() skips variant generation); a space to exercise quoting
+        Category.objects.filter(pk=category.pk).update(image="categories/paint can.png")
+        self.products = [
+            Product.objects.create(name=f"Brush {i}", price=Decimal("2.50") * (i + 1), category=category)
+            for i in range(3)
+        ]
+        manifest = {"source": "products/brush.png", "variants": {"webp": {"160": "products/derived/brush_160w.webp"}}}
+        Product.objects.filter(pk=self.products[0].pk).update(image="products/brush.png", image_variants=manifest)
+        Review.objects.create(
+            product=self.products[1], user=get_user_model().objects.create_user("rater", password="x"), rating=4
+        )
+        cart = Cart.objects.create()
+        for product in self.products[:2]:
+            CartItem.objects.create(cart=cart, product=product, quantity=3)
+        Cart.objects.create()  # no items
+
+    def _expected(self, serializer_class, queryset, path):
+        request = RequestFactory().get(path)
+        data = serializer_class(queryset, many=True, context={"request": request}).data
+        return json.loads(JSONRenderer().render(data))
+
+    def test_list_bodies_match_instance_serializers(self):
+        cases = [
+            ("/api/products/", ProductListSerializer, Product.objects.all()),
+            ("/api/categories/", CategoryListSerializer, Category.objects.all()),
+            ("/api/carts/", CartSerializer, Cart.objects.all()),
+        ]
+        for path, serializer_class, queryset in cases:
+            with self.subTest(path=path):
+                resp = self.client.get(path)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(resp.content)["results"], self._expected(serializer_class, queryset, path))
+
+    def test_cart_list_fetches_items_per_page(self):
+        # count, page of carts, then the items (with products) of the whole page
+        with self.assertNumQueries(3):
+            resp = self.client.get("/api/carts/")
+        items = max((cart["items"] for cart in resp.data["results"]), key=len)
+        self.assertEqual(len(items), 2)
+        for item in items:
+            self.assertEqual(Decimal(item["line_total"]), Decimal(item["product"]["price"]) * 3)
+
+
+class TestRequestMetrics(APITestCase):
+    def setUp(self):
+        metrics.histograms.clear()
+        category = Category.objects.create(name="Glue")
+        for i in range(3):
+            Product.objects.create(name=f"Glue {i}", price=1, category=category)
+
+    def _timings(self, resp):
+        entries = {}
+        for entry in resp["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            entries[name] = dict(param.split("=", 1) for param in params)
+        return entries
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get("/api/products/")
+        timings = self._timings(resp)
+        self.assertEqual(set(timings), {"db", "serialize", "render", "total"})
+        self.assertEqual(timings["db"]["desc"], f'"{len(queries)} queries"')
+        self.assertGreater(float(timings["serialize"]["dur"]), 0)
+        self.assertGreater(float(timings["render"]["dur"]), 0)
+        self.assertGreaterEqual(float(timings["total"]["dur"]), float(timings["db"]["dur"]))
+
+    def test_times_serializers_and_rendering_without_patching_drf(self):
+        user = get_user_model().objects.create_user("reviewer", password="x")
+        Review.objects.create(product=Product.objects.first(), user=user, rating=4)
+        # Not a RowListMixin list: plain serializer output and rendering
+        resp = self.client.get("/api/reviews/")
+        timings = self._timings(resp)
+        self.assertGreater(float(timings["serialize"]["dur"]), 0)
+        self.assertGreater(float(timings["render"]["dur"]), 0)
+        self.assertEqual(serializers.BaseSerializer.data.fget.__module__, "rest_framework.serializers")
+        self.assertEqual(Response.rendered_content.fget.__module__, "rest_framework.response")
+
+    def test_metrics_endpoint_is_staff_only(self):
+        for _ in range(3):
+            self.client.get("/api/products/")
+        self.assertEqual(self.client.get("/api/_metrics").status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = get_user_model().objects.create_user("ops", password="x", is_staff=True)
+        self.client.force_authenticate(staff)
+        resp = self.client.get("/api/_metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp["Content-Type"].startswith("text/plain"))
+        body = resp.content.decode()
+        self.assertIn("# TYPE api_request_duration_seconds summary", body)
+        self.assertIn('api_request_duration_seconds{method="GET",route="product-list",quantile="0.99"}', body)
+        self.assertIn('api_request_queries_count{method="GET",route="product-list"} 3', body)
+        self.assertIn("catalog_response_cache_hits_total", body)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled(self):
+        resp = self.client.get("/api/products/")
+        self.assertNotIn("Server-Timing", resp)
+        self.assertEqual(metrics.histograms.snapshot(), {})
+
+
+class TestSeedCatalog(APITestCase):
+    def _snapshot(self):
+        return (
+            list(Product.objects.order_by("slug").values_list("slug", "price", "category__slug", "rating_avg")),
+            list(Cart.objects.order_by("cart_code").values_list("cart_code", "subtotal", "item_count")),
+            sorted(CartItem.objects.values_list("cart__cart_code", "product__slug", "quantity")),
+        )
+
+    def test_seed_is_deterministic_and_consistent(self):
+        counts = seed_catalog(products=120, categories=4, carts=15, seed=7, batch_size=50)
+        self.assertEqual(counts["products"], Product.objects.count())
+        self.assertEqual(counts["cart_items"], CartItem.objects.count())
+        # Stored aggregates agree with the rows
+        self.assertEqual(recompute_cart_totals(dry_run=True), 0)
+        for product in Product.objects.filter(rating_count__gt=0)[:10]:
+            self.assertEqual(sum(product.rating_histogram.values()), product.rating_count)
+        first = self._snapshot()
+
+        flush_catalog()
+        self.assertFalse(Product.objects.exists())
+        seed_catalog(products=120, categories=4, carts=15, seed=7, batch_size=50)
+        self.assertEqual(self._snapshot(), first)
+
+    def test_command_refuses_a_non_empty_catalog(self):
+        call_command("seed_catalog", "--products", "20", "--categories", "2", "--carts", "3", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("seed_catalog", "--products", "20", "--categories", "2", "--carts", "3")
+        call_command("seed_catalog", "--products", "30", "--categories", "2", "--carts", "3", "--flush", stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(self.client.get("/api/products/").data["count"], 30)
+
+
+class TestQueryBudgets(APITestCase):
+    """
+    Maximum queries per route and method, checked at two dataset sizes; the
+    count must also be the same at both. Budgets are for warm process-local
+    caches and include savepoint statements.
+    """
+
+    SIZES = (3, 25)  # rows per collection; 25 passes every page size
+    BUDGETS = {
+        ("api-root", "get"): 0,
+        ("metrics", "get"): 0,
+        ("product-list", "get"): 4,
+        ("product-list", "post"): 6,
+        ("product-bulk-import", "post"): 6,
+        ("product-search", "get"): 2,
+        ("product-batch", "get"): 2,
+        ("product-changes", "get"): 3,
+        ("product-detail", "get"): 2,
+        ("product-detail", "put"): 7,
+        ("product-detail", "patch"): 6,
+        ("product-detail", "delete"): 12,
+        ("category-list", "get"): 3,
+        ("category-list", "post"): 8,
+        ("category-detail", "get"): 2,
+        ("category-detail", "put"): 7,
+        ("category-detail", "patch"): 7,
+        ("category-detail", "delete"): 5,
+        ("cart-list", "get"): 3,
+        ("cart-list", "post"): 4,
+        ("cart-detail", "get"): 2,
+        ("cart-detail", "put"): 5,
+        ("cart-detail", "patch"): 5,
+        ("cart-detail", "delete"): 5,
+        ("cart-add-or-set-item", "post"): 10,
+        ("cart-batch-items", "post"): 10,
+        ("cart-clear", "delete"): 8,
+        ("cart-update-item", "patch"): 9,
+        ("cart-update-item", "delete"): 9,
+        ("review-list", "get"): 2,
+        ("review-list", "post"): 7,
+        ("review-detail", "get"): 1,
+        ("review-detail", "put"): 9,
+        ("review-detail", "patch"): 8,
+        ("review-detail", "delete"): 4,
+    }
+
+    def _build(self, n):
+        flush_catalog()
+        seed_catalog(products=4 * n, categories=n, carts=n, seed=n)
+        User = get_user_model()
+        self.user = User.objects.create_user(f"budget-{n}", password="x", is_staff=True)
+        self.category = Category.objects.create(name=f"Target {n}")
+        self.products = Product.objects.bulk_create([
+            Product(name=f"Target {n} {i}", slug=f"target-{n}-{i}", price=i + 1, category=self.category)
+            for i in range(n)
+        ])
+        self.product = self.products[0]
+        self.cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=self.cart, product=p, quantity=2) for p in self.products])
+        recompute_cart_totals(Cart.objects.filter(pk=self.cart.pk))
+        self.item = self.cart.items.first()
+        reviewers = User.objects.bulk_create([User(username=f"reviewer-{n}-{i}") for i in range(n)])
+        for i, reviewer in enumerate(reviewers):
+            Review.objects.create(product=self.product, user=reviewer, rating=i % 5 + 1)
+        self.review = Review.objects.create(product=self.product, user=self.user, rating=4)
+
+    def _cases(self):
+        product, category, cart, review = self.product.slug, self.category.slug, self.cart.cart_code, self.review.pk
+        other = self.products[1].pk
+        product_body = {"name": "Budget", "price": "3.00", "category_id": self.category.pk}
+        ndjson = "\n".join(json.dumps({"name": f"Imported {i}", "price": "1.00"}) for i in range(3))
+        return {
+            ("api-root", "get"): ("/api/", {}),
+            ("metrics", "get"): ("/api/_metrics", {}),
+            ("product-list", "get"): ("/api/products/", {}),
+            ("product-list", "post"): ("/api/products/", {"data": product_body}),
+            ("product-bulk-import", "post"): ("/api/products/import/", {"data": ndjson, "content_type": "application/x-ndjson"}),
+            ("product-search", "get"): ("/api/products/search/?q=target", {}),
+            ("product-batch", "get"): (f"/api/products/batch/?slugs={','.join(p.slug for p in self.products)},gone", {}),
+            ("product-changes", "get"): ("/api/products/changes/", {}),
+            ("product-detail", "get"): (f"/api/products/{product}/", {}),
+            ("product-detail", "put"): (f"/api/products/{product}/", {"data": product_body}),
+            ("product-detail", "patch"): (f"/api/products/{product}/", {"data": {"price": "9.00"}}),
+            ("product-detail", "delete"): (f"/api/products/{product}/", {}),
+            ("category-list", "get"): ("/api/categories/", {}),
+            ("category-list", "post"): ("/api/categories/", {"data": {"name": "Budget"}}),
+            ("category-detail", "get"): (f"/api/categories/{category}/", {}),
+            ("category-detail", "put"): (f"/api/categories/{category}/", {"data": {"name": "Renamed"}}),
+            ("category-detail", "patch"): (f"/api/categories/{category}/", {"data": {"name": "Renamed"}}),
+            ("category-detail", "delete"): (f"/api/categories/{category}/", {}),
+            ("cart-list", "get"): ("/api/carts/", {}),
+            ("cart-list", "post"): ("/api/carts/", {}),
+            ("cart-detail", "get"): (f"/api/carts/{cart}/", {}),
+            ("cart-detail", "put"): (f"/api/carts/{cart}/", {"data": {}}),
+            ("cart-detail", "patch"): (f"/api/carts/{cart}/", {"data": {}}),
+            ("cart-detail", "delete"): (f"/api/carts/{cart}/", {}),
+            ("cart-add-or-set-item", "post"): (f"/api/carts/{cart}/items/", {"data": {"product_id": other, "quantity": 5}}),
+            ("cart-batch-items", "post"): (
+                f"/api/carts/{cart}/items/batch/",
+                {"data": {"operations": [{"op": "add", "product_id": other}, {"op": "remove", "product_id": self.product.pk}]}},
+            ),
+            ("cart-clear", "delete"): (f"/api/carts/{cart}/clear/", {}),
+            ("cart-update-item", "patch"): (f"/api/carts/{cart}/items/{self.item.pk}/", {"data": {"quantity": 4}}),
+            ("cart-update-item", "delete"): (f"/api/carts/{cart}/items/{self.item.pk}/", {}),
+            ("review-list", "get"): (f"/api/reviews/?product={self.product.pk}", {}),
+            ("review-list", "post"): ("/api/reviews/", {"data": {"product": other, "rating": 5}}),
+            ("review-detail", "get"): (f"/api/reviews/{review}/", {}),
+            ("review-detail", "put"): (f"/api/reviews/{review}/", {"data": {"product": self.product.pk, "rating": 2}}),
+            ("review-detail", "patch"): (f"/api/reviews/{review}/", {"data": {"rating": 3}}),
+            ("review-detail", "delete"): (f"/api/reviews/{review}/", {}),
+        }
+
+    def _measure(self, key, path, kwargs):
+        method = key[1]
+        if "content_type" not in kwargs and method != "get":
+            kwargs = {**kwargs, "format": "json"}
+        # Warm the process-local category cache, as in steady state
+        category_cache.get_category_id(self.category.slug)
+        with transaction.atomic():
+            with QueryLog() as log:
+                resp = getattr(self.client, method)(path, **kwargs)
+            transaction.set_rollback(True)
+        self.assertLess(resp.status_code, 300, f"{method.upper()} {path}: {resp.status_code} {getattr(resp, 'data', '')}")
+        return log
+
+    def test_report_groups_queries_by_call_site(self):
+        category = Category.objects.create(name="Nails")
+        Product.objects.bulk_create([Product(name=f"P{i}", slug=f"p{i}", price=1, category=category) for i in range(3)])
+        with QueryLog() as log:
+            for product in Product.objects.all():
+                product.category  # the N+1 shape: one query per row
+        report = log.report()
+        self.assertIn("3 x products/tests.py:", report)
+        self.assertIn('FROM "products_category"', report)
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(api_routes(api_urls.urlpatterns), set(self.BUDGETS))
+
+    def test_query_budgets(self):
+        counts = {}
+        failures = []
+        for n in self.SIZES:
+            self._build(n)
+            self.client.force_authenticate(self.user)
+            for key, (path, kwargs) in self._cases().items():
+                log = self._measure(key, path, kwargs)
+                counts.setdefault(key, []).append(len(log))
+                budget = self.BUDGETS[key]
+                if len(log) > budget or len(log) != counts[key][0]:
+                    failures.append(
+                        f"{key[1].upper()} {key[0]} at size {n}: {len(log)} queries "
+                        f"(budget {budget}, {counts[key][0]} at size {self.SIZES[0]})\n{log.report()}"
+                    )
+        if failures:
+            self.fail("Query budgets exceeded:\n" + "\n\n".join(failures))
+
+
+
+class TestDatabaseRouter(APITestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        # A configured replica, outside the test case's transaction
+        replica = mock.patch.dict(connections.settings, {"replica": connections.settings["default"]})
+        outside_atomic = mock.patch.object(connections["default"], "in_atomic_block", False)
+        for patcher in (replica, outside_atomic):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_catalog_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        for model in (Product, Category, Review):
+            self.assertEqual(self.router.db_for_read(model), "replica")
+            self.assertEqual(self.router.db_for_write(model), "default")
+        for model in (Cart, CartItem, get_user_model()):
+            self.assertEqual(self.router.db_for_read(model), "default")
+        self.assertTrue(self.router.allow_migrate("default", "products"))
+        self.assertFalse(self.router.allow_migrate("replica", "products"))
+
+    def test_reads_stay_on_the_primary_when_pinned_or_in_a_transaction(self):
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Product), "default")
+        with mock.patch.object(connections["default"], "in_atomic_block", True):
+            self.assertEqual(self.router.db_for_read(Product), "default")
+        with mock.patch.dict(connections.settings):
+            del connections.settings["replica"]
+            self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_middleware_pins_unsafe_requests(self):
+        seen = {}
+
+        def view(request):
+            seen[request.method] = self.router.db_for_read(Product)
+
+        middleware = PrimaryForWritesMiddleware(view)
+        factory = RequestFactory()
+        middleware(factory.get("/"))
+        middleware(factory.post("/"))
+        self.assertEqual(seen, {"GET": "replica", "POST": "default"})
+
+    def _catalog_reads(self):
+        # Where each catalog read of the block was routed
+        seen = set()
+        db_for_read = PrimaryReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            if model._meta.model_name in REPLICA_MODELS:
+                seen.add(alias)
+            return alias
+
+        return seen, mock.patch.object(PrimaryReplicaRouter, "db_for_read", spy)
+
+    @override_settings(CATALOG_RESPONSE_CACHE_ENABLED=True)
+    def test_response_cache_misses_are_filled_from_the_primary(self):
+        # A replica lagging behind a version bump must not end up cached under it
+        caches[response_cache.CACHE_ALIAS].clear()
+        seen, spy = self._catalog_reads()
+        with spy:
+            miss = self.client.get("/api/products/")
+            self.assertEqual(seen, {"default"})
+            seen.clear()
+            hit = self.client.get("/api/products/")
+        self.assertEqual((miss["X-Cache"], hit["X-Cache"]), ("MISS", "HIT"))
+        self.assertEqual(seen, set())
+
+    @override_settings(CATALOG_RESPONSE_CACHE_ENABLED=True)
+    async def test_async_response_cache_misses_are_filled_from_the_primary(self):
+        await caches[response_cache.CACHE_ALIAS].aclear()
+        view = next(p.callback for p in async_read_urls(router.urls) if p.name == "product-list")
+        seen, spy = self._catalog_reads()
+        with spy:
+            response = await view(AsyncRequestFactory().get("/api/products/"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(seen, {"default"})
+
+
+class TestSparseFieldsets(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Glue")
+        self.product = Product.objects.create(
+            name="Wood glue", description="Long text " * 100, price=Decimal("4.00"), category=category
+        )
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+
+    def _get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(path)
+        return resp, " ".join(query["sql"] for query in queries.captured_queries)
+
+    def test_list_selects_only_requested_columns(self):
+        resp, sql = self._get("/api/products/?fields=id,name,price")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data["results"], [{"id": self.product.pk, "name": "Wood glue", "price": "4.00"}])
+        self.assertNotIn('"slug"', sql)
+        self.assertNotIn('"image_variants"', sql)
+
+    def test_retrieve_defers_omitted_columns(self):
+        resp, sql = self._get(f"/api/products/{self.product.slug}/?omit=description,rating_histogram")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("description", resp.data)
+        self.assertEqual(resp.data["category"]["name"], "Glue")
+        self.assertNotIn('"description"', sql)
+
+    def test_cart_without_items(self):
+        resp, sql = self._get("/api/carts/?fields=cart_code,total")
+        self.assertEqual(resp.data["results"], [{"cart_code": self.cart.cart_code, "total": Decimal("8.00")}])
+        self.assertNotIn('"products_cartitem"."quantity"', sql)
+        resp = self.client.get(f"/api/carts/{self.cart.cart_code}/?omit=items")
+        self.assertNotIn("items", resp.data)
+        self.assertEqual(resp.data["item_count"], 2)
+
+    def test_fields_are_validated_per_serializer(self):
+        # description is a detail field, not a list one
+        resp = self.client.get("/api/products/?fields=name,description")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Unknown fields: description", resp.data["fields"])
+        resp = self.client.get(f"/api/products/{self.product.slug}/?fields=name,description")
+        self.assertEqual(set(resp.data), {"name", "description"})
+        for query in ("fields=name&omit=price", "fields=", "omit=id,name,slug,image,image_srcset,price,rating,rating_count"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/api/products/?{query}").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestProductBatch(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Tape")
+        self.products = [
+            Product.objects.create(name=f"Tape {i}", price=i + 1, category=category) for i in range(3)
+        ]
+        _warm_category_cache(category.pk)
+
+    def test_results_follow_request_order_with_not_found_markers(self):
+        first, second, _third = self.products
+        # The catalog version and the products
+        with self.assertNumQueries(2):
+            resp = self.client.get(f"/api/products/batch/?slugs={second.slug},missing,{first.slug},{second.slug}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.data["results"]
+        self.assertEqual([r and r["slug"] for r in results], [second.slug, None, first.slug, second.slug])
+        self.assertEqual(results[0]["category"]["name"], "Tape")
+        self.assertEqual(resp.data["not_found"], ["missing"])
+
+        resp = self.client.get(f"/api/products/batch/?ids={first.pk},0&fields=id,name")
+        self.assertEqual(resp.data, {"results": [{"id": first.pk, "name": "Tape 0"}, None], "not_found": ["0"]})
+
+    def test_bad_requests(self):
+        too_many = ",".join(str(i) for i in range(1, 202))
+        huge = 2 ** 63
+        for query in ("", "slugs=a&ids=1", "ids=1,x", "slugs=,", f"ids={too_many}", "ids=%C2%B2", f"ids={huge}"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/api/products/batch/?{query}").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestStockReservations(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Flash sale kettle", price="30.00")
+        self.other = Product.objects.create(name="Mug", price="5.00")  # untracked
+        set_stock(self.product, 3)
+        self.cart = Cart.objects.create()
+
+    def _add(self, quantity, product=None):
+        return self.client.post(
+            f"/api/carts/{self.cart.cart_code}/items/",
+            {"product_id": (product or self.product).pk, "quantity": quantity}, format="json",
+        )
+
+    def _reserved(self):
+        return stock_levels(self.product)["reserved"]
+
+    def test_item_writes_reserve_and_release(self):
+        self.assertEqual(self._add(2).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._reserved(), 2)
+        resp = self._add(4)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual((resp.data["product_id"], resp.data["available"]), (self.product.pk, 1))
+        self.assertEqual(self.cart.items.get().quantity, 2)
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).item_count, 2)
+
+        item = self.cart.items.get()
+        resp = self.client.patch(f"/api/carts/{self.cart.cart_code}/items/{item.pk}/", {"quantity": 1}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._reserved(), 1)
+        self.client.delete(f"/api/carts/{self.cart.cart_code}/items/{item.pk}/")
+        self.assertEqual(self._reserved(), 0)
+        self.assertEqual(self._add(500, product=self.other).status_code, status.HTTP_200_OK)
+
+    def test_batch_is_all_or_nothing(self):
+        path = f"/api/carts/{self.cart.cart_code}/items/batch/"
+        ops = [{"op": "add", "product_id": self.other.pk, "quantity": 2}, {"op": "add", "product_id": self.product.pk, "quantity": 4}]
+        self.assertEqual(self.client.post(path, {"operations": ops}, format="json").status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(self.cart.items.exists())
+        self.assertEqual(self._reserved(), 0)
+        ops[1]["quantity"] = 3
+        self.assertEqual(self.client.post(path, {"operations": ops}, format="json").status_code, status.HTTP_200_OK)
+        self.assertEqual(self._reserved(), 3)
+        ops = [{"op": "set", "product_id": self.product.pk, "quantity": 1}]
+        self.client.post(path, {"operations": ops}, format="json")
+        self.assertEqual(self._reserved(), 1)
+
+    def test_holds_expire_with_the_cart(self):
+        self._add(2)
+        self.cart.clear()
+        self.assertEqual(self._reserved(), 0)
+        self._add(2)
+        Cart.objects.filter(pk=self.cart.pk).update(updated_at=timezone.now() - timedelta(days=90))
+        self.assertEqual(purge_stale_carts(), (1, 1))
+        self.assertEqual(self._reserved(), 0)
+        self.cart = Cart.objects.create()
+        self._add(3)
+        self.assertEqual(self.client.delete(f"/api/carts/{self.cart.cart_code}/").status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self._reserved(), 0)
+
+    def test_reserve_is_one_conditional_update(self):
+        with self.assertNumQueries(1):
+            Stock.reserve(self.product.pk, 2)
+        with self.assertRaises(InsufficientStock):
+            Stock.reserve(self.product.pk, 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Stock.objects.filter(product=self.product).update(reserved=4)
+
+    def test_sharded_stock(self):
+        self._add(2)
+        set_stock(self.product, 10, shards=4)
+        rows = list(Stock.objects.filter(product=self.product).order_by("shard").values_list("quantity", "reserved"))
+        self.assertEqual(rows, [(3, 1), (3, 1), (2, 0), (2, 0)])
+        # More than any one shard has free: taken across shards
+        Stock.reserve(self.product.pk, 5)
+        self.assertEqual(stock_levels(self.product), {"quantity": 10, "reserved": 7, "available": 3})
+        with self.assertRaises(InsufficientStock):
+            Stock.reserve(self.product.pk, 4)
+        Stock.release(self.product.pk, 6)
+        self.assertEqual(self._reserved(), 1)
+        with self.assertRaisesMessage(ValueError, "Carts hold 2 units"):
+            set_stock(self.product, 1)
+
+
+@override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+class TestProductChanges(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Ink")
+        self.products = [
+            Product.objects.create(name=f"Ink {i}", price=i + 1, category=category) for i in range(3)
+        ]
+        _warm_category_cache(category.pk)
+
+    def _changes(self, query=""):
+        resp = self.client.get(f"/api/products/changes/?{query}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return resp.data
+
+    def test_feed_resumes_from_its_cursor(self):
+        first, second, _third = self.products
+        second_pk = second.pk
+        # The catalog version, products and tombstones
+        with self.assertNumQueries(3):
+            data = self._changes("fields=id,name")
+        self.assertEqual(
+            [(c["op"], c["id"], c["product"]) for c in data["changes"]],
+            [("created", p.pk, {"id": p.pk, "name": p.name}) for p in self.products],
+        )
+        self.assertFalse(data["has_more"])
+
+        first.price = 9
+        first.save()
+        second.delete()
+        resumed = self._changes(f"since={data['cursor']}")
+        self.assertEqual(
+            [(c["op"], c["id"]) for c in resumed["changes"]],
+            [("updated", first.pk), ("deleted", second_pk)],
+        )
+        self.assertEqual(resumed["changes"][0]["product"]["price"], "9.00")
+        self.assertEqual(resumed["changes"][1]["slug"], second.slug)
+
+        idle = self._changes(f"since={resumed['cursor']}")
+        self.assertEqual((idle["changes"], idle["cursor"]), ([], resumed["cursor"]))
+
+    def test_category_writes_show_up_as_product_updates(self):
+        cursor = self._changes()["cursor"]
+        category = Category.objects.get(name="Ink")
+        category.name = "Toner"
+        category.save()
+        renamed = self._changes(f"since={cursor}")
+        self.assertEqual([(c["op"], c["id"]) for c in renamed["changes"]], [("updated", p.pk) for p in self.products])
+        self.assertEqual({c["product"]["category"]["name"] for c in renamed["changes"]}, {"Toner"})
+
+        category.delete()
+        orphaned = self._changes(f"since={renamed['cursor']}")
+        self.assertEqual([c["id"] for c in orphaned["changes"]], [p.pk for p in self.products])
+        self.assertEqual({c["product"]["category"] for c in orphaned["changes"]}, {None})
+
+    def test_limit_pages_through_changes(self):
+        data = self._changes("limit=2")
+        self.assertEqual([c["id"] for c in data["changes"]], [p.pk for p in self.products[:2]])
+        self.assertTrue(data["has_more"])
+        data = self._changes(f"limit=2&since={data['cursor']}")
+        self.assertEqual([c["id"] for c in data["changes"]], [self.products[2].pk])
+        self.assertFalse(data["has_more"])
+
+    def test_unsettled_and_expired(self):
+        with override_settings(CHANGE_FEED_SETTLE_SECONDS=60):
+            self.assertEqual(self._changes()["changes"], [])
+        expired = encode_cursor(timezone.now() - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS + 1), 0)
+        self.assertEqual(self.client.get(f"/api/products/changes/?since={expired}").status_code, status.HTTP_410_GONE)
+        naive = base64.urlsafe_b64encode(b'{"t":"2026-10-17T00:00:00","i":1}').decode()
+        past_utc = base64.urlsafe_b64encode(b'{"t":"9999-12-31T23:59:59-12:00","i":1}').decode()
+        huge_id = base64.urlsafe_b64encode(b'{"t":"2026-10-17T00:00:00+00:00","i":%d}' % 2 ** 70).decode()
+        for query in ("since=nope", "limit=x", f"since={naive}", f"since={past_utc}", f"since={huge_id}"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/api/products/changes/?{query}").status_code, status.HTTP_400_BAD_REQUEST)
+
+        old, recent = [p.pk for p in self.products[:2]]
+        Product.objects.filter(pk__in=[old, recent]).delete()
+        ProductTombstone.objects.filter(product_id=old).update(
+            deleted_at=timezone.now() - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS + 1)
+        )
+        self.assertEqual(purge_tombstones(), 1)
+        self.assertEqual(list(ProductTombstone.objects.values_list("product_id", flat=True)), [recent])
@@ -1,12 +1,21 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, CategoryViewSet, CartViewSet
+from .views import ProductViewSet, CategoryViewSet, CartViewSet, ReviewViewSet, MetricsView
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'carts', CartViewSet, basename='cart')
+router.register(r'reviews', ReviewViewSet, basename='review')
+
+router_urls = router.urls
+if settings.ASYNC_CATALOG_READS:
+    # Async-native handlers for the hot read routes (ASGI only, see async_views)
+    from .async_views import async_read_urls
+    router_urls = async_read_urls(router_urls)
 
 urlpatterns = [
-    path('', include(router.urls)),
-]  
\ No newline at end of file
+    path('_metrics', MetricsView.as_view(), name='metrics'),
+    path('', include(router_urls)),
+]
@@ -1,24 +1,92 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from django.db.models import Count, Max
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Product, Category
+from .models import Product, Category, Review
 from .serializers import (
     ProductListSerializer,
     ProductDetailSerializer,
+    ProductSearchResultSerializer,
     CategoryListSerializer,
     CategoryDetailSerializer,
     CartSerializer,
     CartItemSerializer,
+    CartBatchSerializer,
+    ReviewSerializer,
 )
-from .models import Cart, CartItem, Product
+from .models import CART_MAX_QUANTITY, ID_MAX, Cart, CartItem, CartTooLarge, InsufficientStock, Product
+from .pagination import ProductPagination
+from .conditional import ConditionalGetMixin
+from .response_cache import CachedResponseMixin, current_version
+from .rows import RowListMixin
+from .fieldsets import SparseFieldsetMixin, fieldset_parameters
+from . import category_cache
+from .category_cache import get_category_block
+from .filters import ProductFilterBackend, _decimal, product_facets
+from .importer import import_products
+from .carts import apply_cart_operations, cart_queryset, cart_validators
+from .search import search_products
+from .metrics import TimedRenderMixin, metrics_text
+from .changes import CHANGE_OPS, OP_DELETED, product_changes
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view, inline_serializer
+from rest_framework import permissions, serializers
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
+# Columns read by ProductListSerializer
+PRODUCT_LIST_COLUMNS = ("id", "name", "slug", "image", "image_variants", "price", "rating_avg", "rating_count")
 
-class ProductViewSet(viewsets.ModelViewSet):
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
+# Most slugs or ids one products/batch request may name
+BATCH_MAX_KEYS = 200
+
+CHANGES_DEFAULT_LIMIT = 100
+CHANGES_MAX_LIMIT = 500
+
+# Content types accepted by the bulk import endpoint
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+def parse_id(value):
+    """`value` as an id if it is ASCII digits (str.isdigit() also takes "²") up to ID_MAX, else None."""
+    # Length first: int() of a long enough digit string raises
+    if value.isascii() and value.isdigit() and len(value) <= len(str(ID_MAX)) and int(value) <= ID_MAX:
+        return int(value)
+    return None
+
+
+@extend_schema_view(
+    list=extend_schema(parameters=fieldset_parameters(ProductListSerializer)),
+    retrieve=extend_schema(parameters=fieldset_parameters(ProductDetailSerializer)),
+    batch=extend_schema(parameters=fieldset_parameters(ProductDetailSerializer)),
+    changes=extend_schema(parameters=fieldset_parameters(ProductDetailSerializer)),
+)
+class ProductViewSet(
+    CachedResponseMixin, TimedRenderMixin, ConditionalGetMixin, SparseFieldsetMixin, RowListMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Product.objects.all()
     serializer_class = ProductDetailSerializer  # default for retrieve/create/update
+    pagination_class = ProductPagination
+    filter_backends = [ProductFilterBackend]
     lookup_field = "slug"
     lookup_url_kwarg = "slug"
+    # List rows are .values() (RowListMixin); keyset cursors need created_at too
+    row_extra_columns = ("created_at",)
+    fieldset_actions = ("list", "retrieve", "batch", "changes")
+    # Read by get_object_validators and the change feed even when ?fields= leaves them out
+    fieldset_required_columns = ("created_at", "updated_at")
 
     # Use lightweight fields for list; detailed fields for retrieve.
     def get_serializer_class(self):
@@ -26,8 +94,203 @@ class ProductViewSet(viewsets.ModelViewSet):
             return ProductListSerializer
         return super().get_serializer_class()
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Reads that nest category blocks (or look up ?category= slugs) must
+        # see other processes' category writes; cached reads sync in
+        # CachedResponseMixin, with the version they key on
+        if request.method == "GET" and (
+            self.action in ("batch", "changes")
+            or (self.action in ("list", "retrieve") and not self._cacheable(request))
+        ):
+            category_cache.sync(current_version())
+
+    def is_conditional(self, request):
+        # The list validators aggregate over the whole filtered table; a
+        # keyset page must cost the same as the first, so it has none
+        if self.action == "list" and self.paginator.use_keyset(request):
+            return False
+        return super().is_conditional(request)
+
+    def get_list_validators(self, queryset):
+        stats = queryset.aggregate(last=Max("updated_at"), count=Count("id"))
+        return (stats["last"], stats["count"]), stats["last"]
+
+    def get_object_validators(self, instance):
+        # The nested category block is part of the body
+        block = get_category_block(instance.category_id)
+        return (instance.pk, instance.updated_at, block), instance.updated_at
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get("facets") in ("1", "true") and isinstance(response.data, dict):
+            # Over the whole filtered set, not just this page
+            response.data["facets"] = product_facets(self.filter_queryset(self.get_queryset()))
+        return response
 
-class CategoryViewSet(viewsets.ModelViewSet):
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("q", str, required=True, description="Search terms (prefix-matched)"),
+            OpenApiParameter("limit", int, description=f"Results per page (max {SEARCH_MAX_LIMIT})"),
+            OpenApiParameter("offset", int),
+        ],
+        responses=inline_serializer("ProductSearchPage", {
+            "next": serializers.URLField(allow_null=True),
+            "results": ProductSearchResultSerializer(many=True),
+        }),
+    )
+    @action(detail=False, methods=["get"], url_path="search", pagination_class=None)
+    def search(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise ValidationError({"q": "This parameter is required."})
+        try:
+            limit = min(max(int(request.query_params.get("limit", SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+            # Clamped: the database takes a 64-bit OFFSET, and no page lies past it
+            offset = min(max(int(request.query_params.get("offset", 0)), 0), ID_MAX)
+        except ValueError:
+            raise ValidationError({"detail": "limit and offset must be integers"})
+
+        # One extra hit tells us whether there is a next page
+        hits = search_products(query, limit=limit + 1, offset=offset)
+        products = Product.objects.only(*PRODUCT_LIST_COLUMNS).in_bulk(
+            [pk for pk, _rank, _snippet in hits[:limit]]
+        )
+        results = []
+        for pk, rank, snippet in hits[:limit]:
+            product = products.get(pk)
+            if product is not None:
+                product.rank = rank
+                product.snippet = snippet
+                results.append(product)
+        next_url = None
+        if len(hits) > limit:
+            next_url = replace_query_param(request.build_absolute_uri(), "offset", offset + limit)
+        serializer = ProductSearchResultSerializer(results, many=True, context=self.get_serializer_context())
+        return Response({"next": next_url, "results": serializer.data})
+
+    @extend_schema(
+        description=(
+            "Products by slug or id in one request, in request order. A key that matches no product "
+            "has null in `results` and is listed in `not_found`."
+        ),
+        parameters=[
+            OpenApiParameter("slugs", str, description=f"Comma-separated product slugs (at most {BATCH_MAX_KEYS})"),
+            OpenApiParameter("ids", str, description="Comma-separated product ids, instead of slugs"),
+        ],
+        responses=inline_serializer("ProductBatch", {
+            "results": serializers.ListField(child=ProductDetailSerializer(allow_null=True)),
+            "not_found": serializers.ListField(child=serializers.CharField()),
+        }),
+    )
+    @action(detail=False, methods=["get"], url_path="batch", pagination_class=None)
+    def batch(self, request):
+        # One IN query for all keys; category blocks come from the category cache
+        params = request.query_params
+        if ("slugs" in params) == ("ids" in params):
+            raise ValidationError({"detail": "Pass either slugs or ids"})
+        field = "slug" if "slugs" in params else "pk"
+        keys = [key.strip() for key in params.get("slugs", params.get("ids")).split(",") if key.strip()]
+        if not keys or len(keys) > BATCH_MAX_KEYS:
+            raise ValidationError({"detail": f"Name between 1 and {BATCH_MAX_KEYS} products"})
+        if field == "pk":
+            keys = [parse_id(key) for key in keys]
+            if None in keys:
+                raise ValidationError({"ids": "Product ids must be integers"})
+
+        # get_queryset() defers columns left out by ?fields=/?omit=
+        products = self.get_queryset().in_bulk(set(keys), field_name=field)
+        found = list(products.values())
+        data = dict(zip(products, self.get_serializer(found, many=True).data))
+        return Response({
+            "results": [data.get(key) for key in keys],
+            "not_found": [str(key) for key in keys if key not in data],
+        })
+
+    @extend_schema(
+        description=(
+            "Products created, updated or deleted since a cursor, oldest first in (timestamp, id) order, "
+            "for incremental sync. Start without `since`, then pass the returned `cursor` back; "
+            "`has_more` means another call has more changes ready. A product changed several times "
+            "appears once, with its current body; a deleted one as a `deleted` entry with its id and slug. "
+            "Changes from the last few seconds are held back until they have settled, and a cursor "
+            "older than the feed's retention gets a 410: sync again from the start."
+        ),
+        parameters=[
+            OpenApiParameter("since", str, description="Cursor from a previous response"),
+            OpenApiParameter(
+                "limit", int,
+                description=f"Changes per response (default {CHANGES_DEFAULT_LIMIT}, max {CHANGES_MAX_LIMIT})",
+            ),
+        ],
+        responses=inline_serializer("ProductChanges", {
+            "changes": serializers.ListField(child=inline_serializer("ProductChange", {
+                "op": serializers.ChoiceField(CHANGE_OPS),
+                "id": serializers.IntegerField(),
+                "at": serializers.DateTimeField(),
+                "product": ProductDetailSerializer(required=False),
+                "slug": serializers.SlugField(required=False, allow_null=True),
+            })),
+            "cursor": serializers.CharField(allow_null=True),
+            "has_more": serializers.BooleanField(),
+        }),
+    )
+    @action(detail=False, methods=["get"], url_path="changes", pagination_class=None)
+    def changes(self, request):
+        # One seek each on the product and tombstone indexes; see changes.py
+        try:
+            limit = int(request.query_params.get("limit", CHANGES_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Must be an integer"})
+        limit = min(max(limit, 1), CHANGES_MAX_LIMIT)
+        changes, cursor, has_more = product_changes(
+            self.get_queryset(), since=request.query_params.get("since") or None, limit=limit
+        )
+
+        products = [record for op, record in changes if op != OP_DELETED]
+        bodies = iter(self.get_serializer(products, many=True).data)
+        stamp = serializers.DateTimeField()
+        entries = []
+        for op, record in changes:
+            if op == OP_DELETED:
+                entries.append({
+                    "op": op, "id": record.product_id,
+                    "at": stamp.to_representation(record.deleted_at), "slug": record.slug,
+                })
+            else:
+                entries.append({
+                    "op": op, "id": record.pk,
+                    "at": stamp.to_representation(record.updated_at), "product": next(bodies),
+                })
+        return Response({"changes": entries, "cursor": cursor, "has_more": has_more})
+
+    @extend_schema(
+        request={content_type: OpenApiTypes.STR for content_type in IMPORT_FORMATS},
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @action(detail=False, methods=["post"], url_path="import")
+    def bulk_import(self, request):
+        # Stream the raw body line by line instead of parsing it into memory
+        content_type = request.content_type.split(";")[0].strip()
+        fmt = IMPORT_FORMATS.get(content_type)
+        if fmt is None:
+            return Response(
+                {"detail": f"Unsupported content type; use one of {', '.join(IMPORT_FORMATS)}"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        lines = (line.decode("utf-8-sig", errors="replace") for line in request._request)
+        result = import_products(lines, fmt)
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    list=extend_schema(parameters=fieldset_parameters(CategoryListSerializer)),
+    retrieve=extend_schema(parameters=fieldset_parameters(CategoryDetailSerializer)),
+)
+class CategoryViewSet(
+    CachedResponseMixin, TimedRenderMixin, ConditionalGetMixin, SparseFieldsetMixin, RowListMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Category.objects.all()
     serializer_class = CategoryDetailSerializer  # default for retrieve/create/update
     lookup_field = "slug"
@@ -38,18 +301,90 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return CategoryListSerializer
         return super().get_serializer_class()
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "retrieve":
+            queryset = queryset.annotate(
+                product_count=Count("products"),
+                products_updated_at=Max("products__updated_at"),
+            )
+        return queryset
 
-class CartViewSet(viewsets.ModelViewSet):
-    queryset = Cart.objects.prefetch_related("items__product").all()
+    def get_list_validators(self, queryset):
+        stats = queryset.aggregate(last=Max("updated_at"), count=Count("id"))
+        return (stats["last"], stats["count"]), stats["last"]
+
+    def get_object_validators(self, instance):
+        # Annotated in get_queryset, so revalidation costs the one lookup query
+        last = max(filter(None, [instance.updated_at, instance.products_updated_at]))
+        return (instance.pk, instance.updated_at, instance.product_count, instance.products_updated_at), last
+
+
+@extend_schema_view(
+    list=extend_schema(parameters=fieldset_parameters(CartSerializer)),
+    retrieve=extend_schema(parameters=fieldset_parameters(CartSerializer)),
+)
+class CartViewSet(TimedRenderMixin, ConditionalGetMixin, SparseFieldsetMixin, RowListMixin, viewsets.ModelViewSet):
+    queryset = cart_queryset()
     serializer_class = CartSerializer
     lookup_field = "cart_code"
     lookup_url_kwarg = "cart_code"
+    # Read by cart_validators even when ?fields= leaves it out
+    fieldset_required_columns = ("updated_at",)
+    # A list validator would have to aggregate over every cart's items and
+    # products, about what rendering the page costs; only detail revalidates
+    conditional_actions = ("retrieve",)
+    # Item actions only need the cart row; they respond via _cart_response
+    item_actions = {"add_or_set_item", "batch_items", "update_item", "remove_item", "clear"}
+
+    filter_backends = [OrderingFilter]
+    ordering_fields = ["subtotal", "item_count", "created_at", "updated_at"]
+
+    def get_queryset(self):
+        if self.action in self.item_actions:
+            return Cart.objects.all()
+        if self.action != "list":
+            return super().get_queryset()
+        # RowListMixin fetches the page's items itself, so no prefetch. Filter
+        # on the stored totals; items are never touched.
+        queryset = Cart.objects.all()
+        params = self.request.query_params
+        if "min_subtotal" in params:
+            queryset = queryset.filter(subtotal__gte=_decimal(params, "min_subtotal"))
+        if "max_subtotal" in params:
+            queryset = queryset.filter(subtotal__lte=_decimal(params, "max_subtotal"))
+        return queryset
+
+    def get_object_validators(self, instance):
+        # Items and products are already prefetched; no extra query
+        return cart_validators(instance)
+
+    def handle_exception(self, exc):
+        # An item write asked for more stock than is left; nothing was changed
+        if isinstance(exc, InsufficientStock):
+            return Response(
+                {"detail": str(exc), "product_id": exc.product_id, "available": exc.available},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if isinstance(exc, CartTooLarge):
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().handle_exception(exc)
 
     def create(self, request, *args, **kwargs):
         cart = Cart.objects.create()
         serializer = self.get_serializer(cart)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        cart = self.get_object()
+        serializer = self.get_serializer(cart, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        # UpdateModelMixin drops the prefetched items after saving, and the
+        # response would then load each item's product separately
+        return self._cart_response(cart)
+
     @action(detail=True, methods=["post"], url_path="items")
     def add_or_set_item(self, request, cart_code=None):
         cart = self.get_object()
@@ -62,7 +397,25 @@ class CartViewSet(viewsets.ModelViewSet):
             item.quantity = quantity
             item.save(update_fields=["quantity", "updated_at"])
         # Return the full cart
-        return Response(CartSerializer(cart).data, status=status.HTTP_200_OK)
+        return self._cart_response(cart)
+
+    @extend_schema(request=CartBatchSerializer, responses=CartSerializer)
+    @action(detail=True, methods=["post"], url_path="items/batch")
+    def batch_items(self, request, cart_code=None):
+        cart = self.get_object()
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        apply_cart_operations(
+            cart, serializer.validated_data["operations"],
+            serializer.validated_data["prices"], serializer.validated_data["tracked"],
+        )
+        return self._cart_response(cart)
+
+    def _cart_response(self, cart):
+        # Re-read the cart with items and products prefetched, so the
+        # serializer doesn't fetch each item's product separately
+        cart = cart_queryset().get(pk=cart.pk)
+        return Response(CartSerializer(cart, context=self.get_serializer_context()).data)
 
     @action(detail=True, methods=["patch"], url_path=r"items/(?P<item_id>[^/.]+)")
     def update_item(self, request, cart_code=None, item_id=None):
@@ -73,22 +426,60 @@ class CartViewSet(viewsets.ModelViewSet):
             quantity = int(quantity)
         except (TypeError, ValueError):
             return Response({"detail": "quantity must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity > CART_MAX_QUANTITY:
+            return Response(
+                {"detail": f"quantity must be at most {CART_MAX_QUANTITY}"}, status=status.HTTP_400_BAD_REQUEST
+            )
         if quantity <= 0:
             item.delete()
         else:
             item.quantity = quantity
             item.save(update_fields=["quantity", "updated_at"])
-        return Response(CartSerializer(cart).data)
+        return self._cart_response(cart)
 
-    @action(detail=True, methods=["delete"], url_path=r"items/(?P<item_id>[^/.]+)")
+    # Same URL as update_item; two actions with one url_path shadow each other
+    @update_item.mapping.delete
     def remove_item(self, request, cart_code=None, item_id=None):
         cart = self.get_object()
         item = get_object_or_404(CartItem, pk=item_id, cart=cart)
         item.delete()
-        return Response(CartSerializer(cart).data, status=status.HTTP_200_OK)
+        return self._cart_response(cart)
 
     @action(detail=True, methods=["delete"], url_path="clear")
     def clear(self, request, cart_code=None):
         cart = self.get_object()
-        cart.items.all().delete()
-        return Response(CartSerializer(cart).data, status=status.HTTP_200_OK)
+        cart.clear()
+        return self._cart_response(cart)
+
+
+class ReviewViewSet(TimedRenderMixin, viewsets.ModelViewSet):
+    queryset = Review.objects.all()
+    serializer_class = ReviewSerializer
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    @extend_schema(parameters=[OpenApiParameter("product", int, description="Only reviews of this product id")])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in permissions.SAFE_METHODS:
+            # Reviews can only be changed by their authors; others get a 404
+            return queryset.filter(user=self.request.user)
+        product = self.request.query_params.get("product")
+        if product:
+            product_id = parse_id(product)
+            if product_id is None:
+                raise ValidationError({"product": "A product id is required."})
+            queryset = queryset.filter(product_id=product_id)
+        return queryset
+
+
+class MetricsView(APIView):
+    """Per-route request metrics (see metrics.py) in the Prometheus text format."""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(exclude=True)
+    def get(self, request):
+        return HttpResponse(metrics_text(), content_type="text/plain; version=0.0.4; charset=utf-8")